@@ -7,19 +7,23 @@ Critical feature for WaveHacks 2 - Self-debugging code generation!
 import json
 import asyncio
 import weave
-from typing import Dict, Any, Optional
-from uuid import UUID, uuid4
+from typing import Dict, Any, Optional, Callable, Awaitable
+from uuid import UUID, uuid4, uuid5, NAMESPACE_URL
 from datetime import datetime
 
 from services.ai_service import call_qwen3_coder, extract_code_block, has_errors, call_google_learnlm
 from services.knowledge_service import explain_topic_with_sources
 from services.memory_service import (
-    load_student_memories,
-    load_learning_insights,
-    store_performance_metric
+    store_performance_metric,
+    upsert_memory,
+    PLATFORM_ENTITY_ID
 )
 from services.daytona_service import daytona_service
-from agents.evaluator import evaluator
+from services.fix_cache import fix_cache, error_signature, apply_edits
+from services.code_autofix import autofix_code, summarize_rewrites
+from services.checkpoint_service import load_checkpoints
+from services.pipeline_dag import PipelineDAG, add_evaluation_stages, evaluate_in_background
+from agents.evaluator import evaluator, EvaluationBatcher
 from db.supabase_client import supabase, get_student, get_tutor
 
 
@@ -78,7 +82,11 @@ async def generate_activity(
     duration: int = 20,
     lesson_id: Optional[str] = None,
     lesson_phase: Optional[str] = None,  # Renamed to class_section in UI, kept for API compatibility
-    max_attempts: int = 3
+    max_attempts: int = 3,
+    on_stage: Optional[Callable[[str], Awaitable[None]]] = None,
+    request_id: Optional[str] = None,
+    evaluation_mode: str = 'overlap',
+    evaluation_batcher: Optional[EvaluationBatcher] = None
 ) -> Dict[str, Any]:
     """
     Generate an interactive React activity with automatic error fixing
@@ -98,152 +106,217 @@ async def generate_activity(
         lesson_id: Optional lesson UUID this activity derives from
         lesson_phase: Which class section/activity (UI calls it "class_section")
         max_attempts: Max attempts to fix errors (default: 3)
+        on_stage: Optional async callback invoked with each pipeline stage name
+        request_id: Optional idempotency key; completed stages are checkpointed
+                    under it and skipped when the same request is retried
+        evaluation_mode: 'overlap' (evaluate the deployed code while it is
+                         stored, default), 'sync' (evaluate the deployed code
+                         before storing) or 'background' (self_evaluation
+                         patched later)
+        evaluation_batcher: Optional EvaluationBatcher shared by a batch job; the
+                            evaluation is packed into one call with its siblings
         
     Returns:
         Dict with activity content, sandbox URL, and evaluation
     """
     
+    checkpoints = await load_checkpoints(request_id, 'activity')
+    
     # AGENT HANDOFF: Load lesson context if creating from lesson
-    knowledge_context = None
-    if lesson_id:
-        print(f"\n🎮 Generating activity from Lesson...")
-        lesson_context = await load_lesson_context(lesson_id, lesson_phase)
+    async def load_lesson(results):
+        activity_topic = topic
+        description = activity_description
+        knowledge_context = None
+        if lesson_id:
+            print(f"\n🎮 Generating activity from Lesson...")
+            lesson_context = await load_lesson_context(lesson_id, lesson_phase)
+            
+            # Extract everything from lesson (no API calls needed!)
+            activity_topic = lesson_context.get('topic', activity_topic) or activity_topic
+            knowledge_context = {
+                'explanation': lesson_context.get('explanation', ''),
+                'sources': lesson_context.get('sources', [])
+            }
+            
+            # Auto-fill activity description if not provided
+            if not description:
+                description = lesson_context.get('activity_description', 
+                    f"Interactive activity for {activity_topic}")
+            
+            print(f"   ✅ Retrieved lesson context (topic: {activity_topic})")
+            print(f"   ✅ Found {len(knowledge_context['sources'])} sources from lesson")
+            print(f"   Activity: {description[:80]}...")
+        else:
+            print(f"\n🎮 Generating standalone interactive activity...")
+            if not activity_topic or not description:
+                raise ValueError("Topic and activity_description required for standalone activity")
         
-        # Extract everything from lesson (no API calls needed!)
-        topic = lesson_context.get('topic', topic) or topic
-        knowledge_context = {
-            'explanation': lesson_context.get('explanation', ''),
-            'sources': lesson_context.get('sources', [])
+        return {
+            'topic': activity_topic,
+            'activity_description': description,
+            'knowledge_context': knowledge_context
         }
+    
+    # Step 1: Load student and tutor data (runs alongside the lesson lookup)
+    async def load_profile(results):
+        student = await get_student(student_id)
+        tutor = await get_tutor(tutor_id)
         
-        # Auto-fill activity description if not provided
-        if not activity_description:
-            activity_description = lesson_context.get('activity_description', 
-                f"Interactive activity for {topic}")
+        if not student:
+            raise ValueError(f"Student {student_id} not found")
+        if not tutor:
+            raise ValueError(f"Tutor {tutor_id} not found")
         
-        print(f"   ✅ Retrieved lesson context (topic: {topic})")
-        print(f"   ✅ Found {len(knowledge_context['sources'])} sources from lesson")
-        print(f"   Activity: {activity_description[:80]}...")
-    else:
-        print(f"\n🎮 Generating standalone interactive activity...")
-        if not topic or not activity_description:
-            raise ValueError("Topic and activity_description required for standalone activity")
-    
-    # Step 1: Load student and tutor data
-    student = await get_student(student_id)
-    tutor = await get_tutor(tutor_id)
-    
-    if not student:
-        raise ValueError(f"Student {student_id} not found")
-    if not tutor:
-        raise ValueError(f"Tutor {tutor_id} not found")
-    
-    print(f"   Student: {student['name']} (Grade {student['grade']})")
-    print(f"   Request: {activity_description[:80]}...")
-    
-    # Step 2: Load memories and insights
-    memories = await load_student_memories(student_id, limit=10)
-    insights = await load_learning_insights(student['grade'], topic, limit=5)
-    
-    # Step 3: Get knowledge context (from lesson OR call Layer 1 for standalone)
-    if not knowledge_context:  # Only for standalone activities
-        print(f"   🔍 Researching topic (standalone mode)...")
-        knowledge_context = await explain_topic_with_sources(
-            topic=topic,
-            grade=student['grade'],
-            subject=student.get('subject', 'General')
+        print(f"   Student: {student['name']} (Grade {student['grade']})")
+        return {'student': student, 'tutor': tutor}
+    
+    # Step 2: Get knowledge context (from lesson OR call Layer 1 for standalone)
+    async def research(results):
+        knowledge_context = results['lesson']['knowledge_context']
+        if not knowledge_context:  # Only for standalone activities
+            student = results['profile']['student']
+            print(f"   🔍 Researching topic (standalone mode)...")
+            knowledge_context = await explain_topic_with_sources(
+                topic=results['lesson']['topic'],
+                grade=student['grade'],
+                subject=student.get('subject', 'General')
+            )
+            print(f"   Found {len(knowledge_context.get('sources', []))} sources")
+        # else: Already loaded from lesson!
+        return knowledge_context
+    
+    # Step 3: Generate React code using Qwen3 Coder (via W&B Inference)
+    async def draft(results):
+        print(f"   💻 Generating React code with Qwen3 Coder 480B...")
+        code = await generate_react_activity_code(
+            topic=results['lesson']['topic'],
+            grade=results['profile']['student']['grade'],
+            activity_description=results['lesson']['activity_description'],
+            knowledge_context=results['research'],
+            student=results['profile']['student']
         )
-        print(f"   Found {len(knowledge_context.get('sources', []))} sources")
-    # else: Already loaded from lesson!
-    
-    # Step 4: Generate React code using Qwen3 Coder (via W&B Inference)
-    print(f"   💻 Generating React code with Qwen3 Coder 480B...")
-    code = await generate_react_activity_code(
-        topic=topic,
-        grade=student['grade'],
-        activity_description=activity_description,
-        knowledge_context=knowledge_context,
-        student=student
-    )
-    
-    print(f"   ✅ Generated {len(code)} characters of React code")
-    
-    # Step 5: Deploy with automatic error fixing (THE MAGIC!)
-    print(f"   🚀 Deploying to Daytona sandbox (max {max_attempts} attempts)...")
-    deployment = await deploy_with_auto_fix(
-        code=code,
-        topic=topic,
-        student_id=student_id,
-        max_attempts=max_attempts
-    )
-    
-    # Step 6: Build activity record
-    activity_content = {
-        "type": "interactive",
-        "title": f"Interactive {topic} Activity",
-        "description": activity_description,
-        "topic": topic,
-        "duration": duration,
-        "code": deployment['code'],
-        "language": "javascript",
-        "sandbox_id": deployment.get('sandbox_id'),
-        "sandbox_url": deployment.get('url'),
-        "deployment_status": deployment['status'],
-        "attempts_needed": deployment['attempts']
-    }
-    
-    # Step 7: Self-evaluate (includes code quality assessment)
-    print("   🔍 Self-evaluating activity...")
-    evaluation = await evaluator.evaluate_activity(
-        activity=activity_content,
-        student=student,
-        deployment_status=deployment['status']
-    )
-    
-    print(f"   📊 Overall Score: {evaluation['overall_score']}/10")
-    if deployment['status'] == 'success':
-        print(f"   ✅ Deployed successfully on attempt {deployment['attempts']}")
-        print(f"   🌐 Sandbox URL: {deployment['url']}")
-    else:
-        print(f"   ❌ Failed after {deployment['attempts']} attempts")
-    
-    # Step 8: Store in database
-    activity_id = uuid4()
-    activity_record = {
-        'id': str(activity_id),
-        'tutor_id': tutor_id,
-        'student_id': student_id,
-        'lesson_id': lesson_id,
-        'title': f"{topic} - Interactive Activity",
-        'type': 'interactive',
-        'duration': duration,
-        'content': activity_content,
-        'code': deployment['code'],
-        'language': 'javascript',
-        'sandbox_id': deployment.get('sandbox_id'),
-        'sandbox_url': deployment.get('url'),
-        'self_evaluation': evaluation,
-        'created_at': datetime.now().isoformat(),
-        'updated_at': datetime.now().isoformat()
-    }
-    
-    supabase.table('activities').insert(activity_record).execute()
-    print(f"   ✅ Activity stored (ID: {activity_id})")
+        print(f"   ✅ Generated {len(code)} characters of React code")
+        return code
+    
+    # Step 4: Deploy with automatic error fixing (THE MAGIC!)
+    async def deploy(results):
+        print(f"   🚀 Deploying to Daytona sandbox (max {max_attempts} attempts)...")
+        deployment = await deploy_with_auto_fix(
+            code=results['draft'],
+            topic=results['lesson']['topic'],
+            student_id=student_id,
+            max_attempts=max_attempts
+        )
+        if deployment['status'] == 'success':
+            print(f"   ✅ Deployed successfully on attempt {deployment['attempts']}")
+            print(f"   🌐 Sandbox URL: {deployment['url']}")
+        else:
+            print(f"   ❌ Failed after {deployment['attempts']} attempts")
+        return deployment
+    
+    # Step 5: Build activity record
+    def build_content(results):
+        deployment = results['deployment']
+        return {
+            "type": "interactive",
+            "title": f"Interactive {results['lesson']['topic']} Activity",
+            "description": results['lesson']['activity_description'],
+            "topic": results['lesson']['topic'],
+            "duration": duration,
+            "code": deployment['code'],
+            "language": "javascript",
+            "sandbox_id": deployment.get('sandbox_id'),
+            "sandbox_url": deployment.get('url'),
+            "deployment_status": deployment['status'],
+            "attempts_needed": deployment['attempts'],
+            "autofix_rewrites": summarize_rewrites(deployment.get('autofix_rewrites', []))
+        }
     
-    # Step 9: Store performance metric
-    await store_performance_metric(
-        agent_type='activity_creator',
-        evaluation=evaluation,
-        session_id=str(activity_id)
+    # Step 6: Self-evaluate (includes code quality assessment)
+    async def evaluate(results):
+        print("   🔍 Self-evaluating activity...")
+        content = build_content(results)
+        if evaluation_batcher:
+            evaluation = await evaluation_batcher.evaluate(
+                content, results['profile']['student'],
+                extra={'deployment_status': content['deployment_status']}
+            )
+        else:
+            evaluation = await evaluator.evaluate_activity(
+                activity=content,
+                student=results['profile']['student'],
+                deployment_status=content['deployment_status']
+            )
+        print(f"   📊 Overall Score: {evaluation['overall_score']}/10")
+        return evaluation
+    
+    # Step 7: Store in database (overlaps with evaluation)
+    async def persist(results):
+        # Deterministic id + upsert keeps a retried persistence stage from duplicating rows
+        activity_id = uuid5(NAMESPACE_URL, f"activity:{request_id}") if request_id else uuid4()
+        deployment = results['deployment']
+        activity_record = {
+            'id': str(activity_id),
+            'tutor_id': tutor_id,
+            'student_id': student_id,
+            'lesson_id': lesson_id,
+            'title': f"{results['lesson']['topic']} - Interactive Activity",
+            'type': 'interactive',
+            'duration': duration,
+            'content': build_content(results),
+            'code': deployment['code'],
+            'language': 'javascript',
+            'sandbox_id': deployment.get('sandbox_id'),
+            'sandbox_url': deployment.get('url'),
+            'created_at': datetime.now().isoformat(),
+            'updated_at': datetime.now().isoformat()
+        }
+        
+        supabase.table('activities').upsert(activity_record).execute()
+        print(f"   ✅ Activity stored (ID: {activity_id})")
+        return {'activity_id': str(activity_id)}
+    
+    # Step 8: Attach the evaluation and store the performance metric
+    async def finalize(results):
+        activity_id = results['persistence']['activity_id']
+        supabase.table('activities')\
+            .update({'self_evaluation': results['evaluation']})\
+            .eq('id', activity_id)\
+            .execute()
+        
+        await store_performance_metric(
+            agent_type='activity_creator',
+            evaluation=results['evaluation'],
+            session_id=activity_id
+        )
+        return {'activity_id': activity_id}
+    
+    dag = PipelineDAG('activity')\
+        .add('lesson', load_lesson)\
+        .add('profile', load_profile)\
+        .add('research', research, depends_on=['lesson', 'profile'])\
+        .add('draft', draft, depends_on=['lesson', 'profile', 'research'])\
+        .add('deployment', deploy, depends_on=['lesson', 'draft'])
+    # The rubric scores code quality and deployment, so evaluation always waits for the
+    # deployed (auto-fixed) code and final status; overlap runs it alongside persistence
+    add_evaluation_stages(
+        dag, evaluation_mode, evaluate, persist, finalize,
+        evaluate_after=['lesson', 'profile', 'deployment'],
+        persist_after=['lesson', 'deployment']
     )
+    results = await dag.run(checkpoints, on_stage)
+    if evaluation_mode == 'background':
+        evaluate_in_background(results, evaluate, finalize, checkpoints, label='activity evaluation')
     
     return {
-        'activity_id': str(activity_id),
-        'content': activity_content,
-        'evaluation': evaluation,
-        'deployment': deployment,
-        'student': student,
-        'tutor': tutor
+        'activity_id': results['persistence']['activity_id'],
+        'content': build_content(results),
+        'evaluation': results.get('evaluation'),  # None until the background evaluation lands
+        'evaluation_status': 'pending' if evaluation_mode == 'background' else 'complete',
+        'deployment': results['deployment'],
+        'student': results['profile']['student'],
+        'tutor': results['profile']['tutor'],
+        'timings': dag.timings
     }
 
 
@@ -468,12 +541,29 @@ async def deploy_with_auto_fix(
         max_attempts: Maximum fix attempts
         
     Returns:
-        Dict with status, sandbox_id, url, attempts, final code
+        Dict with status, sandbox_id, url, attempts, final code, how many fixes
+        came from the fix cache and the deterministic rewrites applied
     """
+    pending_fix = None  # Fix applied before this attempt: recorded once we see the result
+    tried_fixes = set()
+    cached_fixes = 0
+    autofix_rewrites = []
+    
     for attempt in range(1, max_attempts + 1):
         try:
             print(f"\n      🔄 Deployment attempt {attempt}/{max_attempts}...")
             
+            # Rule-based rewrites first (generated and fixed code alike): defects we can
+            # fix locally shouldn't cost a deploy/fix cycle
+            autofix = autofix_code(code)
+            if autofix['changed']:
+                code = autofix['code']
+                autofix_rewrites.extend({**rewrite, 'attempt': attempt} for rewrite in autofix['rewrites'])
+                summary = ', '.join(f"{rule} ×{count}" for rule, count in summarize_rewrites(autofix['rewrites']).items())
+                print(f"      🪛 Auto-fixed before deploy: {summary}")
+            for issue in autofix['unresolved']:
+                print(f"      ⚠️ Auto-fix left: {issue}")
+            
             # Deploy to Daytona sandbox with complete Vite + React setup
             sandbox = await daytona_service.create_and_deploy_react_app(
                 code=code,
@@ -490,7 +580,12 @@ async def deploy_with_auto_fix(
                 error_logs = sandbox.get('logs', '')
             
             # Check if sandbox has errors
-            if sandbox['status'] == 'running' and not has_errors(error_logs if error_logs else ''):
+            deployed = sandbox['status'] == 'running' and not has_errors(error_logs if error_logs else '')
+            if pending_fix:
+                await fix_cache.record(**pending_fix, success=deployed)
+                pending_fix = None
+            
+            if deployed:
                 # SUCCESS!
                 print(f"      ✅ Deployed successfully on attempt {attempt}!")
                 return {
@@ -500,7 +595,9 @@ async def deploy_with_auto_fix(
                     "attempts": attempt,
                     "code": code,
                     "session_id": sandbox.get('session_id'),
-                    "dev_command_id": sandbox.get('dev_command_id')
+                    "dev_command_id": sandbox.get('dev_command_id'),
+                    "cached_fixes": cached_fixes,
+                    "autofix_rewrites": autofix_rewrites
                 }
             
             # Errors found - try to fix if we have attempts left
@@ -509,19 +606,37 @@ async def deploy_with_auto_fix(
             
             if attempt < max_attempts:
                 print(f"      🔧 Attempting to auto-fix code...")
+                signature = error_signature(str(error_logs))
                 
-                # Use Qwen3 to fix the errors
-                fixed_code = await fix_code_errors(
-                    original_code=code,
-                    error_logs=str(error_logs),
-                    topic=topic,
-                    attempt_number=attempt
-                )
+                # Known fix for this exact error signature: replay it without a model call
+                fixed_code = None
+                for known in fix_cache.known_fixes(signature):
+                    if known['key'] in tried_fixes:
+                        continue
+                    tried_fixes.add(known['key'])
+                    fixed_code = apply_edits(code, known['edits'])
+                    if fixed_code and fixed_code != code:
+                        cached_fixes += 1
+                        print(f"      ⚡ Replayed cached fix ({known.get('successes', 0)} past successes)")
+                        break
+                    fixed_code = None
                 
-                print(f"      ✅ Generated fix (diff: {len(fixed_code) - len(code):+d} chars)")
+                if fixed_code is None:
+                    # Use Qwen3 to fix the errors (closest past fix as a worked example)
+                    fixed_code = await fix_code_errors(
+                        original_code=code,
+                        error_logs=str(error_logs),
+                        topic=topic,
+                        attempt_number=attempt,
+                        past_fix=fix_cache.closest_example(signature)
+                    )
+                    
+                    print(f"      ✅ Generated fix (diff: {len(fixed_code) - len(code):+d} chars)")
+                    
+                    # Store fix attempt for learning
+                    await store_code_fix_attempt(code, fixed_code, str(error_logs), attempt)
                 
-                # Store fix attempt for learning
-                await store_code_fix_attempt(code, fixed_code, str(error_logs), attempt)
+                pending_fix = {'signature': signature, 'original': code, 'fixed': fixed_code}
                 
                 # Use fixed code for next attempt
                 code = fixed_code
@@ -542,7 +657,8 @@ async def deploy_with_auto_fix(
                     "status": "failed",
                     "attempts": attempt,
                     "error_logs": str(error_logs)[:500] if error_logs else "Unknown error",
-                    "code": code
+                    "code": code,
+                    "autofix_rewrites": autofix_rewrites
                 }
                 
         except Exception as e:
@@ -554,13 +670,14 @@ async def deploy_with_auto_fix(
                     "status": "failed",
                     "attempts": attempt,
                     "error": str(e),
-                    "code": code
+                    "code": code,
+                    "autofix_rewrites": autofix_rewrites
                 }
             # Retry
             await asyncio.sleep(2)
     
     # Should never reach here
-    return {"status": "failed", "attempts": max_attempts, "code": code}
+    return {"status": "failed", "attempts": max_attempts, "code": code, "autofix_rewrites": autofix_rewrites}
 
 
 @weave.op()
@@ -568,9 +685,15 @@ async def fix_code_errors(
     original_code: str,
     error_logs: str,
     topic: str,
-    attempt_number: int
+    attempt_number: int,
+    past_fix: Optional[Dict[str, Any]] = None
 ) -> str:
-    """Use Qwen3 Coder to fix errors in generated code"""
+    """
+    Use Qwen3 Coder to fix errors in generated code
+    
+    Args:
+        past_fix: Fix cache entry for the most similar past error (few-shot example)
+    """
     
     # Truncate code and logs to avoid token limits
     code_preview = original_code[:2000]
@@ -579,6 +702,18 @@ async def fix_code_errors(
     
     error_preview = error_logs[:800]
     
+    # Worked example from the fix cache
+    past_fix_section = ""
+    if past_fix:
+        past_fix_section = f"""
+A SIMILAR ERROR WAS FIXED BEFORE (the deployment succeeded afterwards):
+Error: {past_fix.get('signature', '')}
+Fix:
+```diff
+{past_fix.get('example', '')}
+```
+"""
+    
     prompt = f"""You are debugging React code that was deployed to a sandbox and encountered errors.
 
 ORIGINAL TOPIC: {topic}
@@ -593,7 +728,7 @@ ERROR LOGS FROM SANDBOX:
 ```
 {error_preview}
 ```
-
+{past_fix_section}
 ---
 
 **YOUR TASK**: Fix the code to eliminate ALL errors while maintaining the educational and interactive experience.
@@ -667,26 +802,29 @@ async def store_code_fix_attempt(
         elif "Failed to compile" in error_logs:
             error_type = "compilation"
         
-        memory_record = {
-            'entity_type': 'content',
-            'entity_id': str(uuid4()),
-            'memory_category': 'code_debugging',
-            'memory_key': 'fix_attempt',
-            'memory_value': {
+        # One row per error type: repeats bump update_count and the running totals
+        await upsert_memory(
+            entity_type='platform',
+            entity_id=PLATFORM_ENTITY_ID,
+            memory_category='code_debugging',
+            memory_key=f"fix_attempt_{error_type}",
+            memory_value={
                 'error_type': error_type,
-                'attempt_number': attempt,
-                'code_length_change': len(fixed_code) - len(original_code),
+                'last_attempt_number': attempt,
+                'last_code_length_change': len(fixed_code) - len(original_code),
                 'had_error_keywords': {
                     'syntax': 'Syntax' in error_logs,
                     'type': 'Type' in error_logs,
                     'reference': 'Reference' in error_logs
                 }
             },
-            'confidence_score': 0.6,  # Will update based on success
-            'created_at': datetime.now().isoformat()
-        }
-        
-        supabase.table('platform_memory').insert(memory_record).execute()
+            confidence_score=0.6,  # Will update based on success
+            accumulate={
+                'attempts': 1,
+                'attempt_number_total': attempt,
+                'code_length_change_total': len(fixed_code) - len(original_code)
+            }
+        )
         print(f"         💾 Stored fix attempt for learning")
         
     except Exception as e:
@@ -758,6 +896,9 @@ Return ONLY the complete React component code in a code block. NO explanations,
         if new_code.startswith('jsx') or new_code.startswith('javascript'):
             new_code = '\n'.join(new_code.split('\n')[1:])
     
+    # Same deterministic rewrites as the deploy path
+    new_code = autofix_code(new_code)['code']
+    
     # Identify changes
     changes_prompt = f"""Briefly describe what changed between these two code versions in 1-2 sentences:
 
@@ -4,20 +4,165 @@ Evaluates generated content (strategies, lessons, activities)
 Critical for self-improvement loop
 """
 
+import re
 import json
+import asyncio
 import weave
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Callable
 from services.ai_service import call_google_learnlm
+from services.evaluation_cache import evaluation_cache, evaluation_cache_key
+from services.strategy_index import html_to_text
+from agents.heuristic_evaluator import heuristic_evaluator
+
+# Bump whenever the prompts/criteria below change: cached scores and stored
+# evaluations are only comparable within one rubric version
+RUBRIC_VERSION = "1"
+
+# Artifacts packed into one batched evaluation call
+BATCH_SIZE = 4
+
+# Criteria per content type (descriptions mirror the evaluation prompts)
+RUBRIC_CRITERIA = {
+    'strategy': {
+        'pedagogical_soundness': 'Follows learning science principles (scaffolding, spacing, active recall)',
+        'cultural_appropriateness': "Respects student's cultural background",
+        'engagement_potential': 'Likely to maintain student interest',
+        'clarity': 'Clear learning objectives and outcomes',
+        'feasibility': 'Realistic within time and resource constraints',
+        'progression': 'Appropriate scaffolding and difficulty curve'
+    },
+    'lesson': {
+        'pedagogical_soundness': 'Follows active learning principles and learning science',
+        'content_quality': 'Accurate, well-researched, uses credible sources',
+        'engagement': 'Likely to maintain student attention and motivation',
+        'differentiation': 'Addresses diverse learning needs and styles',
+        'clarity': 'Clear structure, objectives, and instructions',
+        'feasibility': 'Realistic within time and resource constraints'
+    },
+    'activity': {
+        'educational_value': 'Clear learning objectives with active learning principles',
+        'engagement': 'Strong hooks, gamification, intrinsic motivation',
+        'interactivity': 'Multiple interactive elements with immediate feedback',
+        'creativity': 'Innovative approach that makes learning fun and memorable',
+        'code_quality': 'Clean code, responsive design, no bugs',
+        'feasibility': 'Appropriate for grade level and time constraints'
+    }
+}
+
+# Student profile fields each prompt reads (part of the cache key)
+STUDENT_FIELDS = {
+    'strategy': ('grade', 'learning_style', 'interests', 'nationality'),
+    'lesson': ('grade', 'learning_style', 'interests'),
+    'activity': ('grade', 'learning_style', 'interests')
+}
+
+# Section keyword → criteria an edit to that section can move
+SECTION_CRITERIA = {
+    'strategy': [
+        (('philosoph', 'approach'), ['pedagogical_soundness', 'engagement_potential']),
+        (('big idea', 'essential question'), ['clarity', 'engagement_potential']),
+        (('week', 'progression', 'scaffold'), ['progression', 'pedagogical_soundness', 'clarity']),
+        (('assessment', 'success indicator'), ['pedagogical_soundness', 'clarity']),
+        (('different', 'cultur', 'adaptation'), ['cultural_appropriateness', 'engagement_potential']),
+        (('resource', 'knowledge'), ['feasibility', 'pedagogical_soundness']),
+        (('reflection', 'metacognition'), ['engagement_potential', 'pedagogical_soundness'])
+    ],
+    'lesson': [
+        (('objective', 'overview', 'title'), ['clarity', 'pedagogical_soundness']),
+        (('activit', 'engage', 'explore', 'explain', 'elaborate', 'phase'),
+         ['engagement', 'pedagogical_soundness', 'feasibility']),
+        (('evaluat', 'assessment'), ['pedagogical_soundness', 'clarity']),
+        (('reading', 'source', 'study guide', 'concept'), ['content_quality', 'clarity']),
+        (('different', 'cultur', 'adaptation'), ['differentiation', 'engagement']),
+        (('homework', 'pre-class', 'pre_class', 'preparation'), ['feasibility', 'engagement']),
+        (('material',), ['feasibility'])
+    ]
+}
 
 
 class SelfEvaluator:
     """Agent that evaluates its own outputs"""
     
+    def __init__(self):
+        self.inflight = 0  # LLM evaluations currently running (the sampler backs off under load)
+    
+    async def _prepare(
+        self,
+        content_type: str,
+        content: Dict[str, Any],
+        student: Dict[str, Any],
+        extra: Optional[Dict[str, Any]] = None,
+        heuristic_context: Optional[Dict[str, Any]] = None,
+        force_llm: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Resolve an evaluation without the LLM where possible
+        
+        Returns:
+            {'evaluation': ...} for cache hits and heuristic-only results, otherwise
+            {'key', 'heuristic', 'reason'} for an item that still needs the LLM
+        """
+        key = evaluation_cache_key(
+            content_type, content, student, STUDENT_FIELDS[content_type], RUBRIC_VERSION, extra
+        )
+        cached = await evaluation_cache.get(key)
+        if cached:
+            print(f"   ♻️ Reusing cached {content_type} evaluation (rubric v{RUBRIC_VERSION})")
+            return {'evaluation': {**cached, 'cached': True}}
+        
+        heuristic = heuristic_evaluator.score(content_type, content, **(heuristic_context or {}))
+        use_llm, reason = (True, "forced") if force_llm else heuristic_evaluator.needs_llm(content_type, heuristic, self.inflight)
+        
+        if not use_llm:
+            print(f"   ⚡ Heuristic {content_type} evaluation ({reason}): {heuristic['prior_score']}/10")
+            evaluation = heuristic_evaluator.to_evaluation(content_type, heuristic, list(RUBRIC_CRITERIA[content_type]))
+            evaluation['rubric_version'] = RUBRIC_VERSION
+            return {'evaluation': evaluation}  # Not cached: a later sample may still pay for the LLM score
+        
+        return {'key': key, 'heuristic': heuristic, 'reason': reason}
+    
+    async def _finish(self, content_type: str, pending: Dict[str, Any], evaluation: Dict[str, Any]) -> Dict[str, Any]:
+        """Tag an LLM evaluation, feed the calibration and cache it"""
+        evaluation['rubric_version'] = RUBRIC_VERSION
+        evaluation['source'] = 'llm'
+        evaluation['heuristic'] = {**pending['heuristic'], 'sampling_reason': pending['reason']}
+        heuristic_evaluator.observe(content_type, pending['heuristic'], evaluation)
+        
+        if not evaluation.get('parse_failed'):
+            await evaluation_cache.put(pending['key'], content_type, RUBRIC_VERSION, evaluation)
+        return evaluation
+    
+    async def _evaluate_cached(
+        self,
+        content_type: str,
+        content: Dict[str, Any],
+        student: Dict[str, Any],
+        build_prompt: Callable[[], str],
+        extra: Optional[Dict[str, Any]] = None,
+        heuristic_context: Optional[Dict[str, Any]] = None,
+        force_llm: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Return the cached evaluation for identical content; otherwise score it locally
+        and only call the LLM when the sampling policy asks for it
+        """
+        pending = await self._prepare(content_type, content, student, extra, heuristic_context, force_llm)
+        if 'evaluation' in pending:
+            return pending['evaluation']
+        
+        self.inflight += 1
+        try:
+            response = await call_google_learnlm(build_prompt(), temperature=0.3, max_tokens=1500)
+        finally:
+            self.inflight -= 1
+        return await self._finish(content_type, pending, self._parse_evaluation(response))
+    
     @weave.op()
     async def evaluate_strategy(
         self,
         strategy: Dict[str, Any],
-        student: Dict[str, Any]
+        student: Dict[str, Any],
+        force_llm: bool = False
     ) -> Dict[str, Any]:
         """
         Self-evaluate a generated strategy
@@ -25,39 +170,340 @@ class SelfEvaluator:
         Args:
             strategy: Strategy content dict
             student: Student profile dict
+            force_llm: Skip the heuristic sampling policy
             
         Returns:
             Evaluation dict with scores and feedback
         """
-        prompt = self._build_strategy_eval_prompt(strategy, student)
-        response = await call_google_learnlm(prompt, temperature=0.3, max_tokens=1500)
-        
-        return self._parse_evaluation(response)
+        return await self._evaluate_cached(
+            'strategy', strategy, student,
+            lambda: self._build_strategy_eval_prompt(strategy, student),
+            force_llm=force_llm
+        )
     
     @weave.op()
     async def evaluate_lesson(
         self,
         lesson: Dict[str, Any],
-        student: Dict[str, Any]
+        student: Dict[str, Any],
+        duration: Optional[int] = None,
+        sources: Optional[List[Dict]] = None,
+        force_llm: bool = False
     ) -> Dict[str, Any]:
-        """Self-evaluate a generated lesson"""
-        prompt = self._build_lesson_eval_prompt(lesson, student)
-        response = await call_google_learnlm(prompt, temperature=0.3, max_tokens=1500)
+        """
+        Self-evaluate a generated lesson
         
-        return self._parse_evaluation(response)
+        Args:
+            duration: Requested lesson length (minutes) the activities should add up to
+            sources: Research sources the lesson was meant to link
+        """
+        return await self._evaluate_cached(
+            'lesson', lesson, student,
+            lambda: self._build_lesson_eval_prompt(lesson, student),
+            heuristic_context={'duration': duration, 'sources': sources},
+            force_llm=force_llm
+        )
     
     @weave.op()
     async def evaluate_activity(
         self,
         activity: Dict[str, Any],
         student: Dict[str, Any],
-        deployment_status: str = "success"
+        deployment_status: str = "success",
+        force_llm: bool = False
     ) -> Dict[str, Any]:
         """Self-evaluate a generated activity (including code quality)"""
-        prompt = self._build_activity_eval_prompt(activity, student, deployment_status)
-        response = await call_google_learnlm(prompt, temperature=0.3, max_tokens=1500)
+        return await self._evaluate_cached(
+            'activity', activity, student,
+            lambda: self._build_activity_eval_prompt(activity, student, deployment_status),
+            extra={'deployment_status': deployment_status},
+            force_llm=force_llm
+        )
+    
+    def _build_item_prompt(self, content_type: str, item: Dict[str, Any]) -> str:
+        """Single-item evaluation prompt for a batch item"""
+        if content_type == 'strategy':
+            return self._build_strategy_eval_prompt(item['content'], item['student'])
+        if content_type == 'lesson':
+            return self._build_lesson_eval_prompt(item['content'], item['student'])
+        status = (item.get('extra') or {}).get('deployment_status', 'success')
+        return self._build_activity_eval_prompt(item['content'], item['student'], status)
+    
+    async def _evaluate_single(self, content_type: str, item: Dict[str, Any], pending: Dict[str, Any]) -> Dict[str, Any]:
+        """One LLM call for a prepared batch item"""
+        self.inflight += 1
+        try:
+            response = await call_google_learnlm(
+                self._build_item_prompt(content_type, item), temperature=0.3, max_tokens=1500
+            )
+        finally:
+            self.inflight -= 1
+        return await self._finish(content_type, pending, self._parse_evaluation(response))
+    
+    @weave.op()
+    async def evaluate_batch(
+        self,
+        content_type: str,
+        items: List[Dict[str, Any]],
+        max_batch: int = BATCH_SIZE,
+        force_llm: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Evaluate several artifacts of one type with one LLM call per chunk
+        
+        Cache hits and heuristic-only results are resolved first; the rest are packed
+        into a single prompt returning a per-item array. Items missing from (or
+        unparseable in) the batched response fall back to individual calls.
+        
+        Args:
+            content_type: 'strategy', 'lesson' or 'activity'
+            items: Dicts with 'content', 'student' and optionally 'extra'
+                   (activity: deployment_status) and 'heuristic_context' (lesson: duration, sources)
+            max_batch: Items per LLM call
+            force_llm: Skip the heuristic sampling policy (cache hits are still reused)
+            
+        Returns:
+            Evaluations in the order of `items`
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        pending = []
+        for index, item in enumerate(items):
+            prepared = await self._prepare(
+                content_type, item['content'], item['student'],
+                item.get('extra'), item.get('heuristic_context'), force_llm
+            )
+            if 'evaluation' in prepared:
+                results[index] = prepared['evaluation']
+            else:
+                pending.append((index, prepared))
+        
+        for start in range(0, len(pending), max_batch):
+            chunk = pending[start:start + max_batch]
+            if len(chunk) == 1:
+                index, prepared = chunk[0]
+                results[index] = await self._evaluate_single(content_type, items[index], prepared)
+                continue
+            
+            prompt = self._build_batch_eval_prompt(content_type, [items[index] for index, _ in chunk])
+            
+            self.inflight += 1
+            try:
+                response = await call_google_learnlm(prompt, temperature=0.3, max_tokens=1200 * len(chunk))
+                parsed = self._parse_batch_evaluation(response, len(chunk))
+            except Exception as e:
+                print(f"⚠️ Batched {content_type} evaluation failed: {str(e)}")
+                parsed = [None] * len(chunk)
+            finally:
+                self.inflight -= 1
+            
+            print(f"   📦 Batched {content_type} evaluation: {sum(1 for e in parsed if e)}/{len(chunk)} items in one call")
+            fallbacks = []
+            for (index, prepared), evaluation in zip(chunk, parsed):
+                if evaluation:
+                    results[index] = await self._finish(content_type, prepared, evaluation)
+                else:
+                    fallbacks.append((index, prepared))
+            
+            # Items the batched response lost get their own calls
+            singles = await asyncio.gather(*(
+                self._evaluate_single(content_type, items[index], prepared) for index, prepared in fallbacks
+            ))
+            for (index, _), evaluation in zip(fallbacks, singles):
+                results[index] = evaluation
+        
+        return results
+    
+    @weave.op()
+    async def evaluate_edit(
+        self,
+        content_type: str,
+        old_content: Dict[str, Any],
+        new_content: Dict[str, Any],
+        student: Dict[str, Any],
+        previous_evaluation: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Re-score only the criteria an edit can affect
+        
+        Args:
+            content_type: 'strategy' or 'lesson'
+            old_content: Content the previous evaluation scored
+            new_content: Edited content
+            previous_evaluation: Evaluation of old_content (criteria + overall_score)
+            
+        Returns:
+            Evaluation delta (rescored criteria, changed sections, new overall score),
+            or None when no section changed
+        """
+        changed = changed_sections(old_content, new_content)
+        if not changed:
+            return None
+        
+        criteria = affected_criteria(content_type, changed)
+        previous_criteria = previous_evaluation.get('criteria') or {}
+        full_rescore = len(criteria) == len(RUBRIC_CRITERIA[content_type]) or not previous_criteria
+        
+        if full_rescore:
+            evaluate = self.evaluate_strategy if content_type == 'strategy' else self.evaluate_lesson
+            evaluation = await evaluate(new_content, student, force_llm=True)
+            rescored = evaluation.get('criteria', {})
+        else:
+            prompt = self._build_partial_eval_prompt(content_type, new_content, student, criteria, changed)
+            response = await call_google_learnlm(prompt, temperature=0.3, max_tokens=800)
+            rescored = self._parse_criteria(response, criteria)
+            if not rescored:
+                return None
+        
+        merged = {**previous_criteria, **rescored}
+        scores = [c['score'] for c in merged.values() if isinstance(c, dict) and 'score' in c]
+        overall = round(sum(scores) / len(scores), 1) if scores else previous_evaluation.get('overall_score')
+        
+        print(f"   🔁 Re-scored {len(rescored)} criteria after edit ({', '.join(changed[:4])}): "
+              f"{previous_evaluation.get('overall_score')} → {overall}")
+        
+        return {
+            'rubric_version': RUBRIC_VERSION,
+            'full_rescore': full_rescore,
+            'changed_sections': changed,
+            'criteria': {
+                name: {**value, 'previous_score': (previous_criteria.get(name) or {}).get('score')}
+                for name, value in rescored.items()
+            },
+            'previous_overall_score': previous_evaluation.get('overall_score'),
+            'overall_score': overall
+        }
+    
+    def _build_partial_eval_prompt(
+        self,
+        content_type: str,
+        content: Dict,
+        student: Dict,
+        criteria: List[str],
+        changed: List[str]
+    ) -> str:
+        """Build a prompt that scores only the given criteria"""
+        criteria_lines = '\n'.join(
+            f"- **{name}**: {RUBRIC_CRITERIA[content_type][name]}" for name in criteria
+        )
+        example = ', '.join(f'"{name}": {{"score": 7, "reasoning": "..."}}' for name in criteria)
+        
+        return f"""You are a pedagogical expert re-evaluating an AI-generated {content_type} that a tutor just edited.
+
+EDITED SECTIONS: {', '.join(changed[:10])}
+
+{content_type.upper()} TO EVALUATE:
+{json.dumps(content, indent=2)[:2000]}...
+
+STUDENT CONTEXT:
+- Grade: {student.get('grade')}
+- Learning Style: {student.get('learning_style', 'Mixed')}
+- Interests: {', '.join(student.get('interests', []))}
+
+---
+
+Re-score ONLY these criteria (1-10, with 1-2 sentence reasoning). Be CRITICAL.
+{criteria_lines}
+
+Return ONLY valid JSON:
+{{"criteria": {{{example}}}}}
+"""
+    
+    def _parse_criteria(self, response: str, expected: List[str]) -> Dict[str, Any]:
+        """Parse a partial {"criteria": {...}} response, keeping only expected criteria"""
+        match = re.search(r'\{.*\}', response.strip(), re.DOTALL)
+        if not match:
+            print("⚠️ Could not find JSON in partial evaluation")
+            return {}
+        
+        try:
+            parsed = json.loads(match.group(0))
+        except json.JSONDecodeError as e:
+            print(f"⚠️ Partial evaluation parsing failed: {str(e)[:100]}")
+            return {}
+        
+        criteria = parsed.get('criteria', parsed)
+        result = {}
+        for name in expected:
+            value = criteria.get(name)
+            if isinstance(value, dict) and 'score' in value:
+                result[name] = value
+            elif isinstance(value, (int, float)):
+                result[name] = {"score": float(value), "reasoning": "No reasoning provided"}
+        return result
+    
+    def _build_batch_eval_prompt(self, content_type: str, items: List[Dict[str, Any]]) -> str:
+        """Build one prompt scoring several artifacts, answered as a per-item array"""
+        sections = []
+        for number, item in enumerate(items, start=1):
+            student = item['student']
+            status = (item.get('extra') or {}).get('deployment_status')
+            sections.append(f"""### ITEM {number}
+{json.dumps(item['content'], indent=2)[:1500]}...
+{f"- Deployment Status: {status}" + chr(10) if status else ""}- Student Grade: {student.get('grade')}
+- Learning Style: {student.get('learning_style', 'Mixed')}
+- Interests: {', '.join(student.get('interests', []))}""")
+        
+        criteria_lines = '\n'.join(
+            f"{i}. **{name}**: {description}"
+            for i, (name, description) in enumerate(RUBRIC_CRITERIA[content_type].items(), start=1)
+        )
+        example = ', '.join(f'"{name}": {{"score": 7, "reasoning": "..."}}' for name in RUBRIC_CRITERIA[content_type])
+        
+        return f"""You are a pedagogical expert evaluating {len(items)} AI-generated {content_type}s independently.
+
+{chr(10).join(sections)}
+
+---
+
+EVALUATION CRITERIA (rate each 1-10, per item):
+
+{criteria_lines}
+
+For EACH item:
+- Score every criterion (1-3 poor, 4-6 fair, 7-8 good, 9-10 excellent) with 1-2 sentence reasoning
+- Give the overall score (average of criteria scores), 3 concrete weaknesses and 3 actionable improvements
+- Judge each item on its own - do not compare items with each other
+
+BE HONEST: Most first-generation content scores 6-8. Don't give 9-10 unless truly excellent.
+
+Return ONLY valid JSON with exactly {len(items)} entries in item order:
+{{
+  "evaluations": [
+    {{
+      "item": 1,
+      "overall_score": 7.5,
+      "criteria": {{{example}}},
+      "weaknesses": ["..."],
+      "improvements": ["..."],
+      "confidence": 0.85
+    }}
+  ]
+}}
+"""
+    
+    def _parse_batch_evaluation(self, response: str, count: int) -> List[Optional[Dict[str, Any]]]:
+        """Split a batched response into per-item evaluations (None where an item is missing or invalid)"""
+        cleaned = response.strip()
+        code_block = re.search(r'```(?:json)?\s*(\{.*\})\s*```', cleaned, re.DOTALL)
+        if code_block:
+            cleaned = code_block.group(1)
+        match = re.search(r'\{.*\}', cleaned, re.DOTALL)
+        
+        try:
+            entries = json.loads(match.group(0)).get('evaluations', []) if match else []
+        except (json.JSONDecodeError, AttributeError) as e:
+            print(f"⚠️ Batched evaluation parsing failed: {str(e)[:100]}")
+            entries = []
         
-        return self._parse_evaluation(response)
+        results: List[Optional[Dict[str, Any]]] = [None] * count
+        for position, entry in enumerate(entries if isinstance(entries, list) else []):
+            if not isinstance(entry, dict):
+                continue
+            item = entry.pop('item', position + 1)
+            index = item - 1 if isinstance(item, int) and 1 <= item <= count else position
+            if index < count and results[index] is None:
+                results[index] = self._validate_evaluation(entry)
+        return results
     
     def _build_strategy_eval_prompt(self, strategy: Dict, student: Dict) -> str:
         """Build evaluation prompt for strategy"""
@@ -263,6 +709,32 @@ Return ONLY valid JSON:
 }}
 """
     
+    def _validate_evaluation(self, evaluation: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Normalize a parsed evaluation (None if overall_score/criteria are missing)"""
+        if 'overall_score' not in evaluation or not isinstance(evaluation.get('criteria'), dict):
+            return None
+        
+        # Ensure criteria have proper format
+        validated_criteria = {}
+        for key, value in evaluation['criteria'].items():
+            if isinstance(value, dict) and 'score' in value:
+                validated_criteria[key] = value
+            elif isinstance(value, (int, float)):
+                # Convert simple number to proper format
+                validated_criteria[key] = {
+                    "score": float(value),
+                    "reasoning": "No reasoning provided"
+                }
+        
+        evaluation['criteria'] = validated_criteria
+        
+        # Ensure weaknesses and improvements are lists
+        if 'weaknesses' not in evaluation or not isinstance(evaluation['weaknesses'], list):
+            evaluation['weaknesses'] = []
+        if 'improvements' not in evaluation or not isinstance(evaluation['improvements'], list):
+            evaluation['improvements'] = []
+        return evaluation
+    
     def _parse_evaluation(self, response: str) -> Dict[str, Any]:
         """Parse JSON evaluation from LLM response with robust extraction"""
         import re
@@ -309,32 +781,11 @@ Return ONLY valid JSON:
                 if 'evaluation' in evaluation and isinstance(evaluation['evaluation'], dict):
                     evaluation = evaluation['evaluation']
                 
-                # Validate structure
-                if 'overall_score' in evaluation and 'criteria' in evaluation:
-                    # Ensure criteria have proper format
-                    validated_criteria = {}
-                    for key, value in evaluation['criteria'].items():
-                        if isinstance(value, dict) and 'score' in value:
-                            validated_criteria[key] = value
-                        elif isinstance(value, (int, float)):
-                            # Convert simple number to proper format
-                            validated_criteria[key] = {
-                                "score": float(value),
-                                "reasoning": "No reasoning provided"
-                            }
-                    
-                    evaluation['criteria'] = validated_criteria
-                    
-                    # Ensure weaknesses and improvements are lists
-                    if 'weaknesses' not in evaluation or not isinstance(evaluation['weaknesses'], list):
-                        evaluation['weaknesses'] = []
-                    if 'improvements' not in evaluation or not isinstance(evaluation['improvements'], list):
-                        evaluation['improvements'] = []
-                    
-                    print(f"✅ Successfully parsed evaluation with {len(evaluation['criteria'])} criteria")
-                    return evaluation
-                else:
-                    print(f"⚠️ JSON missing required fields: {list(evaluation.keys())}")
+                validated = self._validate_evaluation(evaluation)
+                if validated:
+                    print(f"✅ Successfully parsed evaluation with {len(validated['criteria'])} criteria")
+                    return validated
+                print(f"⚠️ JSON missing required fields: {list(evaluation.keys())}")
             except json.JSONDecodeError as e:
                 print(f"⚠️ JSON parsing attempt failed: {str(e)[:100]}")
                 continue
@@ -349,10 +800,133 @@ Return ONLY valid JSON:
             },
             "weaknesses": ["Evaluation parsing failed - check LLM response format"],
             "improvements": ["Ensure JSON is properly formatted", "Verify all required fields are present"],
-            "confidence": 0.5
+            "confidence": 0.5,
+            "parse_failed": True
         }
 
 
+class EvaluationBatcher:
+    """
+    Coalesces evaluations from concurrent pipelines of one batch job
+    
+    Each pipeline awaits `evaluate(...)` as usual; requests are flushed through
+    `evaluate_batch` once `max_batch` are waiting or `max_wait` seconds after the
+    first one arrived.
+    
+    Usage:
+        batcher = EvaluationBatcher('lesson', max_batch=concurrency)
+        evaluation = await batcher.evaluate(lesson, student, heuristic_context={'duration': 60})
+    """
+    
+    def __init__(self, content_type: str, max_batch: int = BATCH_SIZE, max_wait: float = 3.0):
+        self.content_type = content_type
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self._pending: List[tuple] = []
+        self._timer: Optional[asyncio.Task] = None
+        self._tasks = set()
+        self.items = 0
+        self.batches = 0
+    
+    async def evaluate(
+        self,
+        content: Dict[str, Any],
+        student: Dict[str, Any],
+        extra: Optional[Dict[str, Any]] = None,
+        heuristic_context: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        future = asyncio.get_running_loop().create_future()
+        item = {'content': content, 'student': student, 'extra': extra, 'heuristic_context': heuristic_context}
+        self._pending.append((item, future))
+        self.items += 1
+        
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif not self._timer:
+            self._timer = asyncio.create_task(self._flush_later())
+        return await future
+    
+    async def _flush_later(self):
+        await asyncio.sleep(self.max_wait)
+        self._timer = None
+        self._flush()
+    
+    @property
+    def calls_saved(self) -> int:
+        """Evaluation requests that were folded into a sibling's batch"""
+        return self.items - self.batches
+    
+    def _flush(self):
+        """Evaluate everything waiting in its own task (a cancelled caller can't strand the others)"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            self.batches += 1
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)  # Keep a reference until done
+            task.add_done_callback(self._tasks.discard)
+    
+    async def _run(self, batch: List[tuple]):
+        try:
+            evaluations = await evaluator.evaluate_batch(self.content_type, [item for item, _ in batch])
+            for (_, future), evaluation in zip(batch, evaluations):
+                if not future.done():
+                    future.set_result(evaluation)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+
+def _content_sections(content: Any) -> Dict[str, str]:
+    """Split content into named sections (top-level keys, or document headings)"""
+    if isinstance(content, dict) and isinstance(content.get('content'), str) and content.get('format'):
+        text = content['content']
+        if content.get('format') == 'html':
+            text = html_to_text(text)
+        
+        sections: Dict[str, str] = {}
+        current = 'introduction'
+        for line in text.split('\n'):
+            heading = re.match(r'\s*#{1,6}\s*(.+)', line) or re.match(r'\s*[-*]?\s*\*\*(Week\s*\d+[^*]*)\*\*', line, re.IGNORECASE)
+            if heading:
+                current = re.sub(r'[*_`]+', '', heading.group(1)).strip() or current
+                continue
+            sections[current] = sections.get(current, '') + line.strip() + '\n'
+        return sections
+    
+    if isinstance(content, dict):
+        return {key: json.dumps(value, sort_keys=True, default=str) for key, value in content.items()}
+    
+    return {'content': json.dumps(content, sort_keys=True, default=str)}
+
+
+def changed_sections(old_content: Any, new_content: Any) -> List[str]:
+    """Names of sections whose (whitespace-normalized) text differs"""
+    old = _content_sections(old_content)
+    new = _content_sections(new_content)
+    normalize = lambda text: re.sub(r'\s+', ' ', text or '').strip()
+    return [
+        name for name in list(dict.fromkeys(list(new) + list(old)))
+        if normalize(old.get(name)) != normalize(new.get(name))
+    ]
+
+
+def affected_criteria(content_type: str, sections: List[str]) -> List[str]:
+    """Criteria an edit to these sections can move (all criteria for unknown sections)"""
+    all_criteria = list(RUBRIC_CRITERIA[content_type])
+    criteria = []
+    for section in sections:
+        name = section.lower()
+        matched = [c for keywords, cs in SECTION_CRITERIA.get(content_type, []) if any(k in name for k in keywords) for c in cs]
+        if not matched:
+            return all_criteria
+        criteria.extend(matched)
+    return [c for c in all_criteria if c in criteria]
+
+
 # Global instance
 evaluator = SelfEvaluator()
 
@@ -0,0 +1,309 @@
+"""
+Heuristic Evaluator
+Local structural scoring that runs before (and often instead of) the LLM evaluation
+
+Signals are cheap checks on the generated artifact (durations, objective counts, source
+coverage, React hooks, handlers...). They produce a prior score that is calibrated
+against LLM scores as they come in, and a sampling policy decides when the LLM
+evaluation is still worth paying for.
+"""
+
+import os
+import re
+import random
+from typing import Dict, Any, List, Optional, Tuple
+
+URL_PATTERN = re.compile(r'https?://[^\s)"\'>\]]+')
+
+
+def _clamp(value: float, low: float = 0.0, high: float = 1.0) -> float:
+    return max(low, min(high, value))
+
+
+def _band(value: float, low: float, high: float, tolerance: float) -> float:
+    """1.0 inside [low, high], falling linearly to 0 over `tolerance` outside"""
+    if low <= value <= high:
+        return 1.0
+    distance = low - value if value < low else value - high
+    return _clamp(1.0 - distance / tolerance)
+
+
+# ==========================================
+# SIGNALS
+# ==========================================
+
+def lesson_signals(
+    lesson: Dict[str, Any],
+    duration: Optional[int] = None,
+    sources: Optional[List[Dict]] = None
+) -> Tuple[Dict[str, float], List[str]]:
+    """Structural signals (0-1) and issues for a lesson plan"""
+    signals: Dict[str, float] = {}
+    issues: List[str] = []
+
+    # Phase / activity durations should add up to the requested duration
+    phases = lesson.get('class_activities') or lesson.get('phases') or []
+    planned = sum(p.get('duration', 0) or 0 for p in phases if isinstance(p, dict) and isinstance(p.get('duration', 0), (int, float)))
+    if duration:
+        signals['duration_match'] = _clamp(1.0 - abs(planned - duration) / duration)
+        if abs(planned - duration) > duration * 0.15:
+            issues.append(f"Activities add up to {planned} min for a {duration}-min lesson")
+    signals['activity_count'] = _band(len(phases), 3, 6, 3)
+    if len(phases) < 3:
+        issues.append(f"Only {len(phases)} class activities")
+
+    objectives = lesson.get('learning_objectives') or []
+    signals['objective_count'] = _band(len(objectives), 3, 5, 3)
+    if not 3 <= len(objectives) <= 5:
+        issues.append(f"{len(objectives)} learning objectives (expected 3-5)")
+
+    # Share of provided research sources the lesson actually links
+    lesson_urls = set(URL_PATTERN.findall(str(lesson)))
+    source_urls = {s.get('url') for s in (sources or []) if s.get('url')}
+    if source_urls:
+        signals['source_coverage'] = _clamp(len(lesson_urls & source_urls) / min(len(source_urls), 3))
+    else:
+        signals['source_coverage'] = _clamp(len(lesson_urls) / 3)
+    if signals['source_coverage'] < 0.34:
+        issues.append("Few or no research sources linked in readings/materials")
+
+    study_guide = lesson.get('study_guide') or {}
+    signals['study_guide'] = _clamp(
+        (len(study_guide.get('key_questions') or []) + len(study_guide.get('core_concepts') or [])) / 6
+    ) if isinstance(study_guide, dict) else 0.0
+
+    return signals, issues
+
+
+def strategy_signals(strategy: Dict[str, Any]) -> Tuple[Dict[str, float], List[str]]:
+    """Structural signals (0-1) and issues for a strategy document"""
+    signals: Dict[str, float] = {}
+    issues: List[str] = []
+
+    topics = strategy.get('topics') or []
+    expected_weeks = strategy.get('weeks') if isinstance(strategy.get('weeks'), int) else len(topics)
+    text = strategy.get('content', '') if isinstance(strategy.get('content'), str) else str(strategy)
+
+    covered = [n for n in range(1, (expected_weeks or 0) + 1) if re.search(rf'week\s*{n}\b', text, re.IGNORECASE)]
+    signals['week_count'] = _clamp(len(covered) / expected_weeks) if expected_weeks else 0.0
+    if expected_weeks and len(covered) < expected_weeks:
+        issues.append(f"Only {len(covered)} of {expected_weeks} weeks are described")
+
+    signals['topic_count'] = 1.0 if expected_weeks and len(topics) == expected_weeks else 0.5
+    signals['length'] = _band(len(text), 4000, 20000, 4000)
+    if len(text) < 2000:
+        issues.append(f"Strategy is short ({len(text)} characters)")
+    signals['resources'] = _clamp(len(set(URL_PATTERN.findall(text))) / 4)
+    if signals['resources'] < 0.5:
+        issues.append("Few resource URLs from the research")
+
+    return signals, issues
+
+
+def activity_signals(activity: Dict[str, Any]) -> Tuple[Dict[str, float], List[str]]:
+    """Structural signals (0-1) and issues for a React activity"""
+    signals: Dict[str, float] = {}
+    issues: List[str] = []
+    code = activity.get('code') or ''
+
+    hooks = set(re.findall(r'\buse(State|Effect|Reducer|Ref|Memo|Callback)\b', code))
+    signals['hooks'] = _clamp(len(hooks) / 2)
+    if 'State' not in hooks:
+        issues.append("No useState: the activity holds no interactive state")
+
+    class_names = re.findall(r'className=["{`]([^"}`]*)', code)
+    tailwind = [c for c in class_names if re.search(r'\b(bg|text|p|m|flex|grid|rounded|w|h)-', c)]
+    signals['tailwind'] = _clamp(len(tailwind) / 10)
+    if not tailwind:
+        issues.append("No Tailwind styling")
+
+    handlers = re.findall(r'\bon(Click|Change|Submit|Drag\w*|Drop|Key\w+|Mouse\w+|Touch\w+|Input)\s*=', code)
+    signals['interactivity'] = _clamp(len(handlers) / 4)
+    if not handlers:
+        issues.append("No event handlers (onClick, onChange, ...)")
+
+    signals['code_size'] = _band(len(code), 2000, 25000, 4000)
+    signals['exports_component'] = 1.0 if re.search(r'export\s+default', code) else 0.0
+    if not signals['exports_component']:
+        issues.append("No default export")
+
+    status = activity.get('deployment_status')
+    if status in ('success', 'failed'):
+        signals['deployed'] = 1.0 if status == 'success' else 0.0
+        if status == 'failed':
+            issues.append("Deployment failed")
+
+    return signals, issues
+
+
+# Which rubric criteria each signal informs (heuristic-only evaluations fill these in)
+SIGNAL_CRITERIA = {
+    'lesson': {
+        'duration_match': ['feasibility'],
+        'activity_count': ['engagement', 'pedagogical_soundness'],
+        'objective_count': ['clarity'],
+        'source_coverage': ['content_quality'],
+        'study_guide': ['clarity', 'differentiation']
+    },
+    'strategy': {
+        'week_count': ['progression', 'clarity'],
+        'topic_count': ['progression'],
+        'length': ['pedagogical_soundness', 'cultural_appropriateness', 'engagement_potential'],
+        'resources': ['feasibility']
+    },
+    'activity': {
+        'hooks': ['interactivity', 'code_quality'],
+        'tailwind': ['code_quality', 'engagement'],
+        'interactivity': ['interactivity', 'engagement', 'educational_value'],
+        'code_size': ['creativity', 'feasibility'],
+        'exports_component': ['code_quality'],
+        'deployed': ['code_quality', 'feasibility']
+    }
+}
+
+SIGNAL_FUNCTIONS = {
+    'lesson': lesson_signals,
+    'strategy': strategy_signals,
+    'activity': activity_signals
+}
+
+
+# ==========================================
+# CALIBRATION + SAMPLING
+# ==========================================
+
+class HeuristicCalibrator:
+    """Running least-squares fit of LLM overall_score on the raw heuristic score, per content type"""
+
+    MIN_SAMPLES = 10
+
+    def __init__(self):
+        self._stats: Dict[str, List[float]] = {}  # n, sum_x, sum_y, sum_xx, sum_xy
+
+    def observe(self, content_type: str, raw: float, llm_score: float):
+        n, sx, sy, sxx, sxy = self._stats.get(content_type, [0, 0.0, 0.0, 0.0, 0.0])
+        self._stats[content_type] = [n + 1, sx + raw, sy + llm_score, sxx + raw * raw, sxy + raw * llm_score]
+
+    def samples(self, content_type: str) -> int:
+        return int(self._stats.get(content_type, [0])[0])
+
+    def predict(self, content_type: str, raw: float) -> float:
+        """Calibrated 1-10 prior (uncalibrated: most first drafts score 6-8, so map 0-1 onto 4-9)"""
+        n, sx, sy, sxx, sxy = self._stats.get(content_type, [0, 0.0, 0.0, 0.0, 0.0])
+        variance = n * sxx - sx * sx
+        if n < self.MIN_SAMPLES or variance <= 1e-9:
+            return round(4.0 + 5.0 * raw, 1)
+
+        slope = (n * sxy - sx * sy) / variance
+        intercept = (sy - slope * sx) / n
+        return round(_clamp(intercept + slope * raw, 1.0, 10.0), 1)
+
+
+class EvaluationSampler:
+    """
+    Decides whether an artifact still needs the LLM evaluation
+
+    Always while the calibration is warming up and when the prior sits in the
+    uncertain middle band; otherwise a `sample_rate` share (cut under load, i.e.
+    when `max_inflight` LLM evaluations are already running) keeps the
+    calibration fresh.
+    """
+
+    def __init__(self, sample_rate: float = 0.3, max_inflight: int = 4, uncertain_band: Tuple[float, float] = (5.5, 7.0)):
+        self.sample_rate = sample_rate
+        self.max_inflight = max_inflight
+        self.uncertain_band = uncertain_band
+
+    def needs_llm(self, calibrated_samples: int, prior: float, issues: List[str], inflight: int) -> Tuple[bool, str]:
+        overloaded = inflight >= self.max_inflight
+        if calibrated_samples < HeuristicCalibrator.MIN_SAMPLES:
+            return True, "calibrating"
+        if self.uncertain_band[0] <= prior <= self.uncertain_band[1] and not overloaded:
+            return True, "uncertain prior"
+        if issues and not overloaded:
+            return True, "structural issues need written feedback"
+
+        rate = self.sample_rate * (0.25 if overloaded else 1.0)
+        if random.random() < rate:
+            return True, "sampled"
+        return False, "overloaded" if overloaded else "confident prior"
+
+
+class HeuristicEvaluator:
+    """Computes signals and a calibrated prior for strategies, lessons and activities"""
+
+    def __init__(self):
+        self.calibrator = HeuristicCalibrator()
+        self.sampler = EvaluationSampler(
+            sample_rate=float(os.getenv("EVAL_SAMPLE_RATE", "0.3")),
+            max_inflight=int(os.getenv("EVAL_MAX_INFLIGHT", "4"))
+        )
+
+    def score(self, content_type: str, content: Dict[str, Any], **context) -> Dict[str, Any]:
+        """
+        Score an artifact locally
+
+        Args:
+            content_type: 'strategy', 'lesson' or 'activity'
+            context: Extra inputs for the signals (lesson: duration, sources)
+
+        Returns:
+            Dict with signals, issues, raw score (0-1) and calibrated prior (1-10)
+        """
+        signals, issues = SIGNAL_FUNCTIONS[content_type](content, **context)
+        raw = round(sum(signals.values()) / len(signals), 3) if signals else 0.0
+        return {
+            'signals': {k: round(v, 3) for k, v in signals.items()},
+            'issues': issues,
+            'raw_score': raw,
+            'prior_score': self.calibrator.predict(content_type, raw)
+        }
+
+    def needs_llm(self, content_type: str, heuristic: Dict[str, Any], inflight: int) -> Tuple[bool, str]:
+        return self.sampler.needs_llm(
+            self.calibrator.samples(content_type), heuristic['prior_score'], heuristic['issues'], inflight
+        )
+
+    def observe(self, content_type: str, heuristic: Dict[str, Any], evaluation: Dict[str, Any]):
+        """Feed an LLM score back into the calibration"""
+        score = evaluation.get('overall_score')
+        if isinstance(score, (int, float)) and not evaluation.get('parse_failed'):
+            self.calibrator.observe(content_type, heuristic['raw_score'], float(score))
+
+    def to_evaluation(self, content_type: str, heuristic: Dict[str, Any], criteria: List[str]) -> Dict[str, Any]:
+        """
+        Evaluation in the LLM's shape, built from the signals alone
+
+        Flagged `estimated`: per-criterion scores are the prior shifted by signals, not
+        measurements, so metrics analytics leaves these evaluations out.
+        """
+        prior = heuristic['prior_score']
+        informed: Dict[str, List[float]] = {}
+        for signal, value in heuristic['signals'].items():
+            for criterion in SIGNAL_CRITERIA[content_type].get(signal, []):
+                informed.setdefault(criterion, []).append(value)
+
+        scores = {}
+        for criterion in criteria:
+            values = informed.get(criterion)
+            # Shift the prior by how this criterion's signals compare with the average
+            shift = (sum(values) / len(values) - heuristic['raw_score']) * 3 if values else 0.0
+            scores[criterion] = {
+                'score': round(_clamp(prior + shift, 1.0, 10.0), 1),
+                'reasoning': 'Heuristic estimate from structural signals'
+            }
+
+        return {
+            'overall_score': prior,
+            'criteria': scores,
+            'weaknesses': heuristic['issues'][:3],
+            'improvements': [],
+            'confidence': 0.6,
+            'source': 'heuristic',
+            'estimated': True,
+            'heuristic': heuristic
+        }
+
+
+# Global instance
+heuristic_evaluator = HeuristicEvaluator()
@@ -3,22 +3,27 @@ Lesson Creator Agent
 Generates 5E lesson plans with self-evaluation
 """
 
+import re
 import json
+import asyncio
 import weave
-from typing import Dict, Any, Optional, List
-from uuid import UUID, uuid4
+from typing import Dict, Any, Optional, List, Callable, Awaitable
+from uuid import UUID, uuid4, uuid5, NAMESPACE_URL
 from datetime import datetime
 
 from services.ai_service import call_google_learnlm
 from services.knowledge_service import explain_topic_with_sources
 from services.memory_service import (
     load_student_memories,
-    load_learning_insights,
     store_performance_metric,
     format_insights_for_prompt,
     format_sources
 )
-from agents.evaluator import evaluator
+from services.insight_digest import load_insight_digest
+from services.checkpoint_service import load_checkpoints
+from services.pipeline_dag import PipelineDAG, add_evaluation_stages, evaluate_in_background
+from services.strategy_index import ensure_strategy_weeks, week_record_to_context
+from agents.evaluator import evaluator, EvaluationBatcher, BATCH_SIZE
 from db.supabase_client import supabase, get_student, get_tutor
 
 
@@ -29,7 +34,12 @@ async def generate_lesson(
     topic: Optional[str] = None,
     duration: int = 60,
     strategy_id: Optional[str] = None,
-    strategy_week_number: Optional[int] = None
+    strategy_week_number: Optional[int] = None,
+    on_stage: Optional[Callable[[str], Awaitable[None]]] = None,
+    request_id: Optional[str] = None,
+    shared_context: Optional[Dict[str, Any]] = None,
+    evaluation_mode: str = 'overlap',
+    evaluation_batcher: Optional[EvaluationBatcher] = None
 ) -> Dict[str, Any]:
     """
     Generate a 5E lesson plan with self-evaluation
@@ -45,42 +55,252 @@ async def generate_lesson(
         duration: Lesson duration in minutes (default: 60)
         strategy_id: Optional strategy UUID this lesson derives from
         strategy_week_number: Which week from strategy (1-4) if applicable
+        on_stage: Optional async callback invoked with each pipeline stage name
+        request_id: Optional idempotency key; completed stages are checkpointed
+                    under it and skipped when the same request is retried
+        shared_context: Optional stage outputs loaded once by a batch caller
+                        ('week', 'profile', 'research'); those stages are skipped
+        evaluation_mode: 'overlap' (evaluate alongside persistence, default),
+                         'sync' (evaluate before storing) or 'background'
+                         (return once stored; self_evaluation is patched later)
+        evaluation_batcher: Optional EvaluationBatcher shared by a batch job; the
+                            evaluation is packed into one call with its siblings
         
     Returns:
         Dict with lesson content and self-evaluation
     """
+    checkpoints = await load_checkpoints(request_id, 'lesson')
     
     # AGENT HANDOFF: Load strategy context if creating from strategy week
-    strategy_context = None
-    if strategy_id and strategy_week_number:
-        print(f"\n📚 Generating lesson from Strategy Week {strategy_week_number}...")
-        strategy_context = await load_strategy_week_context(strategy_id, strategy_week_number)
-        topic = strategy_context['topic']  # Auto-fill topic from strategy
-        print(f"   Topic from strategy: {topic}")
-    else:
-        print(f"\n📚 Generating standalone {duration}-minute lesson on: {topic}...")
-        if not topic:
-            raise ValueError("Topic required for standalone lesson (or provide strategy_id + strategy_week_number)")
-    
-    # Step 1: Load student and tutor data
+    async def load_week(results):
+        strategy_context = None
+        lesson_topic = topic
+        if strategy_id and strategy_week_number:
+            print(f"\n📚 Generating lesson from Strategy Week {strategy_week_number}...")
+            strategy_context = await load_strategy_week_context(strategy_id, strategy_week_number)
+            lesson_topic = strategy_context['topic']  # Auto-fill topic from strategy
+            print(f"   Topic from strategy: {lesson_topic}")
+        else:
+            print(f"\n📚 Generating standalone {duration}-minute lesson on: {lesson_topic}...")
+            if not lesson_topic:
+                raise ValueError("Topic required for standalone lesson (or provide strategy_id + strategy_week_number)")
+        return {'topic': lesson_topic, 'strategy_context': strategy_context}
+    
+    # Step 1: Load student and tutor data + memories (runs alongside the strategy lookup)
+    async def load_profile(results):
+        student = await get_student(student_id)
+        tutor = await get_tutor(tutor_id)
+        
+        if not student:
+            raise ValueError(f"Student {student_id} not found")
+        if not tutor:
+            raise ValueError(f"Tutor {tutor_id} not found")
+        
+        memories = await load_student_memories(student_id, limit=10)
+        
+        # Extract attention span from memories if available
+        attention_span = 15  # Default
+        for memory in memories:
+            if memory.get('memory_category') == 'learning_profile':
+                data = memory.get('memory_value', {}).get('data', {})
+                if 'attention_span' in data:
+                    attention_span = data['attention_span']
+                    break
+        
+        print(f"   Student: {student['name']} (Grade {student['grade']})")
+        print(f"   Tutor: {tutor['name']}")
+        print(f"   Loaded {len(memories)} memories")
+        return {'student': student, 'tutor': tutor, 'attention_span': attention_span}
+    
+    # Step 2: Load the insight digest for this grade/subject (runs alongside research)
+    async def load_insights(results):
+        student = results['profile']['student']
+        digest = await load_insight_digest('lesson_creator', student['grade'], student.get('subject'))
+        print(f"   Loaded {digest['insight_count']} insights (~{digest['token_count']} tokens)")
+        return digest['prompt_text']
+    
+    # Step 3: Call Layer 1 to explain the topic
+    async def research(results):
+        student = results['profile']['student']
+        print(f"   🔍 Researching topic...")
+        knowledge_context = await explain_topic_with_sources(
+            topic=results['week']['topic'],
+            grade=student['grade'],
+            subject=student.get('subject', 'General')
+        )
+        print(f"   Found {len(knowledge_context.get('sources', []))} sources")
+        return knowledge_context
+    
+    # Step 4: Generate 5E lesson plan (with strategy context if applicable)
+    async def draft(results):
+        return await generate_comprehensive_lesson(
+            student=results['profile']['student'],
+            tutor=results['profile']['tutor'],
+            topic=results['week']['topic'],
+            duration=duration,
+            knowledge_context=results['research'],
+            insights_prompt=results['insights'],
+            strategy_context=results['week']['strategy_context']
+        )
+    
+    # Step 5: Self-evaluate the lesson
+    async def evaluate(results):
+        print("   🔍 Self-evaluating lesson...")
+        heuristic_context = {'duration': duration, 'sources': results['research'].get('sources', [])}
+        if evaluation_batcher:
+            evaluation = await evaluation_batcher.evaluate(
+                results['draft'], results['profile']['student'], heuristic_context=heuristic_context
+            )
+        else:
+            evaluation = await evaluator.evaluate_lesson(
+                results['draft'], results['profile']['student'], **heuristic_context
+            )
+        print(f"   📊 Overall Score: {evaluation['overall_score']}/10")
+        return evaluation
+    
+    # Step 6: Store in database (overlaps with evaluation)
+    async def persist(results):
+        # Deterministic id + upsert keeps a retried persistence stage from duplicating rows
+        lesson_id = uuid5(NAMESPACE_URL, f"lesson:{request_id}") if request_id else uuid4()
+        lesson_topic = results['week']['topic']
+        knowledge_context = results['research']
+        lesson_record = {
+            'id': str(lesson_id),
+            'tutor_id': tutor_id,
+            'student_id': student_id,
+            'strategy_id': strategy_id,
+            'strategy_week_number': strategy_week_number,  # NEW: Track which week
+            'title': f"{lesson_topic} - {duration}min Lesson",
+            'duration': duration,
+            'content': results['draft'],
+            'knowledge_context': {  # NEW: Store sources + explanation for Activity Creator!
+                'topic': lesson_topic,
+                'explanation': knowledge_context.get('explanation', ''),
+                'sources': knowledge_context.get('sources', [])
+            },
+            'current_version': 1,  # NEW: Version tracking
+            'is_latest': True,     # NEW: Latest version flag
+            'created_at': datetime.now().isoformat(),
+            'updated_at': datetime.now().isoformat()
+        }
+        
+        supabase.table('lessons').upsert(lesson_record).execute()
+        print(f"   ✅ Lesson stored (ID: {lesson_id})")
+        return {'lesson_id': str(lesson_id)}
+    
+    # Step 7: Attach the evaluation and store the performance metric
+    async def finalize(results):
+        lesson_id = results['persistence']['lesson_id']
+        supabase.table('lessons')\
+            .update({'self_evaluation': results['evaluation']})\
+            .eq('id', lesson_id)\
+            .execute()
+        
+        await store_performance_metric(
+            agent_type='lesson_creator',
+            evaluation=results['evaluation'],
+            session_id=lesson_id
+        )
+        return {'lesson_id': lesson_id}
+    
+    dag = PipelineDAG('lesson')\
+        .add('week', load_week)\
+        .add('profile', load_profile)\
+        .add('insights', load_insights, depends_on=['week', 'profile'])\
+        .add('research', research, depends_on=['week', 'profile'])\
+        .add('draft', draft, depends_on=['week', 'profile', 'insights', 'research'])
+    add_evaluation_stages(
+        dag, evaluation_mode, evaluate, persist, finalize,
+        evaluate_after=['profile', 'draft'],
+        persist_after=['week', 'draft', 'research']
+    )
+    results = await dag.run(checkpoints, on_stage, preloaded=shared_context)
+    if evaluation_mode == 'background':
+        evaluate_in_background(results, evaluate, finalize, checkpoints, label='lesson evaluation')
+    
+    return {
+        'lesson_id': results['persistence']['lesson_id'],
+        'content': results['draft'],
+        'evaluation': results.get('evaluation'),  # None until the background evaluation lands
+        'evaluation_status': 'pending' if evaluation_mode == 'background' else 'complete',
+        'student': results['profile']['student'],
+        'tutor': results['profile']['tutor'],
+        'timings': dag.timings
+    }
+
+
+async def load_strategy_week_context(strategy_id: str, week_number: int) -> Dict:
+    """Load specific week context from the strategy week index"""
+    try:
+        weeks = await ensure_strategy_weeks(strategy_id, week_number)
+        if not weeks:
+            raise ValueError(f"Week {week_number} not found in strategy")
+        
+        return week_record_to_context(weeks[0])
+        
+    except Exception as e:
+        print(f"⚠️ Error loading strategy context: {str(e)}")
+        return None
+
+
+@weave.op()
+async def generate_strategy_lessons(
+    strategy_id: str,
+    tutor_id: Optional[str] = None,
+    duration: int = 60,
+    include_activities: bool = False,
+    concurrency: int = 2,
+    on_stage: Optional[Callable[..., Awaitable[None]]] = None,
+    request_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Generate every week's lesson of a strategy in one batch
+    
+    The strategy, student, tutor and the strategy's stored week research are loaded
+    once and shared by all weeks; lessons run concurrently up to `concurrency`.
+    
+    Args:
+        strategy_id: Strategy UUID
+        tutor_id: Tutor UUID (default: the strategy's tutor)
+        duration: Lesson duration in minutes
+        include_activities: Also generate an interactive activity per lesson
+        concurrency: Max weeks generated at the same time
+        on_stage: Async callback (stage, detail=None); emits 'lesson_completed'
+                  with the lesson as soon as each week finishes
+        request_id: Batch idempotency key; each week resumes under
+                    f"{request_id}:week{n}"
+        
+    Returns:
+        Dict with lessons (sorted by week) and per-week failures
+    """
+    response = supabase.table('strategies')\
+        .select('id, tutor_id, student_id, knowledge_contexts')\
+        .eq('id', strategy_id)\
+        .execute()
+    
+    if not response.data:
+        raise ValueError(f"Strategy {strategy_id} not found")
+    
+    strategy = response.data[0]
+    tutor_id = tutor_id or strategy['tutor_id']
+    student_id = strategy['student_id']
+    knowledge_contexts = strategy.get('knowledge_contexts') or []
+    week_records = await ensure_strategy_weeks(strategy_id)
+    weeks = len(week_records)
+    if not weeks:
+        raise ValueError(f"Strategy {strategy_id} has no weeks to generate lessons for")
+    
+    print(f"\n📚 Batch generating {weeks} lessons for strategy {strategy_id} (concurrency={concurrency})...")
+    
+    # Shared by every week instead of reloading per lesson
     student = await get_student(student_id)
     tutor = await get_tutor(tutor_id)
-    
     if not student:
         raise ValueError(f"Student {student_id} not found")
     if not tutor:
         raise ValueError(f"Tutor {tutor_id} not found")
     
-    print(f"   Student: {student['name']} (Grade {student['grade']})")
-    print(f"   Tutor: {tutor['name']}")
-    
-    # Step 2: Load memories and insights
     memories = await load_student_memories(student_id, limit=10)
-    insights = await load_learning_insights(student['grade'], topic, limit=5)
-    
-    print(f"   Loaded {len(memories)} memories, {len(insights)} insights")
-    
-    # Extract attention span from memories if available
     attention_span = 15  # Default
     for memory in memories:
         if memory.get('memory_category') == 'learning_profile':
@@ -88,130 +308,95 @@ async def generate_lesson(
             if 'attention_span' in data:
                 attention_span = data['attention_span']
                 break
-    
-    # Step 3: Call Layer 1 to explain the topic
-    print(f"   🔍 Researching topic...")
-    knowledge_context = await explain_topic_with_sources(
-        topic=topic,
-        grade=student['grade'],
-        subject=student.get('subject', 'General')
-    )
-    print(f"   Found {len(knowledge_context.get('sources', []))} sources")
-    
-    # Step 4: Generate 5E lesson plan (with strategy context if applicable)
-    lesson_content = await generate_comprehensive_lesson(
-        student=student,
-        tutor=tutor,
-        topic=topic,
-        duration=duration,
-        knowledge_context=knowledge_context,
-        learning_insights=insights,
-        strategy_context=strategy_context
-    )
-    
-    # Step 5: Self-evaluate the lesson
-    print("   🔍 Self-evaluating lesson...")
-    evaluation = await evaluator.evaluate_lesson(lesson_content, student)
-    
-    print(f"   📊 Overall Score: {evaluation['overall_score']}/10")
-    
-    # Step 6: Store in database
-    lesson_id = uuid4()
-    lesson_record = {
-        'id': str(lesson_id),
-        'tutor_id': tutor_id,
-        'student_id': student_id,
-        'strategy_id': strategy_id,
-        'strategy_week_number': strategy_week_number,  # NEW: Track which week
-        'title': f"{topic} - {duration}min Lesson",
-        'duration': duration,
-        'content': lesson_content,
-        'knowledge_context': {  # NEW: Store sources + explanation for Activity Creator!
-            'topic': topic,
-            'explanation': knowledge_context.get('explanation', ''),
-            'sources': knowledge_context.get('sources', [])
-        },
-        'self_evaluation': evaluation,
-        'current_version': 1,  # NEW: Version tracking
-        'is_latest': True,     # NEW: Latest version flag
-        'created_at': datetime.now().isoformat(),
-        'updated_at': datetime.now().isoformat()
-    }
-    
-    supabase.table('lessons').insert(lesson_record).execute()
-    print(f"   ✅ Lesson stored (ID: {lesson_id})")
-    
-    # Step 7: Store performance metric
-    await store_performance_metric(
-        agent_type='lesson_creator',
-        evaluation=evaluation,
-        session_id=str(lesson_id)
-    )
-    
-    return {
-        'lesson_id': str(lesson_id),
-        'content': lesson_content,
-        'evaluation': evaluation,
-        'student': student,
-        'tutor': tutor
-    }
-
-
-async def load_strategy_week_context(strategy_id: str, week_number: int) -> Dict:
-    """Load specific week context from a strategy (markdown format)"""
-    try:
-        response = supabase.table('strategies').select('content').eq('id', strategy_id).execute()
+    profile = {'student': student, 'tutor': tutor, 'attention_span': attention_span}
+    
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    # Sibling weeks finishing together share one evaluation call
+    lesson_batcher = EvaluationBatcher('lesson', max_batch=min(BATCH_SIZE, concurrency))
+    activity_batcher = EvaluationBatcher('activity', max_batch=min(BATCH_SIZE, concurrency))
+    lessons = []
+    failures = []
+    
+    async def run_week(record: Dict[str, Any]):
+        week_number = record['week_number']
+        week_context = week_record_to_context(record)
+        shared = {
+            'week': {'topic': week_context['topic'], 'strategy_context': week_context},
+            'profile': profile
+        }
         
-        if not response.data:
-            raise ValueError(f"Strategy {strategy_id} not found")
+        # Reuse the strategy's research for this week (the index only links matching topics)
+        research_index = record.get('research_index')
+        if research_index is not None and research_index < len(knowledge_contexts):
+            research = knowledge_contexts[research_index] or {}
+            if research.get('sources'):
+                shared['research'] = research
         
-        strategy_content = response.data[0]['content']
+        async def week_stage(stage: str):
+            if on_stage:
+                await on_stage(f"week_{week_number}:{stage}")
         
-        # Handle new markdown format
-        if isinstance(strategy_content, dict) and strategy_content.get('format') == 'markdown':
-            topics = strategy_content.get('topics', [])
-            markdown_content = strategy_content.get('content', '')
+        async with semaphore:
+            lesson = await generate_lesson(
+                student_id=student_id,
+                tutor_id=tutor_id,
+                duration=duration,
+                strategy_id=strategy_id,
+                strategy_week_number=week_number,
+                on_stage=week_stage,
+                request_id=f"{request_id}:week{week_number}" if request_id else None,
+                shared_context=shared,
+                evaluation_batcher=lesson_batcher
+            )
             
-            # Get the topic for this week
-            if week_number <= 0 or week_number > len(topics):
-                raise ValueError(f"Week {week_number} out of range (strategy has {len(topics)} weeks)")
-            
-            topic = topics[week_number - 1]
-            
-            # Extract the relevant week section from markdown
-            import re
-            week_pattern = rf"(?:Week|WEEK)\s*{week_number}[:\s]+.*?(?=(?:Week|WEEK)\s*\d+|$)"
-            week_match = re.search(week_pattern, markdown_content, re.DOTALL | re.IGNORECASE)
-            
-            week_excerpt = ""
-            if week_match:
-                week_excerpt = week_match.group(0)[:500]  # First 500 chars of week section
-            
-            return {
-                'topic': topic,
-                'strategy_excerpt': week_excerpt,
-                'full_strategy': markdown_content[:2000],  # First 2000 chars for broader context
-                'week_number': week_number
+            entry = {
+                'week_number': week_number,
+                'topic': week_context['topic'],
+                'lesson_id': lesson['lesson_id'],
+                'content': lesson['content'],
+                'evaluation': lesson['evaluation']
             }
+            
+            if include_activities:
+                # Imported here to avoid a circular import at module load
+                from agents.activity_creator import generate_activity
+                activity = await generate_activity(
+                    student_id=student_id,
+                    tutor_id=tutor_id,
+                    lesson_id=lesson['lesson_id'],
+                    on_stage=week_stage,
+                    request_id=f"{request_id}:week{week_number}:activity" if request_id else None,
+                    evaluation_batcher=activity_batcher
+                )
+                entry['activity_id'] = activity['activity_id']
+                entry['sandbox_url'] = activity['deployment'].get('url')
         
-        # Fallback for old JSON format (backward compatibility)
-        elif isinstance(strategy_content, dict) and 'weeks' in strategy_content:
-            weeks = strategy_content.get('weeks', [])
-            for week in weeks:
-                if week.get('week_number') == week_number:
-                    return {
-                        'topic': week.get('topic', ''),
-                        'focus_area': week.get('focus_area', ''),
-                        'learning_objectives': week.get('learning_objectives', []),
-                        'key_concepts': week.get('key_concepts', []),
-                        'week_number': week_number
-                    }
-        
-        raise ValueError(f"Week {week_number} not found in strategy")
-        
-    except Exception as e:
-        print(f"⚠️ Error loading strategy context: {str(e)}")
-        return None
+        lessons.append(entry)
+        print(f"   ✅ Week {week_number} lesson ready ({len(lessons)}/{weeks})")
+        if on_stage:
+            await on_stage('lesson_completed', entry)
+    
+    async def run_week_safely(record: Dict[str, Any]):
+        week_number = record['week_number']
+        try:
+            await run_week(record)
+        except Exception as e:
+            print(f"   ❌ Week {week_number} lesson failed: {str(e)}")
+            failures.append({'week_number': week_number, 'error': str(e)})
+            if on_stage:
+                await on_stage('lesson_failed', failures[-1])
+    
+    await asyncio.gather(*(run_week_safely(record) for record in week_records))
+    
+    if failures and not lessons:
+        raise RuntimeError(f"All {weeks} lessons failed: {failures[0]['error']}")
+    
+    return {
+        'strategy_id': strategy_id,
+        'lessons': sorted(lessons, key=lambda l: l['week_number']),
+        'failures': sorted(failures, key=lambda f: f['week_number']),
+        'evaluation_calls_saved': lesson_batcher.calls_saved + activity_batcher.calls_saved
+    }
 
 
 @weave.op()
@@ -418,17 +603,17 @@ async def generate_comprehensive_lesson(
     topic: str,
     duration: int,
     knowledge_context: Dict,
-    learning_insights: List[Dict],
+    insights_prompt: str,
     strategy_context: Optional[Dict] = None
 ) -> Dict:
     """Generate comprehensive detailed lesson plan with pre-class work, in-class activities, and homework"""
     
-    # Build insights section
+    # Build insights section (pre-formatted insight digest)
     insights_section = ""
-    if learning_insights:
+    if insights_prompt:
         insights_section = f"""
 LEARNINGS FROM PREVIOUS LESSON GENERATIONS:
-{format_insights_for_prompt(learning_insights)}
+{insights_prompt}
 """
     
     # Build strategy context section
@@ -4,11 +4,32 @@ Analyzes patterns in agent performance and tutor feedback to generate learning i
 This is the KEY component for "Best Self-Improving Agent" track
 """
 
+import os
+import time
+import asyncio
 import weave
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, AsyncIterator
 from datetime import datetime, timedelta
 from db.supabase_client import supabase
 from services.ai_service import call_google_learnlm
+from services.metrics_analytics import load_metrics, summarize_metrics, format_metric_summary, MEASURED_METRICS_FILTER
+from services.edit_mining import mine_edits, format_edit_patterns
+from services.insight_index import agent_insight_index
+from services.insight_consolidation import find_similar, merge_agent_insights, consolidate_insights
+from agents.evaluator import RUBRIC_VERSION
+
+REFLECTION_AGENTS = ['strategy_creator', 'lesson_creator', 'activity_creator']
+
+# Tutor edits are mined into aggregate change patterns, so many more fit the prompt
+EDIT_WINDOW_LIMIT = 200
+EDIT_COLUMNS = 'id, content_id, version_number, edit_notes, changes_summary, created_at'
+
+# Reflection agent names → agent_type stored by store_performance_metric
+METRIC_AGENT_TYPES = {
+    'strategy_creator': 'strategy_planner',
+    'lesson_creator': 'lesson_creator',
+    'activity_creator': 'activity_creator'
+}
 
 
 class ReflectionService:
@@ -38,15 +59,10 @@ class ReflectionService:
         # Step 1: Get recent performance metrics
         cutoff_date = (datetime.now() - timedelta(days=lookback_days)).isoformat()
         
-        metrics_result = supabase.table('agent_performance_metrics')\
-            .select('*')\
-            .eq('agent_type', agent_type)\
-            .gte('created_at', cutoff_date)\
-            .order('created_at', desc=True)\
-            .limit(20)\
-            .execute()
-        
-        metrics = metrics_result.data if metrics_result.data else []
+        # Summarized statistically, so the whole window fits the prompt
+        metrics = await load_metrics(
+            METRIC_AGENT_TYPES.get(agent_type, agent_type), since=cutoff_date, rubric_version=RUBRIC_VERSION
+        )
         
         if len(metrics) < 3:
             print(f"   ℹ️  Not enough data yet ({len(metrics)} records)")
@@ -55,49 +71,183 @@ class ReflectionService:
         # Step 2: Get recent tutor edits (version history)
         content_type = self._agent_to_content_type(agent_type)
         edits_result = supabase.table('content_versions')\
-            .select('*, content, edit_notes, changes_summary')\
+            .select(EDIT_COLUMNS)\
             .eq('content_type', content_type)\
             .eq('edit_type', 'manual_edit')\
             .gte('created_at', cutoff_date)\
             .order('created_at', desc=True)\
-            .limit(10)\
+            .limit(EDIT_WINDOW_LIMIT)\
             .execute()
         
         edits = edits_result.data if edits_result.data else []
         
         # Step 3: Analyze patterns with LLM
-        insights = await self._analyze_patterns(agent_type, metrics, edits)
+        insights = await self._analyze_patterns(agent_type, metrics, edits) or []
         
         # Step 4: Store insights in cross_agent_learning table
+        self._store_insights(agent_type, insights)
+        
+        print(f"   🎓 Generated {len(insights)} learning insights")
+        return insights
+    
+    def _store_insights(self, agent_type: str, insights: List[Dict[str, Any]]) -> None:
+        """
+        Store insights (failures are logged so a bad row doesn't block the rest)
+        
+        An insight that restates an active one strengthens it (evidence count,
+        combined confidence) instead of adding a near-duplicate row.
+        """
         for insight in insights:
+            text = str(insight.get('insight') or '').strip()
+            if not text:
+                continue
             insight_record = {
-                'source_agent': agent_type,
-                'target_agent': agent_type,  # Can also share with other agents
-                'learning_type': insight['type'],
-                'insight': insight['insight'],
-                'evidence': insight['evidence'],
-                'confidence': insight['confidence'],
-                'created_at': datetime.now().isoformat()
+                'pattern_detected': text,
+                'contributing_agents': [agent_type],  # Can also share with other agents
+                'insight_type': insight.get('type'),
+                'evidence': [insight['evidence']] if insight.get('evidence') else [],
+                'action': insight.get('action'),
+                'confidence_score': max(0.0, min(1.0, float(insight.get('confidence') or 0.5))),
+                'evidence_count': 1,
+                'created_at': datetime.now().isoformat(),
+                'last_updated': datetime.now().isoformat()
             }
             
-            supabase.table('cross_agent_learning').insert(insight_record).execute()
-            print(f"   ✅ Stored insight: {insight['insight'][:60]}...")
+            try:
+                duplicate = find_similar(agent_insight_index, text, agent=agent_type)
+                if duplicate:
+                    update = merge_agent_insights(duplicate, [insight_record])
+                    supabase.table('cross_agent_learning')\
+                        .update(update)\
+                        .eq('id', duplicate['id'])\
+                        .execute()
+                    agent_insight_index.add({**duplicate, **update})
+                    print(f"   🔁 Reinforced insight ({update['evidence_count']}x): {text[:60]}...")
+                    continue
+                
+                result = supabase.table('cross_agent_learning').insert(insight_record).execute()
+                for row in (result.data or []):
+                    agent_insight_index.add(row)
+                print(f"   ✅ Stored insight: {text[:60]}...")
+            except Exception as e:
+                print(f"   ⚠️ Failed to store insight: {str(e)}")
+    
+    @weave.op()
+    async def reflect_incremental(
+        self,
+        agent_type: str,
+        min_new_evidence: int = 5,
+        max_batch: int = 1000,
+        max_edits: int = EDIT_WINDOW_LIMIT
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Analyze only the metrics and tutor edits recorded since the last run
+        
+        A per-agent watermark (reflection_watermarks) stores the created_at of the
+        last processed metric and edit plus running score totals, so each run reads
+        and prompts with new evidence only.
+        
+        Args:
+            agent_type: 'strategy_creator', 'lesson_creator', or 'activity_creator'
+            min_new_evidence: New metrics + edits needed before an analysis runs
+            max_batch: Max new metrics processed per run (summarized, so this can be large)
+            max_edits: Max new tutor edits processed per run; older ones first
+            
+        Returns:
+            Generated insights, or None when there wasn't enough new evidence
+        """
+        watermark = self._load_watermark(agent_type)
+        content_type = self._agent_to_content_type(agent_type)
         
-        print(f"   🎓 Generated {len(insights)} learning insights")
+        metrics_query = supabase.table('agent_performance_metrics')\
+            .select('id, evaluation_details, created_at')\
+            .eq('agent_type', METRIC_AGENT_TYPES.get(agent_type, agent_type))\
+            .eq('rubric_version', RUBRIC_VERSION)\
+            .or_(MEASURED_METRICS_FILTER)
+        if watermark.get('last_metric_at'):
+            metrics_query = metrics_query.gt('created_at', watermark['last_metric_at'])
+        metrics = metrics_query.order('created_at', desc=False).limit(max_batch).execute().data or []
+        
+        edits_query = supabase.table('content_versions')\
+            .select(EDIT_COLUMNS)\
+            .eq('content_type', content_type)\
+            .eq('edit_type', 'manual_edit')
+        if watermark.get('last_edit_at'):
+            edits_query = edits_query.gt('created_at', watermark['last_edit_at'])
+        edits = edits_query.order('created_at', desc=False).limit(max_edits).execute().data or []
+        
+        if len(metrics) + len(edits) < min_new_evidence:
+            print(f"   ℹ️  {agent_type}: {len(metrics)} new metrics, {len(edits)} new edits - waiting for more evidence")
+            return None
+        
+        print(f"\n🧠 Reflection: {agent_type} - {len(metrics)} new metrics, {len(edits)} new edits since last run")
+        
+        # Running baseline so the prompt can compare new scores without re-reading history;
+        # restarted when the rubric changes, since scores under different rubrics don't compare
+        if watermark.get('rubric_version') != RUBRIC_VERSION:
+            watermark = {**watermark, 'metrics_processed': 0, 'score_sum': 0}
+        baseline = None
+        if watermark.get('metrics_processed'):
+            baseline = float(watermark.get('score_sum') or 0) / watermark['metrics_processed']
+        
+        insights = await self._analyze_patterns(agent_type, metrics, edits, baseline_score=baseline)
+        if insights is None:
+            # Keep the watermark so the next run analyzes this evidence again
+            print(f"   ⚠️ {agent_type}: analysis unusable - watermark not advanced")
+            return []
+        self._store_insights(agent_type, insights)
+        
+        new_scores = [
+            (m.get('evaluation_details') or {}).get('overall_score') for m in metrics
+        ]
+        new_scores = [s for s in new_scores if isinstance(s, (int, float))]
+        self._save_watermark(agent_type, {
+            'last_metric_at': metrics[-1]['created_at'] if metrics else watermark.get('last_metric_at'),
+            'last_edit_at': edits[-1]['created_at'] if edits else watermark.get('last_edit_at'),
+            'metrics_processed': (watermark.get('metrics_processed') or 0) + len(new_scores),
+            'edits_processed': (watermark.get('edits_processed') or 0) + len(edits),
+            'score_sum': float(watermark.get('score_sum') or 0) + sum(new_scores),
+            'rubric_version': RUBRIC_VERSION,
+            'last_run_at': datetime.now().isoformat(),
+            'last_insight_count': len(insights)
+        })
+        
+        print(f"   🎓 Generated {len(insights)} learning insights from new evidence")
         return insights
     
+    def _load_watermark(self, agent_type: str) -> Dict[str, Any]:
+        result = supabase.table('reflection_watermarks')\
+            .select('*')\
+            .eq('agent_type', agent_type)\
+            .execute()
+        return result.data[0] if result.data else {}
+    
+    def _save_watermark(self, agent_type: str, values: Dict[str, Any]) -> None:
+        try:
+            supabase.table('reflection_watermarks').upsert(
+                {'agent_type': agent_type, **values}, on_conflict='agent_type'
+            ).execute()
+        except Exception as e:
+            print(f"   ⚠️ Failed to advance reflection watermark for {agent_type}: {str(e)}")
+    
     @weave.op()
     async def _analyze_patterns(
         self,
         agent_type: str,
         metrics: List[Dict],
-        edits: List[Dict]
-    ) -> List[Dict[str, Any]]:
-        """Use LLM to analyze patterns in metrics and edits"""
+        edits: List[Dict],
+        baseline_score: Optional[float] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Use LLM to analyze patterns in metrics and edits
+        
+        Returns:
+            Insights (possibly empty), or None when the response couldn't be parsed
+        """
         
         # Format metrics for LLM
-        metrics_summary = self._format_metrics(metrics)
-        edits_summary = self._format_edits(edits)
+        metrics_summary = self._format_metrics(metrics, baseline_score)
+        edits_summary = self._format_edits(edits, self._agent_to_content_type(agent_type))
         
         prompt = f"""You are analyzing an AI agent's performance to identify improvement patterns.
 
@@ -116,7 +266,7 @@ Identify 3-5 concrete, actionable patterns that would improve future generations
 
 Focus on:
 1. **What criteria consistently score low?** (Look for weaknesses)
-2. **What do tutors frequently edit?** (Look for gaps in AI output)
+2. **What do tutors frequently edit?** (Recurring field changes point to gaps in AI output)
 3. **Why do some generations score higher?** (Look for success patterns)
 4. **Cultural/contextual issues** (Student backgrounds, interests)
 5. **Structural improvements** (Activity types, lesson formats)
@@ -168,50 +318,18 @@ Return ONLY valid JSON:
         except Exception as e:
             print(f"   ⚠️  Insight parsing failed: {str(e)}")
         
-        return []
+        return None
     
-    def _format_metrics(self, metrics: List[Dict]) -> str:
-        """Format metrics for LLM"""
-        if not metrics:
-            return "No metrics available"
-        
-        lines = []
-        for i, metric in enumerate(metrics[:10]):  # Top 10
-            eval_data = metric.get('evaluation', {})
-            score = eval_data.get('overall_score', 0)
-            criteria = eval_data.get('criteria', {})
-            
-            # Get low-scoring criteria
-            low_criteria = [
-                f"{k.replace('_', ' ')}: {v.get('score', 0):.1f}"
-                for k, v in criteria.items()
-                if isinstance(v, dict) and v.get('score', 10) < 7
-            ]
-            
-            lines.append(
-                f"{i+1}. Overall: {score}/10 | Low scores: {', '.join(low_criteria) if low_criteria else 'None'}"
-            )
-        
-        # Calculate averages
-        scores = [m.get('evaluation', {}).get('overall_score', 0) for m in metrics]
-        avg_score = sum(scores) / len(scores) if scores else 0
-        
-        lines.append(f"\nAverage Score: {avg_score:.2f}/10")
-        
-        return "\n".join(lines)
+    def _format_metrics(self, metrics: List[Dict], baseline_score: Optional[float] = None) -> str:
+        """Format metrics for LLM (vectorized summary, not raw rows)"""
+        return format_metric_summary(summarize_metrics(metrics), baseline_score)
     
-    def _format_edits(self, edits: List[Dict]) -> str:
-        """Format tutor edits for LLM"""
+    def _format_edits(self, edits: List[Dict], content_type: str) -> str:
+        """Format tutor edits for LLM (structural change patterns, not raw notes)"""
         if not edits:
             return "No tutor edits available"
         
-        lines = []
-        for i, edit in enumerate(edits[:10]):
-            edit_notes = edit.get('edit_notes', 'No notes')
-            changes = edit.get('changes_summary', 'Changes not specified')
-            lines.append(f"{i+1}. WHY: {edit_notes} | WHAT: {changes}")
-        
-        return "\n".join(lines)
+        return format_edit_patterns(mine_edits(content_type, edits))
     
     def _agent_to_content_type(self, agent_type: str) -> str:
         """Map agent type to content type"""
@@ -226,21 +344,20 @@ Return ONLY valid JSON:
     async def get_relevant_insights(
         self,
         agent_type: str,
-        max_insights: int = 5
+        max_insights: int = 5,
+        query: Optional[str] = None
     ) -> List[Dict[str, Any]]:
         """
         Retrieve most relevant learning insights for this agent
         To be prepended to prompts for adaptive generation
-        """
-        result = supabase.table('cross_agent_learning')\
-            .select('*')\
-            .or_(f'source_agent.eq.{agent_type},target_agent.eq.{agent_type}')\
-            .order('confidence', desc=True)\
-            .order('created_at', desc=True)\
-            .limit(max_insights)\
-            .execute()
         
-        insights = result.data if result.data else []
+        Args:
+            agent_type: Agent the insights must apply to
+            max_insights: Insights to return
+            query: Current topic / subject / grade; ranks by relevance (otherwise
+                   by confidence and recency)
+        """
+        insights = agent_insight_index.search(query or '', limit=max_insights, agent=agent_type)
         
         if insights:
             print(f"   🎓 Retrieved {len(insights)} learning insights for {agent_type}")
@@ -265,8 +382,8 @@ def format_insights_for_prompt(insights: List[Dict[str, Any]]) -> str:
     lines.append("")
     
     for i, insight in enumerate(insights, 1):
-        confidence_emoji = "🟢" if insight.get('confidence', 0) > 0.8 else "🟡"
-        lines.append(f"{i}. {confidence_emoji} {insight.get('insight', '')}")
+        confidence_emoji = "🟢" if (insight.get('confidence_score') or 0) > 0.8 else "🟡"
+        lines.append(f"{i}. {confidence_emoji} {insight.get('pattern_detected', '')}")
         
         action = insight.get('action')
         if action:
@@ -281,6 +398,47 @@ def format_insights_for_prompt(insights: List[Dict[str, Any]]) -> str:
 reflection_service = ReflectionService()
 
 
+async def _reflect_agent(agent_type: str, lookback_days: int) -> Dict[str, Any]:
+    """One agent's window analysis as a result entry (errors are captured, not raised)"""
+    started = time.monotonic()
+    try:
+        insights = await reflection_service.generate_learning_insights(
+            agent_type=agent_type,
+            lookback_days=lookback_days
+        )
+        return {
+            'agent_type': agent_type,
+            'insights': insights,
+            'seconds': round(time.monotonic() - started, 1)
+        }
+    except Exception as e:
+        return {
+            'agent_type': agent_type,
+            'insights': [],
+            'error': str(e),
+            'seconds': round(time.monotonic() - started, 1)
+        }
+
+
+async def reflect_agents(
+    agent_types: Optional[List[str]] = None,
+    lookback_days: int = 7
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Analyze agents concurrently, yielding each agent's result as soon as it finishes
+
+    The Gemini calls share the provider limiter in ai_service, so this never exceeds
+    the configured concurrency however many agents run at once.
+    """
+    tasks = [asyncio.create_task(_reflect_agent(a, lookback_days)) for a in (agent_types or REFLECTION_AGENTS)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
 # Background task to run periodically (call this from a cron job or FastAPI background task)
 async def run_reflection_analysis():
     """
@@ -291,16 +449,56 @@ async def run_reflection_analysis():
     print("🧠 STARTING REFLECTION ANALYSIS")
     print("=" * 60)
     
-    for agent_type in ['strategy_creator', 'lesson_creator', 'activity_creator']:
-        try:
-            insights = await reflection_service.generate_learning_insights(
-                agent_type=agent_type,
-                lookback_days=7
-            )
-            print(f"✅ {agent_type}: Generated {len(insights)} insights")
-        except Exception as e:
-            print(f"❌ {agent_type}: Reflection failed - {str(e)}")
+    async for result in reflect_agents():
+        if result.get('error'):
+            print(f"❌ {result['agent_type']}: Reflection failed - {result['error']}")
+        else:
+            print(f"✅ {result['agent_type']}: Generated {len(result['insights'])} insights ({result['seconds']}s)")
     
     print("=" * 60)
     print("🎓 REFLECTION COMPLETE\n")
 
+
+async def run_incremental_reflection(min_new_evidence: int = 5) -> Dict[str, Any]:
+    """
+    One pass of the incremental reflector over all agents
+
+    Returns:
+        Insight count per agent (None where there wasn't enough new evidence)
+    """
+    async def reflect(agent_type: str):
+        try:
+            insights = await reflection_service.reflect_incremental(agent_type, min_new_evidence)
+            return None if insights is None else len(insights)
+        except Exception as e:
+            print(f"❌ {agent_type}: Incremental reflection failed - {str(e)}")
+            return None
+
+    counts = await asyncio.gather(*(reflect(agent_type) for agent_type in REFLECTION_AGENTS))
+    return dict(zip(REFLECTION_AGENTS, counts))
+
+
+async def start_reflection_loop(
+    interval_seconds: Optional[float] = None,
+    min_new_evidence: Optional[int] = None
+):
+    """
+    Background reflector: every interval, analyze agents with enough new evidence
+    and consolidate the reflection insights when new ones were stored
+
+    Configured by REFLECTION_INTERVAL_SECONDS (default 600) and
+    REFLECTION_MIN_EVIDENCE (default 5); runs until cancelled.
+    """
+    interval_seconds = interval_seconds or float(os.getenv("REFLECTION_INTERVAL_SECONDS", "600"))
+    min_new_evidence = min_new_evidence or int(os.getenv("REFLECTION_MIN_EVIDENCE", "5"))
+    print(f"🧠 Reflection loop started (every {interval_seconds:.0f}s, min {min_new_evidence} new records)")
+
+    while True:
+        counts = await run_incremental_reflection(min_new_evidence)
+        # New insights are deduplicated on write; this folds in rows other workers wrote
+        if any(counts.values()):
+            try:
+                await consolidate_insights(tables=['cross_agent_learning'])
+            except Exception as e:
+                print(f"❌ Insight consolidation failed - {str(e)}")
+        await asyncio.sleep(interval_seconds)
@@ -4,21 +4,24 @@ Generates 4-week personalized learning strategies with self-evaluation
 """
 
 import json
+import asyncio
 import weave
-from typing import Dict, Any, List
-from uuid import UUID, uuid4
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+from uuid import UUID, uuid4, uuid5, NAMESPACE_URL
 from datetime import datetime
 
 from services.ai_service import call_google_learnlm
 from services.knowledge_service import explain_multiple_topics
 from services.memory_service import (
     load_student_memories,
-    load_learning_insights,
     store_performance_metric,
-    format_insights_for_prompt,
     format_sources
 )
-from agents.evaluator import evaluator
+from services.insight_digest import load_insight_digest
+from services.checkpoint_service import load_checkpoints
+from services.pipeline_dag import PipelineDAG, add_evaluation_stages, evaluate_in_background
+from services.strategy_index import sync_strategy_weeks
+from agents.evaluator import evaluator, EvaluationBatcher, BATCH_SIZE
 from db.supabase_client import supabase, get_student, get_tutor
 
 
@@ -27,7 +30,12 @@ async def generate_strategy(
     student_id: str,
     tutor_id: str,
     subject: str,
-    weeks: int = 4
+    weeks: int = 4,
+    on_stage: Optional[Callable[[str], Awaitable[None]]] = None,
+    request_id: Optional[str] = None,
+    shared_context: Optional[Dict[str, Any]] = None,
+    evaluation_mode: str = 'overlap',
+    evaluation_batcher: Optional[EvaluationBatcher] = None
 ) -> Dict[str, Any]:
     """
     Generate a comprehensive learning strategy with self-evaluation
@@ -37,96 +45,308 @@ async def generate_strategy(
         tutor_id: Tutor UUID
         subject: Subject area (e.g., "Physics", "Chemistry")
         weeks: Number of weeks (default: 4)
+        on_stage: Optional async callback invoked with each pipeline stage name
+        request_id: Optional idempotency key; completed stages are checkpointed
+                    under it and skipped when the same request is retried
+        shared_context: Optional stage outputs computed once for a cohort
+                        ('topics', 'research'); those stages are skipped
+        evaluation_mode: 'overlap' (evaluate alongside persistence, default),
+                         'sync' (evaluate before storing) or 'background'
+                         (return once stored; self_evaluation is patched later)
+        evaluation_batcher: Optional EvaluationBatcher shared by a batch job; the
+                            evaluation is packed into one call with its siblings
         
     Returns:
         Dict with strategy content and self-evaluation
     """
     print(f"\n🎯 Generating {weeks}-week strategy for {subject}...")
+    checkpoints = await load_checkpoints(request_id, 'strategy')
     
-    # Step 1: Load student and tutor data
-    student = await get_student(student_id)
-    tutor = await get_tutor(tutor_id)
-    
-    if not student:
-        raise ValueError(f"Student {student_id} not found")
-    if not tutor:
-        raise ValueError(f"Tutor {tutor_id} not found")
-    
-    print(f"   Student: {student['name']} (Grade {student['grade']})")
-    print(f"   Tutor: {tutor['name']} ({tutor.get('teaching_style', 'Standard')})")
-    
-    # Step 2: Load memories and insights for adaptive prompting
-    memories = await load_student_memories(student_id, limit=10)
-    insights = await load_learning_insights(student['grade'], subject, limit=5)
+    # Step 1: Load student, tutor and memories for adaptive prompting
+    async def load_profile(results):
+        student = await get_student(student_id)
+        tutor = await get_tutor(tutor_id)
+        
+        if not student:
+            raise ValueError(f"Student {student_id} not found")
+        if not tutor:
+            raise ValueError(f"Tutor {tutor_id} not found")
+        
+        memories = await load_student_memories(student_id, limit=10)
+        print(f"   Student: {student['name']} (Grade {student['grade']})")
+        print(f"   Tutor: {tutor['name']} ({tutor.get('teaching_style', 'Standard')})")
+        print(f"   Loaded {len(memories)} student memories")
+        return {'student': student, 'tutor': tutor, 'memories': memories}
     
-    print(f"   Loaded {len(memories)} student memories")
-    print(f"   Loaded {len(insights)} learning insights")
+    # Step 2: Learning insights (runs alongside topic generation)
+    async def load_insights(results):
+        student = results['profile']['student']
+        digest = await load_insight_digest('strategy_planner', student['grade'], subject)
+        print(f"   Loaded {digest['insight_count']} learning insights (~{digest['token_count']} tokens)")
+        return digest['prompt_text']
     
-    # Step 3: Generate weekly topics (now returns list of strings)
-    week_topics = await generate_weekly_topics(student, tutor, subject, weeks)
-    print(f"   Generated {len(week_topics)} weekly topics")
+    # Step 3: Generate weekly topics
+    async def topics(results):
+        profile = results['profile']
+        week_topics = await generate_weekly_topics(profile['student'], profile['tutor'], subject, weeks)
+        print(f"   Generated {len(week_topics)} weekly topics")
+        return week_topics
     
     # Step 4: Call Layer 1 to explain all topics in parallel
-    knowledge_contexts = await explain_multiple_topics(
-        topics=week_topics,  # week_topics is already a list of strings
-        grade=student['grade'],
-        subject=subject
-    )
-    print(f"   Retrieved knowledge for {len(knowledge_contexts)} topics")
+    async def research(results):
+        knowledge_contexts = await explain_multiple_topics(
+            topics=results['topics'],  # week_topics is already a list of strings
+            grade=results['profile']['student']['grade'],
+            subject=subject
+        )
+        print(f"   Retrieved knowledge for {len(knowledge_contexts)} topics")
+        return knowledge_contexts
     
     # Step 5: Generate comprehensive strategy
-    strategy_content = await generate_full_strategy(
-        student=student,
-        tutor=tutor,
-        week_topics=week_topics,
-        knowledge_contexts=knowledge_contexts,
-        learning_insights=insights
-    )
+    async def draft(results):
+        return await generate_full_strategy(
+            student=results['profile']['student'],
+            tutor=results['profile']['tutor'],
+            week_topics=results['topics'],
+            knowledge_contexts=results['research'],
+            insights_prompt=results['insights']
+        )
     
     # Step 6: Self-evaluate the strategy
-    print("   🔍 Self-evaluating strategy...")
-    evaluation = await evaluator.evaluate_strategy(strategy_content, student)
-    
-    print(f"   📊 Overall Score: {evaluation['overall_score']}/10")
-    
-    # Step 7: Store in database
-    strategy_id = uuid4()
-    strategy_record = {
-        'id': str(strategy_id),
-        'tutor_id': tutor_id,
-        'student_id': student_id,
-        'title': f"{weeks}-Week {subject} Strategy for {student['name']}",
-        'description': f"Personalized learning strategy for grade {student['grade']} {subject}",
-        'weeks_count': weeks,
-        'content': strategy_content,
-        'knowledge_contexts': knowledge_contexts,  # NEW: Store all research for lessons/activities!
-        'self_evaluation': evaluation,
-        'created_at': datetime.now().isoformat(),
-        'updated_at': datetime.now().isoformat()
-    }
+    async def evaluate(results):
+        print("   🔍 Self-evaluating strategy...")
+        if evaluation_batcher:
+            evaluation = await evaluation_batcher.evaluate(results['draft'], results['profile']['student'])
+        else:
+            evaluation = await evaluator.evaluate_strategy(results['draft'], results['profile']['student'])
+        print(f"   📊 Overall Score: {evaluation['overall_score']}/10")
+        return evaluation
     
-    supabase.table('strategies').insert(strategy_record).execute()
-    print(f"   ✅ Strategy stored (ID: {strategy_id})")
+    # Step 7: Store in database (overlaps with evaluation)
+    async def persist(results):
+        # Deterministic id + upsert keeps a retried persistence stage from duplicating rows
+        strategy_id = uuid5(NAMESPACE_URL, f"strategy:{request_id}") if request_id else uuid4()
+        student = results['profile']['student']
+        strategy_record = {
+            'id': str(strategy_id),
+            'tutor_id': tutor_id,
+            'student_id': student_id,
+            'title': f"{weeks}-Week {subject} Strategy for {student['name']}",
+            'description': f"Personalized learning strategy for grade {student['grade']} {subject}",
+            'weeks_count': weeks,
+            'content': results['draft'],
+            'knowledge_contexts': results['research'],  # NEW: Store all research for lessons/activities!
+            'created_at': datetime.now().isoformat(),
+            'updated_at': datetime.now().isoformat()
+        }
+        
+        supabase.table('strategies').upsert(strategy_record).execute()
+        print(f"   ✅ Strategy stored (ID: {strategy_id})")
+        
+        # Per-week index so lesson creation never re-parses the markdown
+        await sync_strategy_weeks(str(strategy_id), results['draft'], results['research'], version_number=1)
+        return {'strategy_id': str(strategy_id)}
     
-    # Step 8: Store performance metric
-    await store_performance_metric(
-        agent_type='strategy_planner',
-        evaluation=evaluation,
-        session_id=str(strategy_id)
+    # Step 8: Attach the evaluation and store the performance metric
+    async def finalize(results):
+        strategy_id = results['persistence']['strategy_id']
+        supabase.table('strategies')\
+            .update({'self_evaluation': results['evaluation']})\
+            .eq('id', strategy_id)\
+            .execute()
+        
+        await store_performance_metric(
+            agent_type='strategy_planner',
+            evaluation=results['evaluation'],
+            session_id=strategy_id
+        )
+        return {'strategy_id': strategy_id}
+    
+    dag = PipelineDAG('strategy')\
+        .add('profile', load_profile)\
+        .add('insights', load_insights, depends_on=['profile'])\
+        .add('topics', topics, depends_on=['profile'])\
+        .add('research', research, depends_on=['profile', 'topics'])\
+        .add('draft', draft, depends_on=['profile', 'topics', 'research', 'insights'])
+    add_evaluation_stages(
+        dag, evaluation_mode, evaluate, persist, finalize,
+        evaluate_after=['profile', 'draft'],
+        persist_after=['profile', 'draft', 'research']
     )
+    results = await dag.run(checkpoints, on_stage, preloaded=shared_context)
+    if evaluation_mode == 'background':
+        evaluate_in_background(results, evaluate, finalize, checkpoints, label='strategy evaluation')
     
     # Collect all sources from all knowledge contexts
     all_sources = []
-    for context in knowledge_contexts:
+    for context in results['research']:
         all_sources.extend(context.get('sources', []))
     
     return {
-        'strategy_id': str(strategy_id),
-        'content': strategy_content,
-        'evaluation': evaluation,
-        'student': student,
-        'tutor': tutor,
-        'sources': all_sources  # Include all Perplexity sources
+        'strategy_id': results['persistence']['strategy_id'],
+        'content': results['draft'],
+        'evaluation': results.get('evaluation'),  # None until the background evaluation lands
+        'evaluation_status': 'pending' if evaluation_mode == 'background' else 'complete',
+        'student': results['profile']['student'],
+        'tutor': results['profile']['tutor'],
+        'sources': all_sources,  # Include all Perplexity sources
+        'timings': dag.timings
+    }
+
+
+@weave.op()
+async def generate_cohort_strategies(
+    student_ids: List[str],
+    tutor_id: str,
+    subject: str,
+    weeks: int = 4,
+    concurrency: int = 3,
+    on_stage: Optional[Callable[..., Awaitable[None]]] = None,
+    request_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Generate strategies for a cohort of students with shared topic research
+    
+    Students are grouped by grade; each group gets one set of weekly topics and one
+    round of research (deduplicated across the cohort), then every student's
+    strategy is personalized (draft, evaluation, persistence) with bounded concurrency.
+    
+    Args:
+        student_ids: Students in the cohort
+        tutor_id: Tutor UUID
+        subject: Subject area
+        weeks: Number of weeks (default: 4)
+        concurrency: Max student strategies drafted at the same time
+        on_stage: Async callback (stage, detail=None); emits 'strategy_completed'
+                  as soon as each student's strategy is stored
+        request_id: Cohort idempotency key (shared research and each student resume)
+        
+    Returns:
+        Dict with strategies, per-student failures and a research savings report
+    """
+    student_ids = list(dict.fromkeys(student_ids))  # Drop duplicate ids, keep order
+    if not student_ids:
+        raise ValueError("Cohort must contain at least one student")
+    
+    tutor = await get_tutor(tutor_id)
+    if not tutor:
+        raise ValueError(f"Tutor {tutor_id} not found")
+    
+    print(f"\n👥 Generating {weeks}-week {subject} strategies for a cohort of {len(student_ids)}...")
+    
+    students = {}
+    for student_id in student_ids:
+        student = await get_student(student_id)
+        if not student:
+            raise ValueError(f"Student {student_id} not found")
+        students[student_id] = student
+    
+    # Research depends on grade, so the cohort shares it per grade group
+    grade_groups: Dict[str, List[str]] = {}
+    for student_id, student in students.items():
+        grade_groups.setdefault(student['grade'], []).append(student_id)
+    
+    checkpoints = await load_checkpoints(f"{request_id}:cohort" if request_id else None, 'strategy')
+    
+    async def research_group(grade: str, member_ids: List[str]):
+        members = [students[sid] for sid in member_ids]
+        cohort_profile = {
+            'name': f"Grade {grade} cohort ({len(members)} students)",
+            'grade': grade,
+            'learning_style': 'Mixed',
+            'interests': list(dict.fromkeys(i for m in members for i in (m.get('interests') or [])))[:8],
+            'objectives': list(dict.fromkeys(o for m in members for o in (m.get('objectives') or [])))[:8]
+        }
+        week_topics = await generate_weekly_topics(cohort_profile, tutor, subject, weeks)
+        
+        # Identical topics are researched once
+        unique_topics = list(dict.fromkeys(week_topics))
+        explained = await explain_multiple_topics(topics=unique_topics, grade=grade, subject=subject)
+        by_topic = dict(zip(unique_topics, explained))
+        return {'topics': week_topics, 'research': [by_topic[t] for t in week_topics]}
+    
+    if on_stage:
+        await on_stage('shared_research')
+    shared_by_grade = {}
+    for grade, member_ids in grade_groups.items():
+        shared_by_grade[grade] = await checkpoints.run(
+            f"research_grade_{grade}",
+            lambda grade=grade, member_ids=member_ids: research_group(grade, member_ids)
+        )
+    
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    batcher = EvaluationBatcher('strategy', max_batch=min(BATCH_SIZE, concurrency))
+    strategies = []
+    failures = []
+    
+    async def run_student(student_id: str):
+        shared = shared_by_grade[students[student_id]['grade']]
+        
+        async def student_stage(stage: str):
+            if on_stage:
+                await on_stage(f"{student_id}:{stage}")
+        
+        try:
+            async with semaphore:
+                result = await generate_strategy(
+                    student_id=student_id,
+                    tutor_id=tutor_id,
+                    subject=subject,
+                    weeks=weeks,
+                    on_stage=student_stage,
+                    request_id=f"{request_id}:{student_id}" if request_id else None,
+                    shared_context={'topics': shared['topics'], 'research': shared['research']},
+                    evaluation_batcher=batcher
+                )
+            entry = {
+                'student_id': student_id,
+                'strategy_id': result['strategy_id'],
+                'content': result['content'],
+                'evaluation': result['evaluation']
+            }
+            strategies.append(entry)
+            print(f"   ✅ Strategy for {students[student_id]['name']} ready ({len(strategies)}/{len(student_ids)})")
+            if on_stage:
+                await on_stage('strategy_completed', entry)
+        except Exception as e:
+            print(f"   ❌ Strategy for student {student_id} failed: {str(e)}")
+            failures.append({'student_id': student_id, 'error': str(e)})
+            if on_stage:
+                await on_stage('strategy_failed', failures[-1])
+    
+    await asyncio.gather(*(run_student(sid) for sid in student_ids))
+    
+    if failures and not strategies:
+        raise RuntimeError(f"All {len(student_ids)} strategies failed: {failures[0]['error']}")
+    
+    # Savings vs. one strategy call per student: each skipped topic list is one LLM
+    # call, each skipped explanation is one query-generation call + its Perplexity queries
+    topic_calls_saved = len(student_ids) - len(grade_groups)
+    explanations_saved = 0
+    research_calls_saved = 0
+    for grade, member_ids in grade_groups.items():
+        research = shared_by_grade[grade]['research']
+        unique = {ctx.get('topic'): ctx for ctx in research}
+        per_student_calls = sum(1 + ctx.get('query_count', 0) for ctx in research)
+        shared_calls = sum(1 + ctx.get('query_count', 0) for ctx in unique.values())
+        explanations_saved += len(member_ids) * len(research) - len(unique)
+        research_calls_saved += len(member_ids) * per_student_calls - shared_calls
+    
+    report = {
+        'students': len(student_ids),
+        'grade_groups': len(grade_groups),
+        'topic_generation_calls_saved': topic_calls_saved,
+        'topic_explanations_saved': explanations_saved,
+        'upstream_calls_saved': topic_calls_saved + research_calls_saved,
+        'evaluation_calls_saved': batcher.calls_saved
+    }
+    print(f"   ♻️ Shared research saved {report['upstream_calls_saved']} upstream calls "
+          f"({explanations_saved} topic explanations)")
+    
+    return {
+        'strategies': sorted(strategies, key=lambda s: student_ids.index(s['student_id'])),
+        'failures': failures,
+        'savings': report
     }
 
 
@@ -198,16 +418,16 @@ async def generate_full_strategy(
     tutor: Dict,
     week_topics: List[str],
     knowledge_contexts: List[Dict],
-    learning_insights: List[Dict]
+    insights_prompt: str
 ) -> Dict:
     """Generate a comprehensive, pedagogically-rich learning strategy in free-form markdown"""
     
-    # Build insights section for adaptive prompting
+    # Build insights section for adaptive prompting (pre-formatted insight digest)
     insights_section = ""
-    if learning_insights:
+    if insights_prompt:
         insights_section = f"""
 IMPORTANT LEARNINGS FROM PREVIOUS STRATEGIES:
-{format_insights_for_prompt(learning_insights)}
+{insights_prompt}
 
 ⚠️ Incorporate these insights to create an even stronger strategy.
 """
@@ -0,0 +1,130 @@
+"""
+Code Autofix Benchmark
+Runs the rule-based auto-fixer over a corpus of past generated activities
+
+Usage:
+    python benchmark_autofix.py                              # activities table
+    AUTOFIX_BENCHMARK_DIR=./corpus python benchmark_autofix.py   # *.jsx / *.js files
+
+Reports how many activities each rule would rewrite, what stayed unresolved, whether
+a second pass is a no-op (rewrites must be idempotent) and the time per activity.
+Stored activity code is the final deployed version, so defects the model fixer
+already repaired are not counted: treat the rewrite rates as a lower bound.
+"""
+
+import os
+import re
+import time
+import statistics
+from pathlib import Path
+from collections import Counter
+from typing import List, Dict, Any
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from services.code_autofix import autofix_code, summarize_rewrites
+
+PAGE_SIZE = 500
+
+
+def load_activity_corpus(limit: int) -> List[Dict[str, Any]]:
+    """Generated code of the most recent activities (paged)"""
+    from db.supabase_client import supabase
+
+    corpus: List[Dict[str, Any]] = []
+    while len(corpus) < limit:
+        page = supabase.table('activities')\
+            .select('id, code, content, deployment_status, deployment_attempts')\
+            .order('created_at', desc=True)\
+            .range(len(corpus), min(limit, len(corpus) + PAGE_SIZE) - 1)\
+            .execute().data or []
+        corpus.extend(page)
+        if len(page) < PAGE_SIZE:
+            break
+    # The activity pipeline records deployment outcome in content, older rows in columns
+    return [{
+        'id': row['id'],
+        'code': row['code'],
+        'deployment_status': row.get('deployment_status') or (row.get('content') or {}).get('deployment_status'),
+        'deployment_attempts': row.get('deployment_attempts') or (row.get('content') or {}).get('attempts_needed')
+    } for row in corpus if row.get('code')]
+
+
+def load_file_corpus(directory: str) -> List[Dict[str, Any]]:
+    """Code files from a local directory (e.g. exported failing drafts)"""
+    paths = sorted(p for p in Path(directory).rglob('*') if p.suffix in ('.jsx', '.js'))
+    return [{'id': str(path), 'code': path.read_text(encoding='utf-8')} for path in paths]
+
+
+def run_benchmark(corpus: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Auto-fix every item and aggregate the results
+
+    Returns:
+        Dict with corpus size, changed count, rewrites per rule, activities touched
+        per rule, unresolved issue counts, non-idempotent ids and timings (ms)
+    """
+    rewrites_by_rule, activities_by_rule, unresolved = Counter(), Counter(), Counter()
+    timings, not_idempotent = [], []
+    changed = retried_changed = retried = 0
+
+    for item in corpus:
+        started = time.perf_counter()
+        result = autofix_code(item['code'])
+        timings.append((time.perf_counter() - started) * 1000)
+
+        counts = summarize_rewrites(result['rewrites'])
+        rewrites_by_rule.update(counts)
+        activities_by_rule.update(counts.keys())
+        unresolved.update(re.sub(r' \(line \d+\)', '', issue).split(':')[0] for issue in result['unresolved'])
+
+        needed_retries = (item.get('deployment_attempts') or 0) > 1 or item.get('deployment_status') == 'failed'
+        retried += needed_retries
+        if result['changed']:
+            changed += 1
+            retried_changed += needed_retries
+            if autofix_code(result['code'])['changed']:
+                not_idempotent.append(item['id'])
+
+    timings.sort()
+    return {
+        'activities': len(corpus),
+        'changed': changed,
+        'rewrites_by_rule': dict(rewrites_by_rule),
+        'activities_by_rule': dict(activities_by_rule),
+        'unresolved': dict(unresolved),
+        'needed_retries': retried,
+        'needed_retries_changed': retried_changed,
+        'not_idempotent': not_idempotent,
+        'ms_mean': round(statistics.mean(timings), 2) if timings else 0.0,
+        'ms_p95': round(timings[int(len(timings) * 0.95)] if timings else 0.0, 2),
+        'ms_max': round(timings[-1], 2) if timings else 0.0
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    total = report['activities'] or 1
+    print(f"\n📊 Auto-fix benchmark: {report['activities']} activities")
+    print(f"   ✏️ Changed: {report['changed']} ({report['changed'] / total:.0%})")
+    for rule, count in sorted(report['rewrites_by_rule'].items()):
+        print(f"      • {rule}: {count} rewrites in {report['activities_by_rule'][rule]} activities")
+    if report['needed_retries']:
+        print(f"   🔁 Needed a model fix or failed: {report['needed_retries']} "
+              f"({report['needed_retries_changed']} of them still changed by the rules)")
+    for issue, count in sorted(report['unresolved'].items(), key=lambda kv: -kv[1]):
+        print(f"   ⚠️ Unresolved — {issue}: {count}")
+    if report['not_idempotent']:
+        print(f"   ❌ Second pass changed {len(report['not_idempotent'])} activities: {report['not_idempotent'][:5]}")
+    else:
+        print(f"   ✅ Idempotent on every changed activity")
+    print(f"   ⏱️ {report['ms_mean']} ms mean, {report['ms_p95']} ms p95, {report['ms_max']} ms max per activity")
+
+
+if __name__ == "__main__":
+    directory = os.getenv("AUTOFIX_BENCHMARK_DIR")
+    if directory:
+        corpus = load_file_corpus(directory)
+    else:
+        corpus = load_activity_corpus(int(os.getenv("AUTOFIX_BENCHMARK_LIMIT", "1000")))
+    print_report(run_benchmark(corpus))
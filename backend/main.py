@@ -5,9 +5,11 @@ Self-Improving AI Tutoring Platform
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from contextlib import asynccontextmanager
 import weave
 import os
+import json
 from dotenv import load_dotenv
 import asyncio
 
@@ -17,9 +19,6 @@ load_dotenv()
 # Initialize Weave for tracing
 weave.init(os.getenv("WEAVE_PROJECT_NAME", "tutorpilot-weavehacks"))
 
-# Import services (will create these next)
-# from services.learning_service import start_reflection_loop
-
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -28,14 +27,40 @@ async def lifespan(app: FastAPI):
     print("🚀 TutorPilot backend starting...")
     print(f"📊 Weave tracing enabled: {os.getenv('WEAVE_PROJECT_NAME')}")
     
-    # Start background reflection loop
-    # reflection_task = asyncio.create_task(start_reflection_loop())
+    # Start the incremental reflection loop (analyzes only new metrics/edits)
+    reflection_task = None
+    if os.getenv("REFLECTION_LOOP_ENABLED", "true").lower() == "true":
+        from agents.reflection_service import start_reflection_loop
+        reflection_task = asyncio.create_task(start_reflection_loop())
+    
+    # Periodically fold old student memories into summaries (keeps memory reads top-k)
+    compaction_task = None
+    if os.getenv("MEMORY_COMPACTION_ENABLED", "true").lower() == "true":
+        from services.memory_service import start_memory_compaction_loop
+        compaction_task = asyncio.create_task(start_memory_compaction_loop())
+    
+    # Start an in-process job worker (run `python worker.py` for dedicated workers)
+    worker_task = None
+    if os.getenv("JOB_WORKER_INPROCESS", "true").lower() == "true":
+        from worker import run_worker
+        worker_task = asyncio.create_task(run_worker(
+            concurrency=int(os.getenv("JOB_WORKER_CONCURRENCY", "2"))
+        ))
     
     yield
     
     # Shutdown
     print("👋 TutorPilot backend shutting down...")
-    # reflection_task.cancel()
+    if worker_task:
+        worker_task.cancel()
+    from services.save_coalescer import save_coalescer
+    await save_coalescer.flush_all()
+    from services.pipeline_dag import drain_background_evaluations
+    await drain_background_evaluations()
+    if reflection_task:
+        reflection_task.cancel()
+    if compaction_task:
+        compaction_task.cancel()
 
 
 app = FastAPI(
@@ -85,63 +110,79 @@ async def health_check():
 # ==========================================
 
 @app.post("/api/v1/reflection/analyze")
-async def trigger_reflection_analysis(agent_type: str = None):
+async def trigger_reflection_analysis(agent_type: str = None, stream: bool = False):
     """
     Trigger reflection analysis to generate learning insights
     This is the self-improvement loop!
     
+    Agents are analyzed concurrently (bounded by the provider limiter).
+    
     Args:
         agent_type: Optional - specific agent to analyze, or None for all
+        stream: Return Server-Sent Events: an `agent` event per agent as it
+                finishes, then a `done` summary
     """
     try:
-        from agents.reflection_service import reflection_service
+        from agents.reflection_service import reflect_agents
+        
+        agent_types = [agent_type] if agent_type else None
+        
+        if stream:
+            async def events():
+                total = 0
+                async for result in reflect_agents(agent_types, lookback_days=7):
+                    total += len(result['insights'])
+                    yield f"event: agent\ndata: {json.dumps(result, default=str)}\n\n"
+                yield f"event: done\ndata: {json.dumps({'total_insights': total})}\n\n"
+            
+            return StreamingResponse(events(), media_type="text/event-stream")
+        
+        results = {}
+        async for result in reflect_agents(agent_types, lookback_days=7):
+            results[result['agent_type']] = result
         
         if agent_type:
-            insights = await reflection_service.generate_learning_insights(
-                agent_type=agent_type,
-                lookback_days=7
-            )
+            result = results[agent_type]
+            if result.get('error'):
+                raise HTTPException(status_code=500, detail=result['error'])
             return {
                 "success": True,
                 "agent_type": agent_type,
-                "insights_generated": len(insights),
-                "insights": insights
-            }
-        else:
-            # Analyze all agents
-            all_insights = {}
-            for agent in ['strategy_creator', 'lesson_creator', 'activity_creator']:
-                insights = await reflection_service.generate_learning_insights(
-                    agent_type=agent,
-                    lookback_days=7
-                )
-                all_insights[agent] = insights
-            
-            return {
-                "success": True,
-                "insights_by_agent": {
-                    agent: len(insights)
-                    for agent, insights in all_insights.items()
-                },
-                "total_insights": sum(len(i) for i in all_insights.values()),
-                "details": all_insights
+                "insights_generated": len(result['insights']),
+                "insights": result['insights']
             }
+        
+        return {
+            "success": True,
+            "insights_by_agent": {
+                agent: len(result['insights'])
+                for agent, result in results.items()
+            },
+            "total_insights": sum(len(r['insights']) for r in results.values()),
+            "details": {agent: result['insights'] for agent, result in results.items()},
+            "errors": {agent: result['error'] for agent, result in results.items() if result.get('error')},
+            "seconds_by_agent": {agent: result['seconds'] for agent, result in results.items()}
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/v1/reflection/insights/{agent_type}")
-async def get_learning_insights(agent_type: str):
+async def get_learning_insights(agent_type: str, query: str = None):
     """
     Get learning insights for a specific agent
     Shows what the AI has learned from past generations
+    (ranked by relevance to `query` when given, e.g. a topic)
     """
     try:
         from agents.reflection_service import reflection_service
         
         insights = await reflection_service.get_relevant_insights(
             agent_type=agent_type,
-            max_insights=10
+            max_insights=10,
+            query=query
         )
         
         return {
@@ -185,13 +226,18 @@ async def get_tutors():
 
 @app.get("/api/v1/data/strategies/{student_id}")
 async def get_student_strategies(student_id: str):
-    """Get all strategies for a student"""
+    """Get all strategies for a student (buffered autosaves are committed first)"""
     try:
-        response = supabase.table('strategies')\
-            .select('id, title, content, created_at')\
-            .eq('student_id', student_id)\
-            .order('created_at', desc=True)\
-            .execute()
+        def load():
+            return supabase.table('strategies')\
+                .select('id, title, content, created_at')\
+                .eq('student_id', student_id)\
+                .order('created_at', desc=True)\
+                .execute()
+
+        response = load()
+        if await save_coalescer.flush_contents('strategy', [row['id'] for row in response.data or []]):
+            response = load()
         return {
             "success": True,
             "strategies": response.data
@@ -202,13 +248,18 @@ async def get_student_strategies(student_id: str):
 
 @app.get("/api/v1/data/lessons/{student_id}")
 async def get_student_lessons(student_id: str):
-    """Get all lessons for a student"""
+    """Get all lessons for a student (buffered autosaves are committed first)"""
     try:
-        response = supabase.table('lessons')\
-            .select('id, title, content, strategy_id, strategy_week_number, created_at')\
-            .eq('student_id', student_id)\
-            .order('created_at', desc=True)\
-            .execute()
+        def load():
+            return supabase.table('lessons')\
+                .select('id, title, content, strategy_id, strategy_week_number, created_at')\
+                .eq('student_id', student_id)\
+                .order('created_at', desc=True)\
+                .execute()
+
+        response = load()
+        if await save_coalescer.flush_contents('lesson', [row['id'] for row in response.data or []]):
+            response = load()
         return {
             "success": True,
             "lessons": response.data
@@ -234,13 +285,20 @@ async def get_student_activities(student_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# Import agents
-from agents.strategy_planner import generate_strategy
-from agents.lesson_creator import generate_lesson
-from agents.activity_creator import generate_activity
+# Import services
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from db.supabase_client import supabase
+from services.version_service import (
+    save_content_version as save_version,
+    load_version_history,
+    load_version_content,
+    load_version_diff,
+    encode_code_snapshot,
+    reconstruct_chat_history
+)
+from services.save_coalescer import save_coalescer
+from services.job_queue import enqueue_job, get_job
 
 # Request models
 class StrategyRequest(BaseModel):
@@ -248,6 +306,15 @@ class StrategyRequest(BaseModel):
     tutor_id: str
     subject: str
     weeks: int = 4
+    request_id: Optional[str] = None  # Resume key: reuses checkpointed stages of an earlier run
+    evaluation_mode: str = 'overlap'  # 'overlap', 'sync' or 'background'
+
+class CohortStrategyRequest(BaseModel):
+    student_ids: List[str]
+    tutor_id: str
+    subject: str
+    weeks: int = 4
+    concurrency: int = 3  # Student strategies drafted at the same time
 
 class LessonRequest(BaseModel):
     student_id: str
@@ -256,6 +323,8 @@ class LessonRequest(BaseModel):
     duration: int = 60
     strategy_id: Optional[str] = None  # If creating from strategy week
     strategy_week_number: Optional[int] = None  # Which week (1-4)
+    request_id: Optional[str] = None  # Resume key: reuses checkpointed stages of an earlier run
+    evaluation_mode: str = 'overlap'  # 'overlap', 'sync' or 'background'
 
 class ActivityRequest(BaseModel):
     student_id: str
@@ -266,6 +335,26 @@ class ActivityRequest(BaseModel):
     lesson_id: Optional[str] = None  # If creating from lesson phase
     lesson_phase: Optional[str] = None  # Which phase (Engage, Explore, etc.)
     max_attempts: int = 3
+    request_id: Optional[str] = None  # Resume key: reuses checkpointed stages of an earlier run
+    evaluation_mode: str = 'overlap'  # 'overlap', 'sync' or 'background'
+
+class LessonBatchRequest(BaseModel):
+    strategy_id: str
+    tutor_id: Optional[str] = None  # Defaults to the strategy's tutor
+    duration: int = 60
+    include_activities: bool = False
+    concurrency: int = 2  # Weeks generated at the same time
+
+class RescoreRequest(BaseModel):
+    content_types: Optional[List[str]] = None  # 'strategy', 'lesson', 'activity' (default: all)
+    page_size: int = 50
+    concurrency: int = 4  # Batched evaluation calls in flight
+    limit: Optional[int] = None  # Max rows per content type
+    request_id: Optional[str] = None  # Resume key: continues from the last stored page
+
+class ConsolidateInsightsRequest(BaseModel):
+    tables: Optional[List[str]] = None  # 'cross_agent_learning', 'learning_insights' (default: both)
+    similarity_threshold: Optional[float] = None  # Default INSIGHT_SIMILARITY_THRESHOLD (0.6)
 
 # Collaborative Editing Models
 class ContentVersionRequest(BaseModel):
@@ -275,6 +364,7 @@ class ContentVersionRequest(BaseModel):
     changes_summary: Optional[str] = None  # What changed
     edit_notes: Optional[str] = None  # WHY tutor edited (feeds learning insights)
     tutor_id: str
+    coalesce: bool = True  # Buffer rapid autosaves into a single version
 
 class ActivityChatRequest(BaseModel):
     activity_id: str
@@ -282,81 +372,175 @@ class ActivityChatRequest(BaseModel):
     message: str  # Tutor's request for changes
     student_id: str
 
+# Agent endpoints enqueue a durable job and return immediately.
+# Workers (worker.py) run the pipeline; poll /api/v1/jobs/{job_id} or stream
+# /api/v1/jobs/{job_id}/stream for stage progress and the final result.
+
+def _job_accepted(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "success": True,
+        "job_id": job['id'],
+        "job_type": job['job_type'],
+        "status": job['status'],
+        "status_url": f"/api/v1/jobs/{job['id']}",
+        "stream_url": f"/api/v1/jobs/{job['id']}/stream"
+    }
+
 # Strategy endpoint
 @app.post("/api/v1/agents/strategy")
 async def create_strategy(request: StrategyRequest):
-    """Generate a personalized learning strategy"""
+    """Enqueue generation of a personalized learning strategy"""
     try:
-        result = await generate_strategy(
-            student_id=request.student_id,
-            tutor_id=request.tutor_id,
-            subject=request.subject,
-            weeks=request.weeks
-        )
-        return {
-            "success": True,
-            "strategy_id": result['strategy_id'],
-            "content": result['content'],
-            "evaluation": result['evaluation'],
-            "student": result['student'],
-            "tutor": result['tutor']
-        }
+        job = await enqueue_job('strategy', request.model_dump())
+        return _job_accepted(job)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Cohort strategy endpoint (shared research across students)
+@app.post("/api/v1/agents/strategy/cohort")
+async def create_cohort_strategies(request: CohortStrategyRequest):
+    """
+    Enqueue strategies for several students of a tutor
+    Topic research is deduplicated across the cohort; each finished strategy is
+    streamed as a `strategy_completed` stage event and the result reports the
+    upstream calls saved.
+    """
+    try:
+        if not request.student_ids:
+            raise HTTPException(status_code=400, detail="student_ids must not be empty")
+        job = await enqueue_job('strategy_cohort', request.model_dump())
+        return _job_accepted(job)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Lesson endpoint
 @app.post("/api/v1/agents/lesson")
 async def create_lesson(request: LessonRequest):
-    """Generate a 5E lesson plan"""
+    """Enqueue generation of a 5E lesson plan"""
     try:
-        result = await generate_lesson(
-            student_id=request.student_id,
-            tutor_id=request.tutor_id,
-            topic=request.topic,
-            duration=request.duration,
-            strategy_id=request.strategy_id,
-            strategy_week_number=request.strategy_week_number  # NEW
-        )
-        return {
-            "success": True,
-            "lesson_id": result['lesson_id'],
-            "content": result['content'],
-            "evaluation": result['evaluation'],
-            "student": result['student'],
-            "tutor": result['tutor']
-        }
+        if request.strategy_id:
+            # The worker reads the strategy week from the database: commit pending edits
+            await save_coalescer.flush_content('strategy', request.strategy_id)
+        job = await enqueue_job('lesson', request.model_dump())
+        return _job_accepted(job)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Batch lesson endpoint (every week of a strategy)
+@app.post("/api/v1/agents/lessons/batch")
+async def create_strategy_lessons(request: LessonBatchRequest):
+    """
+    Enqueue generation of every week's lesson for a strategy
+    Each finished lesson is streamed as a `lesson_completed` stage event.
+    """
+    try:
+        await save_coalescer.flush_content('strategy', request.strategy_id)
+        job = await enqueue_job('lesson_batch', request.model_dump())
+        return _job_accepted(job)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Activity endpoint (with auto-fix!)
 @app.post("/api/v1/agents/activity")
 async def create_activity(request: ActivityRequest):
-    """Generate an interactive React activity with auto-debugging"""
+    """Enqueue generation of an interactive React activity with auto-debugging"""
     try:
-        result = await generate_activity(
-            student_id=request.student_id,
-            tutor_id=request.tutor_id,
-            topic=request.topic,
-            activity_description=request.activity_description,
-            duration=request.duration,
-            lesson_id=request.lesson_id,
-            lesson_phase=request.lesson_phase,  # NEW
-            max_attempts=request.max_attempts
-        )
+        if request.lesson_id:
+            await save_coalescer.flush_content('lesson', request.lesson_id)
+        job = await enqueue_job('activity', request.model_dump())
+        return _job_accepted(job)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Historical re-scoring (after a rubric change)
+@app.post("/api/v1/reflection/rescore")
+async def rescore_evaluations(request: RescoreRequest):
+    """
+    Enqueue re-scoring of stored strategies/lessons/activities under the current rubric
+    Results land in evaluation_scores tagged with the rubric version; progress and
+    throughput are streamed as `rescore_<type>` stage events.
+    """
+    try:
+        job = await enqueue_job('rescore', request.model_dump())
+        return _job_accepted(job)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Insight consolidation (merge near-duplicates)
+@app.post("/api/v1/reflection/consolidate")
+async def consolidate_learning_insights(request: ConsolidateInsightsRequest):
+    """
+    Enqueue consolidation of near-duplicate learning insights
+    Each cluster is merged into its strongest member; the rest are deprecated.
+    """
+    try:
+        job = await enqueue_job('insight_consolidation', request.model_dump())
+        return _job_accepted(job)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# ==========================================
+# JOB STATUS ENDPOINTS
+# ==========================================
+
+@app.get("/api/v1/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """Poll a generation job (status, current stage, progress, result)"""
+    try:
+        job = await get_job(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        
         return {
             "success": True,
-            "activity_id": result['activity_id'],
-            "content": result['content'],
-            "evaluation": result['evaluation'],
-            "deployment": result['deployment'],
-            "student": result['student'],
-            "tutor": result['tutor'],
-            "sandbox_url": result['deployment'].get('url')
+            "job": job
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/v1/jobs/{job_id}/stream")
+async def stream_job(job_id: str, poll_interval: float = 1.0):
+    """
+    Stream job progress as Server-Sent Events
+    Emits a `stage` event per recorded stage, then a final `result` or `error` event.
+    """
+    job = await get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    async def events():
+        sent = 0
+        while True:
+            current = await get_job(job_id)
+            if not current:
+                yield f"event: error\ndata: {json.dumps({'error': 'Job not found'})}\n\n"
+                return
+            
+            progress = current.get('progress') or []
+            for entry in progress[sent:]:
+                yield f"event: stage\ndata: {json.dumps(entry)}\n\n"
+            sent = len(progress)
+            
+            if current['status'] == 'succeeded':
+                yield f"event: result\ndata: {json.dumps(current['result'])}\n\n"
+                return
+            if current['status'] == 'failed':
+                yield f"event: error\ndata: {json.dumps({'error': current.get('error')})}\n\n"
+                return
+            
+            await asyncio.sleep(poll_interval)
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
 # Activity redeployment endpoint (retry only Daytona deployment, don't regenerate code)
 @app.post("/api/v1/agents/activity/redeploy")
 async def redeploy_activity(request: dict):
@@ -465,72 +649,146 @@ async def save_content_version(request: ContentVersionRequest):
     
     This feeds into learning insights - we analyze WHY tutors edit content
     to improve future AI generations.
+    
+    By default edits are coalesced: rapid saves of the same document by the same
+    tutor are buffered and committed as one version once editing pauses.
+    Send coalesce=false to commit immediately. Edits that fail to commit after
+    retries are reported as `failed_saves` here and by the save-status endpoint.
     """
     try:
-        # Get current version number
-        version_query = supabase.table('content_versions')\
-            .select('version_number')\
-            .eq('content_type', request.content_type)\
-            .eq('content_id', request.content_id)\
-            .order('version_number', desc=True)\
-            .limit(1)\
-            .execute()
-        
-        current_version = version_query.data[0]['version_number'] if version_query.data else 0
-        new_version = current_version + 1
-        
-        # Save new version
-        version_record = {
-            'content_type': request.content_type,
-            'content_id': request.content_id,
-            'version_number': new_version,
-            'content': request.content,
-            'changes_summary': request.changes_summary,
-            'edited_by': request.tutor_id,
-            'edit_type': 'manual_edit',
-            'edit_notes': request.edit_notes,  # WHY they edited (important for learning!)
-        }
+        if request.coalesce:
+            ack = await save_coalescer.submit(
+                content_type=request.content_type,
+                content_id=request.content_id,
+                tutor_id=request.tutor_id,
+                content=request.content,
+                edit_notes=request.edit_notes,
+                changes_summary=request.changes_summary
+            )
+            return {
+                "success": True,
+                "version_number": None,  # Allocated when the buffer is committed
+                "message": f"Edit buffered ({ack['buffered_edits']} pending), "
+                           f"committing in {ack['commit_in_seconds']}s",
+                **ack
+            }
         
-        result = supabase.table('content_versions').insert(version_record).execute()
+        # Allocate version, store it (as a delta when possible) and update the parent
+        # row in one transaction (see create_content_version() in database/complete-schema.sql)
+        saved = await save_version(
+            content_type=request.content_type,
+            content_id=request.content_id,
+            content=request.content,
+            tutor_id=request.tutor_id,
+            edit_type='manual_edit',
+            edit_notes=request.edit_notes,  # WHY they edited (important for learning!)
+            changes_summary=request.changes_summary
+        )
         
-        # Update main content table to mark latest version
-        table_name = 'strategies' if request.content_type == 'strategy' else 'lessons'
-        supabase.table(table_name)\
-            .update({'current_version': new_version, 'content': request.content})\
-            .eq('id', request.content_id)\
-            .execute()
+        new_version = saved['version_number']
         
         return {
             "success": True,
+            "status": "committed",
             "version_number": new_version,
             "message": f"Version {new_version} saved successfully",
             "edit_notes": request.edit_notes
         }
         
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/v1/content/save-status/{content_type}/{content_id}")
+async def get_content_save_status(content_type: str, content_id: str, tutor_id: Optional[str] = None):
+    """
+    Buffered and dropped autosaves of a strategy or lesson
+    Dropped edits carry their content so the tutor can save them again.
+    """
+    return {
+        "success": True,
+        "buffered_edits": save_coalescer.pending_edits(content_type, content_id, tutor_id),
+        "failed_saves": save_coalescer.failed_saves(content_type, content_id, tutor_id)
+    }
+
+
 @app.get("/api/v1/content/versions/{content_type}/{content_id}")
-async def get_content_versions(content_type: str, content_id: str):
+async def get_content_versions(content_type: str, content_id: str, format: str = 'metadata'):
     """
     Get version history for a strategy or lesson.
-    Returns all versions with edit notes for tracking tutor modifications.
+    Returns version metadata with edit notes for tracking tutor modifications;
+    content is fetched per version on demand.
+    
+    Args:
+        format: 'metadata' (listing fields only, default),
+                'full' (rebuild content for every version) or
+                'delta' (stored checkpoints + JSON Patches)
     """
     try:
-        versions = supabase.table('content_versions')\
-            .select('*')\
-            .eq('content_type', content_type)\
-            .eq('content_id', content_id)\
-            .order('version_number', desc=True)\
-            .execute()
+        # Commit buffered autosaves first so the history reflects every edit
+        await save_coalescer.flush_content(content_type, content_id)
+        versions = await load_version_history(content_type, content_id, format=format)
+        
+        return {
+            "success": True,
+            "format": format,
+            "versions": versions,
+            "total_versions": len(versions),
+            "failed_saves": save_coalescer.failed_saves(content_type, content_id)
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/v1/content/versions/{content_type}/{content_id}/diff")
+async def get_content_version_diff(
+    content_type: str,
+    content_id: str,
+    from_version: int,
+    to_version: int
+):
+    """Server-side JSON Patch between two versions of a strategy or lesson"""
+    try:
+        diff = await load_version_diff(content_type, content_id, from_version, to_version)
+        
+        if diff is None:
+            raise HTTPException(status_code=404, detail="Version not found")
         
         return {
             "success": True,
-            "versions": versions.data,
-            "total_versions": len(versions.data)
+            "from_version": from_version,
+            "to_version": to_version,
+            "diff": diff,
+            "total_changes": len(diff)
         }
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/v1/content/versions/{content_type}/{content_id}/{version_number}")
+async def get_content_version(content_type: str, content_id: str, version_number: int):
+    """Fetch the full content of a single version (rebuilt from its nearest checkpoint)"""
+    try:
+        version = await load_version_content(content_type, content_id, version_number)
+        
+        if not version:
+            raise HTTPException(status_code=404, detail="Version not found")
+        
+        return {
+            "success": True,
+            "version": version
+        }
+        
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -579,13 +837,18 @@ async def activity_chat(request: ActivityChatRequest):
             topic=current_activity.get('topic', '')
         )
         
-        # Save agent response
+        # Save agent response (code stored as a delta against the previous snapshot)
+        snapshot = await encode_code_snapshot(
+            activity_id=request.activity_id,
+            previous_code=current_code,
+            new_code=result.get('new_code') or ''
+        )
         agent_message = {
             'activity_id': request.activity_id,
             'tutor_id': request.tutor_id,
             'message_type': 'agent_response',
             'message_content': result.get('explanation', 'Activity updated'),
-            'code_snapshot': result.get('new_code'),
+            **snapshot,
             'sandbox_url': result.get('sandbox_url')
         }
         
@@ -616,8 +879,13 @@ async def activity_chat(request: ActivityChatRequest):
 
 
 @app.get("/api/v1/activity/chat/{activity_id}")
-async def get_activity_chat_history(activity_id: str):
-    """Get chat history for an activity"""
+async def get_activity_chat_history(activity_id: str, format: str = 'full'):
+    """
+    Get chat history for an activity
+    
+    Args:
+        format: 'full' (rebuild every code snapshot) or 'delta' (stored line deltas)
+    """
     try:
         chat_history = supabase.table('activity_chat_history')\
             .select('*')\
@@ -625,10 +893,15 @@ async def get_activity_chat_history(activity_id: str):
             .order('created_at', desc=False)\
             .execute()
         
+        messages = chat_history.data or []
+        if format == 'full':
+            messages = reconstruct_chat_history(messages)
+        
         return {
             "success": True,
-            "chat_history": chat_history.data,
-            "total_messages": len(chat_history.data)
+            "format": format,
+            "chat_history": messages,
+            "total_messages": len(messages)
         }
         
     except Exception as e:
@@ -13,6 +13,24 @@ import google.generativeai as genai
 
 # weave.init() is called in main.py
 
+# Concurrent in-flight calls allowed per provider; extra calls queue here instead of
+# tripping the provider's rate limit (and its retry backoff)
+PROVIDER_CONCURRENCY = {
+    'google': int(os.getenv("GOOGLE_MAX_CONCURRENCY", "8")),
+    'perplexity': int(os.getenv("PERPLEXITY_MAX_CONCURRENCY", "4")),
+    'wandb': int(os.getenv("WANDB_INFERENCE_MAX_CONCURRENCY", "4"))
+}
+
+_provider_limiters: Dict[str, asyncio.Semaphore] = {}
+
+
+def provider_limiter(provider: str) -> asyncio.Semaphore:
+    """Shared semaphore bounding concurrent calls to one provider"""
+    if provider not in _provider_limiters:
+        _provider_limiters[provider] = asyncio.Semaphore(PROVIDER_CONCURRENCY.get(provider, 4))
+    return _provider_limiters[provider]
+
+
 @weave.op()
 async def call_google_learnlm(
     prompt: str,
@@ -59,11 +77,12 @@ async def call_google_learnlm(
     for attempt in range(max_retries):
         try:
             # Generate content (run sync function in thread pool for async compatibility)
-            response = await asyncio.to_thread(
-                model.generate_content,
-                prompt,
-                generation_config=generation_config
-            )
+            async with provider_limiter('google'):
+                response = await asyncio.to_thread(
+                    model.generate_content,
+                    prompt,
+                    generation_config=generation_config
+                )
             
             if response and response.text:
                 return response.text
@@ -147,7 +166,7 @@ async def call_perplexity(
     }
     
     try:
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient() as client, provider_limiter('perplexity'):
             response = await client.post(url, headers=headers, json=payload, timeout=120)
             response.raise_for_status()
             
@@ -215,21 +234,22 @@ async def call_qwen3_coder(
             )
             
             # Call Qwen3 Coder 480B
-            response = await wb_client.chat.completions.create(
-                model="Qwen/Qwen3-Coder-480B-A35B-Instruct",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an expert React developer creating educational interactive components. Generate clean, well-commented, production-ready code."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=temperature,
-                max_tokens=max_tokens
-            )
+            async with provider_limiter('wandb'):
+                response = await wb_client.chat.completions.create(
+                    model="Qwen/Qwen3-Coder-480B-A35B-Instruct",
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": "You are an expert React developer creating educational interactive components. Generate clean, well-commented, production-ready code."
+                        },
+                        {
+                            "role": "user",
+                            "content": prompt
+                        }
+                    ],
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                )
             
             print(f"   ✅ Qwen3 Coder succeeded on attempt {attempt + 1}")
             return response.choices[0].message.content
@@ -0,0 +1,81 @@
+"""
+Checkpoint Service
+Persists each agent pipeline stage's output keyed by request id
+
+A retried or resumed run with the same request id skips the stages that already
+completed (e.g. the Perplexity research) and continues from the first missing one.
+"""
+
+from typing import Dict, Any, Optional, Callable, Awaitable
+from datetime import datetime
+from db.supabase_client import supabase
+
+
+class PipelineCheckpoints:
+    """Stage outputs for one pipeline run (no-op when request_id is None)"""
+
+    def __init__(self, request_id: Optional[str], pipeline: str, stages: Optional[Dict[str, Any]] = None):
+        self.request_id = request_id
+        self.pipeline = pipeline
+        self.stages: Dict[str, Any] = stages or {}
+
+    def has(self, stage: str) -> bool:
+        return stage in self.stages
+
+    def get(self, stage: str) -> Any:
+        return self.stages.get(stage)
+
+    async def save(self, stage: str, output: Any) -> None:
+        """Persist a stage output (failures are logged, never fatal)"""
+        self.stages[stage] = output
+        if not self.request_id:
+            return
+
+        try:
+            supabase.table('pipeline_checkpoints').upsert({
+                'request_id': self.request_id,
+                'pipeline': self.pipeline,
+                'stage': stage,
+                'output': output,
+                'created_at': datetime.now().isoformat()
+            }, on_conflict='request_id,pipeline,stage').execute()
+        except Exception as e:
+            print(f"   ⚠️ Failed to checkpoint {self.pipeline}/{stage}: {str(e)}")
+
+    async def run(self, stage: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the checkpointed output for `stage`, or run `fn` and checkpoint it"""
+        if self.has(stage):
+            print(f"   ⏭️ Resuming: skipping completed stage '{stage}'")
+            return self.get(stage)
+
+        output = await fn()
+        await self.save(stage, output)
+        return output
+
+
+async def load_checkpoints(request_id: Optional[str], pipeline: str) -> PipelineCheckpoints:
+    """
+    Load completed stages for a request
+
+    Args:
+        request_id: Idempotency key for the run (job id or client-provided); None disables checkpointing
+        pipeline: 'strategy', 'lesson', 'activity' or 'rescore'
+    """
+    if not request_id:
+        return PipelineCheckpoints(None, pipeline)
+
+    try:
+        result = supabase.table('pipeline_checkpoints')\
+            .select('stage, output')\
+            .eq('request_id', request_id)\
+            .eq('pipeline', pipeline)\
+            .execute()
+
+        stages = {row['stage']: row['output'] for row in (result.data or [])}
+        if stages:
+            print(f"   💾 Found {len(stages)} checkpointed stage(s) for request {request_id}: {', '.join(stages)}")
+        return PipelineCheckpoints(request_id, pipeline, stages)
+
+    except Exception as e:
+        print(f"   ⚠️ Failed to load checkpoints for {request_id}: {str(e)}")
+        return PipelineCheckpoints(request_id, pipeline)
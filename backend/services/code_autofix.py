@@ -0,0 +1,562 @@
+"""
+Code Autofix
+Deterministic rewrites for common defects in generated React activity code
+
+Runs on every version of the code before it is deployed to the sandbox, so the
+usual failures (missing semicolons, hooks used without importing them, imports of
+packages the sandbox doesn't install, no default export) don't each cost a full
+deploy / model-fix cycle. Rules are conservative: when the code can't be scanned
+cleanly or a defect has no safe rewrite it is reported as unresolved and left for
+the model fixer. Every rewrite is reported with its rule, line and a short detail.
+"""
+
+import re
+import bisect
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple
+
+# The sandbox installs react + react-dom only (see daytona_service); main.jsx
+# imports ./index.css, which is the only local file App.jsx can rely on
+SUPPORTED_PACKAGES = ('react', 'react-dom')
+SUPPORTED_LOCAL_IMPORTS = ('./index.css',)
+
+REACT_HOOKS = (
+    'useState', 'useEffect', 'useCallback', 'useMemo', 'useRef', 'useReducer', 'useContext',
+    'useLayoutEffect', 'useId', 'useTransition', 'useDeferredValue', 'useImperativeHandle'
+)
+HOOK_CALL = re.compile(r'(?<![\w$.])(' + '|'.join(REACT_HOOKS) + r')\s*\(')
+
+IMPORT_STATEMENT = re.compile(
+    r"^[ \t]*import\s+(?:(?P<clause>[^'\";]+?)\s+from\s+)?(?P<q>['\"])(?P<source>[^'\"]+)(?P=q)[ \t]*;?[ \t]*\n?",
+    re.MULTILINE
+)
+COMPONENT_DEFINITION = re.compile(r'^(?:export\s+)?(?:function|const|let|class)\s+([A-Z][\w$]*)', re.MULTILINE)
+DEFAULT_EXPORT = re.compile(r'^\s*export\s+default\b', re.MULTILINE)
+COMMONJS_EXPORT = re.compile(r'^module\.exports\s*=\s*([A-Z][\w$]*)\s*;?[ \t]*$', re.MULTILINE)
+
+FRAMER_MOTION_PROPS = {
+    'initial', 'animate', 'exit', 'transition', 'variants', 'layoutId', 'whileHover', 'whileTap',
+    'whileFocus', 'whileDrag', 'whileInView', 'drag', 'dragConstraints', 'viewport'
+}
+# Icon stand-in: keeps props and children so nothing rendered through it is lost
+STUB_COMPONENT = "const {name} = ({{ children, ...props }}) => <span aria-hidden=\"true\" {{...props}}>{{children ?? '•'}}</span>;"
+EVENT_HANDLER_PROP = re.compile(r'\son[A-Z]\w*\s*=')
+
+# Scanner context: what the previous token says about the next '{', '<' or '/'
+JSX_PRECEDERS = set('(,=?:&|{[!;') | {'', '=>', 'return'}
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^') | {'', '=>', 'return', 'typeof', 'case', 'in', 'of', 'delete', 'void', 'throw', 'new', 'else', 'do'}
+OBJECT_PRECEDERS = set('=(,:[?&|!+-*%<>~^') | {
+    'return', 'typeof', 'case', 'yield', 'await', 'in', 'of', 'const', 'let', 'var', 'import', 'export', 'default'
+}
+
+CONTROL_HEADER = re.compile(r'^\s*(?:\}\s*)?(?:if|for|while|else|with|switch|catch|do)\b')
+TRAILING_WORD = re.compile(r'([A-Za-z_$][\w$]*)$')
+LEADING_WORD = re.compile(r'[A-Za-z_$][\w$]*')
+JSX_CLOSE = re.compile(r'(?:/|</[\w.]*)>$')
+NO_SEMICOLON_WORDS = {
+    'else', 'do', 'try', 'finally', 'async', 'await', 'yield', 'typeof', 'new', 'in', 'of', 'instanceof',
+    'case', 'default', 'extends', 'return', 'const', 'let', 'var', 'function', 'class', 'import', 'export',
+    'from', 'throw', 'void', 'delete'
+}
+CONTINUATION_WORDS = {'in', 'of', 'instanceof', 'as'}
+
+
+def _rewrite(rule: str, detail: str, line: Optional[int] = None) -> Dict[str, Any]:
+    return {'rule': rule, 'line': line, 'detail': detail}
+
+
+def _line_of(code: str, offset: int) -> int:
+    return code.count('\n', 0, offset) + 1
+
+
+# ==========================================
+# SCANNER
+# ==========================================
+
+def _statement_line_ends(code: str) -> Optional[List[int]]:
+    """
+    Offsets of the last code character of every line that ends at statement level:
+    inside a block (not an object literal or expression), outside parens/brackets,
+    strings, template literals, comments, regex literals and JSX
+
+    Returns:
+        Sorted offsets, or None when the code doesn't scan cleanly
+    """
+    frames = [{'type': 'js', 'kind': 'block', 'depth': 0}]
+    ends = []
+    last = None  # Last code character on the current line
+    prev = ''    # Previous token (identifier, punctuation or '=>')
+    i, n = 0, len(code)
+
+    while i < n:
+        ch = code[i]
+        frame = frames[-1]
+
+        if ch == '\n':
+            if frame['type'] == 'js' and frame['kind'] == 'block' and frame['depth'] == 0 and last is not None:
+                ends.append(last)
+            last = None
+            i += 1
+            continue
+
+        if frame['type'] == 'template':
+            if ch == '\\':
+                i += 2
+            elif ch == '`':
+                frames.pop()
+                prev, last = '`', i
+                i += 1
+            elif code.startswith('${', i):
+                frames.append({'type': 'js', 'kind': 'expr', 'depth': 0})
+                prev = '{'
+                i += 2
+            else:
+                i += 1
+            continue
+
+        if frame['type'] == 'jsx':
+            closed = None
+            if frame['in_tag']:
+                if ch in '"\'':
+                    end = code.find(ch, i + 1)
+                    if end < 0:
+                        return None
+                    i = end + 1
+                elif ch == '{':
+                    frames.append({'type': 'js', 'kind': 'expr', 'depth': 0})
+                    prev = '{'
+                    i += 1
+                elif code.startswith('/>', i):
+                    frame['in_tag'] = False
+                    frame['depth'] -= 1
+                    closed = i + 1
+                elif ch == '>':
+                    frame['in_tag'] = False
+                    i += 1
+                else:
+                    i += 1
+            elif ch == '{':
+                frames.append({'type': 'js', 'kind': 'expr', 'depth': 0})
+                prev = '{'
+                i += 1
+            elif code.startswith('</', i):
+                end = code.find('>', i)
+                if end < 0:
+                    return None
+                frame['depth'] -= 1
+                closed = end
+            elif ch == '<' and i + 1 < n and (code[i + 1].isalpha() or code[i + 1] == '>'):
+                frame['depth'] += 1
+                frame['in_tag'] = code[i + 1] != '>'
+                i += 1 if frame['in_tag'] else 2
+            else:
+                i += 1  # JSX text: quotes and slashes mean nothing here
+
+            if closed is not None:
+                i = closed + 1
+                if frame['depth'] == 0:
+                    frames.pop()
+                    prev, last = ')', closed
+            continue
+
+        # JavaScript
+        if ch in ' \t\r':
+            i += 1
+        elif code.startswith('//', i):
+            end = code.find('\n', i)
+            i = n if end < 0 else end
+        elif code.startswith('/*', i):
+            end = code.find('*/', i + 2)
+            if end < 0:
+                return None
+            if '\n' in code[i:end]:
+                last = None
+            i = end + 2
+        elif ch in '"\'':
+            j = i + 1
+            while j < n and code[j] not in (ch, '\n'):
+                j += 2 if code[j] == '\\' else 1
+            if j >= n or code[j] != ch:
+                return None
+            prev, last = ch, j
+            i = j + 1
+        elif ch == '`':
+            frames.append({'type': 'template'})
+            i += 1
+        elif ch == '/' and prev in REGEX_PRECEDERS:
+            j, in_class = i + 1, False
+            while j < n and code[j] != '\n':
+                if code[j] == '\\':
+                    j += 2
+                    continue
+                if code[j] == '/' and not in_class:
+                    break
+                in_class = (in_class or code[j] == '[') and code[j] != ']'
+                j += 1
+            if j >= n or code[j] != '/':
+                return None
+            j += 1
+            while j < n and code[j].isalpha():
+                j += 1
+            prev, last = ')', j - 1
+            i = j
+        elif ch == '<' and prev in JSX_PRECEDERS and i + 1 < n and (code[i + 1].isalpha() or code[i + 1] == '>'):
+            fragment = code[i + 1] == '>'
+            frames.append({'type': 'jsx', 'depth': 1, 'in_tag': not fragment})
+            i += 2 if fragment else 1
+        elif ch == '{':
+            nested_in_expression = prev == '{' and frame['kind'] != 'block'
+            kind = 'object' if prev in OBJECT_PRECEDERS or nested_in_expression else 'block'
+            frames.append({'type': 'js', 'kind': kind, 'depth': 0})
+            prev, last = '{', i
+            i += 1
+        elif ch == '}':
+            if len(frames) == 1:
+                return None
+            frames.pop()
+            prev, last = '}', i
+            i += 1
+        elif ch.isalnum() or ch in '_$':
+            j = i
+            while j < n and (code[j].isalnum() or code[j] in '_$'):
+                j += 1
+            prev, last = code[i:j], j - 1
+            i = j
+        else:
+            if ch in '([':
+                frame['depth'] += 1
+            elif ch in ')]':
+                frame['depth'] -= 1
+                if frame['depth'] < 0:
+                    return None
+            prev = '=>' if ch == '>' and code[i - 1] == '=' else ch
+            last = i
+            i += 1
+
+    if len(frames) != 1 or frames[0]['depth'] != 0:
+        return None
+    if last is not None:
+        ends.append(last)
+    return ends
+
+
+# ==========================================
+# RULES
+# ==========================================
+
+def _next_code_line(lines: List[str], start: int) -> Optional[str]:
+    for line in lines[start:]:
+        stripped = line.strip()
+        if stripped and not stripped.startswith(('//', '/*', '*')):
+            return stripped
+    return None
+
+
+def insert_semicolons(code: str) -> Tuple[str, List[Dict[str, Any]], List[str]]:
+    """
+    Terminate statements that end a line without ';' when the next line starts a
+    new statement (identifier/keyword or closing brace)
+
+    Returns:
+        (code, rewrites, unresolved)
+    """
+    ends = _statement_line_ends(code)
+    if ends is None:
+        return code, [], ["Semicolons not checked: code could not be scanned (unbalanced braces, strings or JSX)"]
+
+    lines = code.split('\n')
+    line_starts = [0] + [m.end() for m in re.finditer('\n', code)]
+    rewrites = []
+
+    for offset in reversed(ends):
+        line_no = bisect.bisect_right(line_starts, offset) - 1
+        text = lines[line_no]
+        col = offset - line_starts[line_no]
+        head = text[:col + 1]
+        last_char = head[-1]
+
+        if not (last_char.isalnum() or last_char in '_$)]\'"`' or head.endswith(('++', '--')) or JSX_CLOSE.search(head)):
+            continue
+        word = TRAILING_WORD.search(head)
+        if (word and word.group(1) in NO_SEMICOLON_WORDS) or CONTROL_HEADER.match(text):
+            continue
+        following = _next_code_line(lines, line_no + 1)
+        if following is not None and following[0] != '}':
+            first_word = LEADING_WORD.match(following)
+            if not first_word or first_word.group(0) in CONTINUATION_WORDS:
+                continue
+
+        lines[line_no] = head + ';' + text[col + 1:]
+        statement = head.strip()
+        snippet = statement if len(statement) <= 40 else '…' + statement[-39:]
+        rewrites.append(_rewrite('semicolons', f"Inserted ';' after `{snippet}`", line_no + 1))
+
+    return '\n'.join(lines), list(reversed(rewrites)), []
+
+
+def _import_bindings(clause: Optional[str]) -> Dict[str, Any]:
+    """Default, namespace and named (local) bindings of an import clause"""
+    bindings = {'default': None, 'namespace': None, 'named': []}
+    if not clause:
+        return bindings
+    named = re.search(r'\{([^}]*)\}', clause)
+    if named:
+        for item in named.group(1).split(','):
+            parts = item.split(' as ')
+            if parts[-1].strip():
+                bindings['named'].append(parts[-1].strip())
+        clause = clause[:named.start()] + clause[named.end():]
+    namespace = re.search(r'\*\s*as\s+([\w$]+)', clause)
+    if namespace:
+        bindings['namespace'] = namespace.group(1)
+        clause = clause[:namespace.start()] + clause[namespace.end():]
+    default = clause.strip().strip(',').strip()
+    if default:
+        bindings['default'] = default
+    return bindings
+
+
+def _is_supported(source: str) -> bool:
+    return source in SUPPORTED_LOCAL_IMPORTS or any(
+        source == package or source.startswith(package + '/') for package in SUPPORTED_PACKAGES
+    )
+
+
+def _tag_end(code: str, start: int) -> int:
+    """Offset of the '>' that closes the JSX tag opened at `start`"""
+    depth, i = 0, start
+    while i < len(code):
+        ch = code[i]
+        if ch in '"\'`' and depth == 0:
+            end = code.find(ch, i + 1)
+            i = len(code) if end < 0 else end + 1
+            continue
+        if ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+        elif ch == '>' and depth == 0:
+            return i
+        i += 1
+    return len(code)
+
+
+def _strip_jsx_props(tag: str, props: set) -> str:
+    """Remove the named attributes (with string or {expression} values) from one tag"""
+    for match in reversed(list(re.finditer(r'\s+([A-Za-z][\w-]*)', tag))):
+        if match.group(1) not in props:
+            continue
+        end = match.end()
+        if end < len(tag) and tag[end] == '=':
+            end += 1
+            if end < len(tag) and tag[end] == '{':
+                depth = 0
+                while end < len(tag):
+                    depth += {'{': 1, '}': -1}.get(tag[end], 0)
+                    end += 1
+                    if depth == 0:
+                        break
+            elif end < len(tag) and tag[end] in '"\'':
+                end = tag.find(tag[end], end + 1) + 1
+        tag = tag[:match.start()] + tag[end:]
+    return tag
+
+
+def _replace_framer_motion(code: str, bindings: Dict[str, Any]) -> Tuple[str, int]:
+    """motion.div → div (animation props dropped), AnimatePresence → fragment"""
+    replaced = 0
+    if 'motion' in bindings['named']:
+        pieces, position = [], 0
+        for match in re.finditer(r'<motion\.([a-z][\w]*)', code):
+            if match.start() < position:
+                continue
+            end = _tag_end(code, match.end())
+            pieces.append(code[position:match.start()])
+            pieces.append(_strip_jsx_props(f"<{match.group(1)}" + code[match.end():end], FRAMER_MOTION_PROPS))
+            position = end
+            replaced += 1
+        code = ''.join(pieces) + code[position:]
+        code = re.sub(r'</motion\.([a-z][\w]*)\s*>', r'</\1>', code)
+    if 'AnimatePresence' in bindings['named']:
+        code, opened = re.subn(r'<AnimatePresence\b[^>]*>', '<>', code)
+        code = re.sub(r'</AnimatePresence\s*>', '</>', code)
+        replaced += opened
+    return code, replaced
+
+
+def _is_icon_usage(code: str, name: str) -> bool:
+    """
+    True when every use of `name` is a self-closing JSX tag without event handlers
+    (an icon). Anything that wraps children, handles events or is passed around as
+    a value could carry the activity's content, so it must not be stubbed.
+    """
+    for match in re.finditer(rf'(?<![\w$.]){re.escape(name)}\b', code):
+        if code[match.start() - 1:match.start()] != '<':
+            return False
+        end = _tag_end(code, match.end())
+        tag = code[match.end():end]
+        if not tag.rstrip().endswith('/') or EVENT_HANDLER_PROP.search(tag):
+            return False
+    return True
+
+
+def remove_unsupported_imports(code: str) -> Tuple[str, List[Dict[str, Any]], List[str]]:
+    """
+    Drop imports the sandbox can't resolve
+
+    Side-effect imports (stylesheets, polyfills) are removed. framer-motion elements
+    become plain elements; icons (components only used self-closing, without event
+    handlers) get an inline stand-in. Components that wrap content or handle events
+    (UI kits) and bindings used as values (axios, lodash, ...) have no safe rewrite:
+    the import is kept and reported as unresolved for the model fixer.
+
+    Returns:
+        (code, rewrites, unresolved)
+    """
+    rewrites, unresolved, stubs = [], [], []
+    for match in reversed(list(IMPORT_STATEMENT.finditer(code))):
+        source = match.group('source')
+        if _is_supported(source):
+            continue
+
+        line = _line_of(code, match.start())
+        bindings = _import_bindings(match.group('clause'))
+        rest = code[:match.start()] + code[match.end():]
+
+        if source == 'framer-motion':
+            rest, replaced = _replace_framer_motion(rest, bindings)
+            leftover = [name for name in bindings['named'] if re.search(rf'(?<![\w$.]){re.escape(name)}\b', rest)]
+            if leftover:
+                unresolved.append(f"framer-motion import (line {line}) still needed for {', '.join(leftover)}")
+                continue
+            code = rest
+            rewrites.append(_rewrite('unsupported_imports', f"Removed framer-motion; {replaced} animated element(s) made static", line))
+            continue
+
+        names = [name for name in [bindings['default'], bindings['namespace']] + bindings['named'] if name]
+        used = [name for name in names if re.search(rf'(?<![\w$.]){re.escape(name)}\b', rest)]
+        values = [name for name in used if not name[0].isupper() or name == bindings['namespace']]
+        if values:
+            unresolved.append(f"Unsupported package '{source}' (line {line}) is used as a value: {', '.join(values)}")
+            continue
+        components = [name for name in used if not _is_icon_usage(rest, name)]
+        if components:
+            unresolved.append(f"Unsupported package '{source}' (line {line}) provides components that "
+                              f"render content or handle events: {', '.join(components)}")
+            continue
+
+        code = rest
+        stubs.extend(name for name in used if name not in stubs)
+        detail = f"Removed import of '{source}'"
+        if used:
+            detail += f"; stand-in icon(s) for {', '.join(used)}"
+        rewrites.append(_rewrite('unsupported_imports', detail, line))
+
+    if stubs:
+        imports = list(IMPORT_STATEMENT.finditer(code))
+        position = imports[-1].end() if imports else 0
+        block = "// Stand-ins for icons from packages the sandbox doesn't install\n"
+        block += "\n".join(STUB_COMPONENT.format(name=name) for name in stubs)
+        code = code[:position].rstrip('\n') + ("\n\n" if position else "") + block + "\n\n" + code[position:].lstrip('\n')
+
+    return code, list(reversed(rewrites)), unresolved
+
+
+def add_hook_imports(code: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """Import React hooks that are called but never imported or defined"""
+    imported, react_imports = set(), []
+    for match in IMPORT_STATEMENT.finditer(code):
+        if match.group('source') == 'react':
+            bindings = _import_bindings(match.group('clause'))
+            imported.update(bindings['named'])
+            react_imports.append((match, bindings))
+
+    missing = []
+    for hook in HOOK_CALL.findall(code):
+        defined = re.search(rf'\b(?:function|const|let|var)\s+{hook}\b', code)
+        if hook not in imported and hook not in missing and not defined:
+            missing.append(hook)
+    if not missing:
+        return code, []
+
+    names = ', '.join(missing)
+    target = next(((m, b) for m, b in react_imports if '{' in (m.group('clause') or '')), None) or \
+        next(((m, b) for m, b in react_imports if b['default'] and not b['namespace']), None)
+
+    if target:
+        match, bindings = target
+        clause = match.group('clause')
+        if '{' in clause:
+            new_clause = re.sub(r'\{\s*([^}]*?)\s*,?\s*\}', lambda m: '{ ' + ', '.join(filter(None, [m.group(1), names])) + ' }', clause, count=1)
+        else:
+            new_clause = f"{clause.strip()}, {{ {names} }}"
+        start, end = match.span('clause')
+        code = code[:start] + new_clause + code[end:]
+        line = _line_of(code, match.start())
+        return code, [_rewrite('hook_imports', f"Added {names} to the react import", line)]
+
+    statement = f"import {{ {names} }} from 'react';" if react_imports else f"import React, {{ {names} }} from 'react';"
+    return statement + "\n" + code, [_rewrite('hook_imports', f"Added `{statement}`", 1)]
+
+
+def ensure_default_export(code: str) -> Tuple[str, List[Dict[str, Any]], List[str]]:
+    """Export the root component as default when the code has no default export"""
+    if DEFAULT_EXPORT.search(code):
+        return code, [], []
+
+    commonjs = COMMONJS_EXPORT.search(code)
+    if commonjs:
+        line = _line_of(code, commonjs.start())
+        code = code[:commonjs.start()] + f"export default {commonjs.group(1)};" + code[commonjs.end():]
+        return code, [_rewrite('default_export', f"Replaced module.exports with `export default {commonjs.group(1)};`", line)], []
+
+    components = COMPONENT_DEFINITION.findall(code)
+    if not components:
+        return code, [], ["No default export and no top-level component to export"]
+
+    # Root = a component no other component renders; App wins, then the last one defined
+    roots = [c for c in components if not re.search(rf'<{c}[\s/>]', code)] or components
+    name = 'App' if 'App' in roots else roots[-1]
+    code = code.rstrip('\n') + f"\n\nexport default {name};\n"
+    return code, [_rewrite('default_export', f"Added `export default {name};`", _line_of(code, len(code) - 1))], []
+
+
+# ==========================================
+# ENGINE
+# ==========================================
+
+def autofix_code(code: str) -> Dict[str, Any]:
+    """
+    Apply every rule to generated activity code
+
+    Returns:
+        Dict with the rewritten code, changed flag, rewrites (rule, line, detail)
+        and unresolved issues the rules found but could not safely fix
+    """
+    if not code or not code.strip():
+        return {'code': code, 'changed': False, 'rewrites': [], 'unresolved': []}
+
+    rewrites, unresolved = [], []
+
+    fixed, applied, skipped = remove_unsupported_imports(code)
+    rewrites.extend(applied)
+    unresolved.extend(skipped)
+
+    fixed, applied = add_hook_imports(fixed)
+    rewrites.extend(applied)
+
+    fixed, applied, skipped = ensure_default_export(fixed)
+    rewrites.extend(applied)
+    unresolved.extend(skipped)
+
+    # Last, so statements added by the other rules are scanned too
+    fixed, applied, skipped = insert_semicolons(fixed)
+    rewrites.extend(applied)
+    unresolved.extend(skipped)
+
+    return {'code': fixed, 'changed': fixed != code, 'rewrites': rewrites, 'unresolved': unresolved}
+
+
+def summarize_rewrites(rewrites: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Rewrite counts per rule"""
+    return dict(Counter(rewrite['rule'] for rewrite in rewrites))
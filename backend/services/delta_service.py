@@ -0,0 +1,193 @@
+"""
+Delta Service
+Compact diffs for version history storage
+- JSON Patch (RFC 6902 subset: add / remove / replace, plus a `text` op) for
+  strategy & lesson content
+- Line-based text deltas for activity code snapshots
+"""
+
+import re
+import copy
+import json
+import difflib
+import hashlib
+from typing import Any, Dict, List
+
+# Store a full copy every N versions so reconstruction never replays long chains
+CONTENT_CHECKPOINT_INTERVAL = 10
+CODE_CHECKPOINT_INTERVAL = 5
+
+# String leaves at least this long (tutor-edited markdown/HTML bodies) are stored as
+# text deltas instead of whole replacements
+TEXT_DIFF_MIN_LENGTH = 512
+
+# Markup bodies are diffed in segments ending at a newline or a tag (editor HTML is one line)
+MARKUP_BREAK = re.compile(r'(?<=[>\n])')
+
+
+# ==========================================
+# JSON PATCH (content versions)
+# ==========================================
+
+def _escape_pointer(token: str) -> str:
+    return str(token).replace('~', '~0').replace('/', '~1')
+
+
+def _unescape_pointer(token: str) -> str:
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def diff_json(old: Any, new: Any, path: str = '') -> List[Dict[str, Any]]:
+    """
+    Compute a JSON Patch that turns `old` into `new`
+
+    Args:
+        old: Previous document
+        new: New document
+        path: JSON pointer prefix (used for recursion)
+
+    Returns:
+        List of RFC 6902 operations (add, remove, replace). Long strings that share
+        most of their text become {"op": "text", "path", "value": diff_text ops}.
+    """
+    if old == new:
+        return []
+
+    if isinstance(old, str) and isinstance(new, str) and len(new) >= TEXT_DIFF_MIN_LENGTH:
+        ops = diff_text(old, new, markup=True)
+        if len(json.dumps(ops)) < len(json.dumps(new)):
+            return [{'op': 'text', 'path': path, 'value': ops}]
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key in old:
+            if key not in new:
+                ops.append({'op': 'remove', 'path': f"{path}/{_escape_pointer(key)}"})
+        for key, value in new.items():
+            child_path = f"{path}/{_escape_pointer(key)}"
+            if key not in old:
+                ops.append({'op': 'add', 'path': child_path, 'value': value})
+            else:
+                ops.extend(diff_json(old[key], value, child_path))
+        return ops
+
+    if isinstance(old, list) and isinstance(new, list):
+        ops = []
+        common = min(len(old), len(new))
+        for i in range(common):
+            ops.extend(diff_json(old[i], new[i], f"{path}/{i}"))
+        # Remove trailing items from the end so indices stay valid
+        for i in range(len(old) - 1, common - 1, -1):
+            ops.append({'op': 'remove', 'path': f"{path}/{i}"})
+        for i in range(common, len(new)):
+            ops.append({'op': 'add', 'path': f"{path}/{i}", 'value': new[i]})
+        return ops
+
+    return [{'op': 'replace', 'path': path, 'value': new}]
+
+
+def apply_json_patch(document: Any, patch: List[Dict[str, Any]]) -> Any:
+    """Apply a JSON Patch produced by diff_json (returns a new document)"""
+    result = copy.deepcopy(document)
+
+    for operation in patch:
+        op = operation['op']
+        path = operation['path']
+
+        if path == '':
+            if op == 'remove':
+                result = None
+            elif op == 'text':
+                result = apply_text_diff(result, operation['value'], markup=True)
+            else:
+                result = copy.deepcopy(operation['value'])
+            continue
+
+        tokens = [_unescape_pointer(t) for t in path.split('/')[1:]]
+        parent = result
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+
+        last = tokens[-1]
+        if isinstance(parent, list):
+            index = len(parent) if last == '-' else int(last)
+            if op == 'add':
+                parent.insert(index, copy.deepcopy(operation['value']))
+            elif op == 'remove':
+                del parent[index]
+            elif op == 'replace':
+                parent[index] = copy.deepcopy(operation['value'])
+            elif op == 'text':
+                parent[index] = apply_text_diff(parent[index], operation['value'], markup=True)
+        else:
+            if op == 'text':
+                parent[last] = apply_text_diff(parent.get(last), operation['value'], markup=True)
+            elif op in ('add', 'replace'):
+                parent[last] = copy.deepcopy(operation['value'])
+            elif op == 'remove':
+                parent.pop(last, None)
+
+    return result
+
+
+# ==========================================
+# TEXT DELTAS (activity code snapshots)
+# ==========================================
+
+def _split_text(text: str, markup: bool = False) -> List[str]:
+    """Lines of `text` (markup: segments ending at a newline or '>'), ends kept"""
+    if markup:
+        return [segment for segment in MARKUP_BREAK.split(text or '') if segment]
+    return (text or '').splitlines(keepends=True)
+
+
+def diff_text(old: str, new: str, markup: bool = False) -> List[List[Any]]:
+    """
+    Compute a line-based delta that turns `old` into `new`
+
+    Args:
+        markup: Split after every tag as well as every newline (markdown / HTML bodies)
+
+    Ops are compact lists:
+        ["=", n]        keep n lines
+        ["-", n]        drop n lines
+        ["+", [lines]]  insert lines
+    """
+    old_lines = _split_text(old, markup)
+    new_lines = _split_text(new, markup)
+
+    ops: List[List[Any]] = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append(['=', i2 - i1])
+            continue
+        if tag in ('delete', 'replace'):
+            ops.append(['-', i2 - i1])
+        if tag in ('insert', 'replace'):
+            ops.append(['+', new_lines[j1:j2]])
+
+    return ops
+
+
+def apply_text_diff(old: str, ops: List[List[Any]], markup: bool = False) -> str:
+    """Apply a delta produced by diff_text (same `markup` setting)"""
+    old_lines = _split_text(old, markup)
+    result = []
+    cursor = 0
+
+    for op, arg in ops:
+        if op == '=':
+            result.extend(old_lines[cursor:cursor + arg])
+            cursor += arg
+        elif op == '-':
+            cursor += arg
+        elif op == '+':
+            result.extend(arg)
+
+    return ''.join(result)
+
+
+def text_fingerprint(text: str) -> str:
+    """Stable hash used to verify a delta is applied to the right base"""
+    return hashlib.sha1((text or '').encode('utf-8')).hexdigest()
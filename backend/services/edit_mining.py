@@ -0,0 +1,404 @@
+"""
+Edit Mining
+Structural change records for tutor edits, aggregated into recurring patterns
+
+Each manual edit is rebuilt next to its previous version and diffed locally.
+Structured content is diffed per JSON path (diff_json). Tutor-edited document bodies
+({content, format}) are split into heading sections and compared line by line, and
+the first save of a generated lesson as a document compares the rendered text instead
+of reporting every structured key as removed. Every change becomes a compact record
+(path or section with list indices / numbers collapsed, added / removed / rewritten,
+length delta) and records are counted across edits, so the reflection prompt sees
+what tutors keep changing across hundreds of edits for the token cost of a short list.
+"""
+
+import re
+import json
+import difflib
+from collections import defaultdict
+from typing import List, Dict, Any, Tuple
+from db.supabase_client import supabase
+from services.delta_service import diff_json, _unescape_pointer
+from services.version_service import reconstruct_versions
+from agents.evaluator import _content_sections
+
+# Path segments kept per pattern (deeper changes roll up into their parent field)
+MAX_PATH_DEPTH = 4
+# Words of a heading kept in a section path ('Week 2: Fractions' -> 'week_#')
+MAX_SECTION_WORDS = 3
+OP_KINDS = {'add': 'added', 'remove': 'removed', 'replace': 'rewritten', 'text': 'rewritten'}
+# Document keys holding the body, and identifiers that are never rendered
+DOCUMENT_KEYS = ('content', 'format')
+HIDDEN_KEY = re.compile(r'(^|_)ids?$')
+
+# (section path, normalized text, is heading)
+DocumentLine = Tuple[str, str, bool]
+
+
+def _size(value: Any) -> int:
+    """Characters of text a value carries"""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value)
+    return len(json.dumps(value, ensure_ascii=False))
+
+
+def _resolve(document: Any, pointer: str) -> Any:
+    """Value at a JSON pointer, None if the path doesn't exist"""
+    current = document
+    for token in [_unescape_pointer(t) for t in pointer.split('/')[1:]]:
+        if isinstance(current, list) and token.isdigit() and int(token) < len(current):
+            current = current[int(token)]
+        elif isinstance(current, dict) and token in current:
+            current = current[token]
+        else:
+            return None
+    return current
+
+
+def normalize_path(pointer: str, max_depth: int = MAX_PATH_DEPTH) -> str:
+    """'/weeks/2/activities/0/title' -> 'weeks[].activities[].title'"""
+    parts: List[str] = []
+    for token in [_unescape_pointer(t) for t in pointer.split('/')[1:]]:
+        if token.isdigit():
+            if parts:
+                parts[-1] += '[]'
+            else:
+                parts.append('[]')
+        else:
+            parts.append(token)
+    return '.'.join(parts[:max_depth]) or '(root)'
+
+
+def is_document(content: Any) -> bool:
+    """Tutor-edited body: {content: <markdown/html string>, format}"""
+    return isinstance(content, dict) and isinstance(content.get('content'), str) and bool(content.get('format'))
+
+
+def section_path(heading: str) -> str:
+    """'🎯 Learning Objectives' -> 'learning_objectives', 'Week 2: Fractions' -> 'week_#'"""
+    name = re.sub(r'\d+', '#', heading.split(':')[0].replace('_', ' ').lower())
+    return '_'.join(re.findall(r'[a-z#]+', name)[:MAX_SECTION_WORDS]) or 'introduction'
+
+
+def _normalize_line(line: str) -> str:
+    """Comparable text of a line: no markup, bullets, numbering or 'Label:' prefix"""
+    line = re.sub(r'[*_`#>|]+', ' ', line)
+    line = re.sub(r'^\s*(?:[-•]|\d+[.)])\s+', '', line)
+    line = re.sub(r'^\s*[A-Za-z][\w ]{0,30}:\s+', '', line)
+    return ' '.join(re.findall(r'\w+', line.lower()))
+
+
+def _document_lines(content: Dict[str, Any]) -> List[DocumentLine]:
+    """Heading and body lines of a document, in order, tagged with their section"""
+    lines: List[DocumentLine] = []
+    for heading, text in _content_sections(content).items():
+        section = section_path(heading)
+        if heading != 'introduction':
+            lines.append((section, _normalize_line(heading), True))
+        for line in text.split('\n'):
+            normalized = _normalize_line(line)
+            if normalized:
+                lines.append((section, normalized, False))
+    return lines
+
+
+def _leaf_text(value: Any) -> List[str]:
+    if isinstance(value, str):
+        return value.split('\n')
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return [str(value)]
+    if isinstance(value, list):
+        return [text for item in value for text in _leaf_text(item)]
+    if isinstance(value, dict):
+        return [text for key, item in value.items() if not HIDDEN_KEY.search(key) for text in _leaf_text(item)]
+    return []
+
+
+def _structured_lines(content: Dict[str, Any]) -> Tuple[List[DocumentLine], Dict[str, set]]:
+    """
+    Rendered text of structured content (top-level keys become sections)
+
+    Returns:
+        Lines, and per section the words of its text and nested key names
+    """
+    lines: List[DocumentLine] = []
+    vocabulary: Dict[str, set] = defaultdict(set)
+    for key, value in content.items():
+        if HIDDEN_KEY.search(key):
+            continue
+        section = section_path(key)
+        heading = _normalize_line(key.replace('_', ' '))
+        lines.append((section, heading, True))
+        vocabulary[section].update(heading.split())
+        for text in _leaf_text(value):
+            normalized = _normalize_line(text)
+            if normalized:
+                lines.append((section, normalized, False))
+                vocabulary[section].update(normalized.split())
+        # Nested field names appear as rendered labels ('Materials:', 'Teacher Notes:')
+        nested_keys = re.findall(r'"(\w+)":', json.dumps(value)) if isinstance(value, (dict, list)) else []
+        vocabulary[section].update(word for k in nested_keys for word in k.lower().split('_'))
+    return lines, vocabulary
+
+
+def _section_records(removed: List[DocumentLine], added: List[DocumentLine]) -> List[Dict[str, Any]]:
+    """One record per section: rewritten if it lost and gained lines, else added / removed"""
+    sections: Dict[str, List[int]] = {}
+    for lines, side in ((removed, 0), (added, 1)):
+        for section, text, _ in lines:
+            totals = sections.setdefault(section, [0, 0, 0, 0])
+            totals[side] += len(text)
+            totals[side + 2] += 1
+
+    records = []
+    for section, (chars_before, chars_after, lines_before, lines_after) in sections.items():
+        kind = 'rewritten' if lines_before and lines_after else ('added' if lines_after else 'removed')
+        records.append({
+            'path': section,
+            'kind': kind,
+            'chars_before': chars_before,
+            'chars_after': chars_after
+        })
+    return records
+
+
+def _document_changes(old: Dict[str, Any], new: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Line diff of two document bodies, grouped by section"""
+    old_lines, new_lines = _document_lines(old), _document_lines(new)
+    matcher = difflib.SequenceMatcher(
+        None, [line[1] for line in old_lines], [line[1] for line in new_lines], autojunk=False
+    )
+    removed: List[DocumentLine] = []
+    added: List[DocumentLine] = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != 'equal':
+            removed.extend(old_lines[i1:i2])
+            added.extend(new_lines[j1:j2])
+    return _section_records(removed, added)
+
+
+def _conversion_changes(structured: Dict[str, Any], document: Dict[str, Any], structured_is_old: bool) -> List[Dict[str, Any]]:
+    """
+    Changes between structured content and its document rendering (first HTML save
+    of a generated lesson)
+
+    The frontend renders fields with its own headings and labels, so lines can't be
+    aligned: a structured line is unchanged if its text appears in the document, a
+    document line if it appears in the structured text or only uses words of the
+    matching section (e.g. 'Activity 1: Fraction pizza (10 min)'). Heading lines
+    are rendering, not edits, and are ignored.
+    """
+    structured_lines, vocabulary = _structured_lines(structured)
+    document_lines = _document_lines(document)
+    document_text = '\n'.join(text for _, text, _ in document_lines)
+    structured_text = '\n'.join(text for _, text, _ in structured_lines)
+
+    def rendered(text: str, section: str) -> bool:
+        if text in structured_text:
+            return True
+        words = set(text.split())
+        candidates = [vocabulary[section]] if section in vocabulary else list(vocabulary.values())
+        return any(words <= candidate for candidate in candidates)
+
+    dropped = [line for line in structured_lines if not line[2] and line[1] not in document_text]
+    written = [line for line in document_lines if not line[2] and not rendered(line[1], line[0])]
+    return _section_records(dropped, written) if structured_is_old else _section_records(written, dropped)
+
+
+def change_records(old: Any, new: Any) -> List[Dict[str, Any]]:
+    """
+    Compact change records between two versions
+
+    Returns:
+        One record per changed field (or document section): path (normalized),
+        kind (added, removed, rewritten), chars_before / chars_after and, for
+        rewritten numbers, value_delta
+    """
+    if is_document(old) or is_document(new):
+        if is_document(old) and is_document(new):
+            records = _document_changes(old, new)
+            # Metadata kept next to the body (e.g. the generated strategy's topics)
+            shared = [k for k in old if k in new and k not in DOCUMENT_KEYS]
+            old = {k: old[k] for k in shared}
+            new = {k: new[k] for k in shared}
+        elif isinstance(old, dict) and isinstance(new, dict):
+            return _conversion_changes(old, new, True) if is_document(new) else _conversion_changes(new, old, False)
+        else:
+            return []
+    else:
+        records = []
+
+    for op in diff_json(old, new):
+        before = _resolve(old, op['path']) if op['op'] != 'add' else None
+        after = _resolve(new, op['path']) if op['op'] != 'remove' else None
+        record = {
+            'path': normalize_path(op['path']),
+            'kind': OP_KINDS.get(op['op'], op['op']),
+            'chars_before': _size(before),
+            'chars_after': _size(after)
+        }
+        if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in (before, after)):
+            record['value_delta'] = after - before
+        records.append(record)
+    return records
+
+
+def _load_edit_pairs(content_type: str, edits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Rebuild (previous, edited) content for each edit
+
+    One chain query per document: from the checkpoint at or before the earliest
+    previous version up to the latest edited version.
+    """
+    by_document: Dict[str, List[int]] = defaultdict(list)
+    for edit in edits:
+        if edit.get('content_id') and isinstance(edit.get('version_number'), int):
+            by_document[edit['content_id']].append(edit['version_number'])
+
+    contents: Dict[tuple, Any] = {}
+    for content_id, numbers in by_document.items():
+        first = max(min(numbers) - 1, 1)
+        try:
+            checkpoint = supabase.table('content_versions')\
+                .select('version_number')\
+                .eq('content_type', content_type)\
+                .eq('content_id', content_id)\
+                .eq('storage_format', 'full')\
+                .lte('version_number', first)\
+                .order('version_number', desc=True)\
+                .limit(1)\
+                .execute()
+            if not checkpoint.data:
+                continue
+
+            chain = supabase.table('content_versions')\
+                .select('version_number, content, content_delta, base_version, storage_format')\
+                .eq('content_type', content_type)\
+                .eq('content_id', content_id)\
+                .gte('version_number', checkpoint.data[0]['version_number'])\
+                .lte('version_number', max(numbers))\
+                .order('version_number', desc=False)\
+                .execute()
+            for row in reconstruct_versions(chain.data or []):
+                contents[(content_id, row['version_number'])] = row.get('content')
+        except Exception as e:
+            print(f"   ⚠️ Could not rebuild versions of {content_type} {content_id}: {str(e)}")
+
+    pairs = []
+    for edit in edits:
+        key = (edit.get('content_id'), edit.get('version_number'))
+        previous = contents.get((key[0], key[1] - 1)) if isinstance(key[1], int) else None
+        current = contents.get(key)
+        if previous is not None and current is not None:
+            pairs.append({'edit': edit, 'old': previous, 'new': current})
+    return pairs
+
+
+def aggregate_patterns(edit_records: List[List[Dict[str, Any]]], top_patterns: int = 12) -> List[Dict[str, Any]]:
+    """
+    Recurring (path, kind) changes across edits
+
+    Args:
+        edit_records: change_records() output per edit
+        top_patterns: Patterns to keep, most widespread first
+
+    Returns:
+        Patterns with the number of edits they appear in, total fields touched
+        and the average length delta per field (average value delta for numbers)
+    """
+    patterns: Dict[tuple, Dict[str, Any]] = {}
+    for records in edit_records:
+        seen = set()
+        for record in records:
+            key = (record['path'], record['kind'])
+            pattern = patterns.setdefault(key, {
+                'path': record['path'], 'kind': record['kind'], 'edits': 0, 'fields': 0,
+                'chars_delta': 0, 'value_deltas': []
+            })
+            pattern['fields'] += 1
+            pattern['chars_delta'] += record['chars_after'] - record['chars_before']
+            if 'value_delta' in record:
+                pattern['value_deltas'].append(record['value_delta'])
+            if key not in seen:
+                pattern['edits'] += 1
+                seen.add(key)
+
+    ranked = sorted(patterns.values(), key=lambda p: (-p['edits'], -p['fields'], p['path']))
+    for pattern in ranked:
+        pattern['avg_chars_delta'] = round(pattern['chars_delta'] / pattern['fields'])
+        deltas = pattern.pop('value_deltas')
+        pattern['avg_value_delta'] = round(sum(deltas) / len(deltas), 2) if deltas else None
+    return ranked[:top_patterns]
+
+
+def mine_edits(content_type: str, edits: List[Dict[str, Any]], top_patterns: int = 12) -> Dict[str, Any]:
+    """
+    Diff every manual edit against its previous version and aggregate the changes
+
+    Args:
+        content_type: 'strategy' or 'lesson'
+        edits: content_versions rows (content_id, version_number, edit_notes, changes_summary)
+        top_patterns: Patterns to report
+
+    Returns:
+        Dict with edits / diffed counts, recurring patterns, net size change and
+        distinct tutor notes
+    """
+    pairs = _load_edit_pairs(content_type, edits)
+    edit_records = [change_records(pair['old'], pair['new']) for pair in pairs]
+
+    growth = [
+        sum(r['chars_after'] - r['chars_before'] for r in records)
+        for records in edit_records
+    ]
+    notes: List[str] = []
+    for edit in edits:
+        for note in (edit.get('edit_notes'), edit.get('changes_summary')):
+            if note and note.strip() and note.strip() not in notes:
+                notes.append(note.strip())
+
+    return {
+        'edits': len(edits),
+        'diffed': len(pairs),
+        'fields_changed': sum(len(records) for records in edit_records),
+        'avg_chars_delta': round(sum(growth) / len(growth)) if growth else None,
+        'growing_edits': sum(1 for g in growth if g > 0),
+        'patterns': aggregate_patterns(edit_records, top_patterns),
+        'notes': notes
+    }
+
+
+def format_edit_patterns(mined: Dict[str, Any], max_notes: int = 8) -> str:
+    """Compact text for the reflection prompt"""
+    if not mined.get('edits'):
+        return "No tutor edits available"
+
+    lines = [
+        f"Edits analyzed: {mined['edits']} ({mined['diffed']} diffed against their previous version, "
+        f"{mined['fields_changed']} fields changed)"
+    ]
+    if mined.get('avg_chars_delta') is not None:
+        lines.append(
+            f"Average edit changes content length by {mined['avg_chars_delta']:+} chars; "
+            f"{mined['growing_edits']} of {mined['diffed']} edits add content"
+        )
+
+    if mined['patterns']:
+        lines.append("\nRecurring changes (path: kind, edits, avg change per field):")
+        for pattern in mined['patterns']:
+            lines.append(
+                f"- {pattern['path']}: {pattern['kind']} in {pattern['edits']} edit(s)"
+                + (f", {pattern['fields']} fields" if pattern['fields'] != pattern['edits'] else "")
+                + (f", value {pattern['avg_value_delta']:+g} on average" if pattern['avg_value_delta'] is not None
+                   else f", {pattern['avg_chars_delta']:+} chars")
+            )
+
+    if mined['notes']:
+        lines.append("\nTutor notes:")
+        lines.extend(f"- {note[:200]}" for note in mined['notes'][:max_notes])
+        if len(mined['notes']) > max_notes:
+            lines.append(f"- ... {len(mined['notes']) - max_notes} more")
+
+    return "\n".join(lines)
@@ -0,0 +1,127 @@
+"""
+Evaluation Cache
+Reuses self-evaluations for content that was already scored
+
+Keys hash (content type, normalized content, the student fields the rubric reads,
+rubric version), so a redeploy of identical code or a lesson restored from an old
+version never pays for a second LLM evaluation.
+"""
+
+import re
+import json
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Iterable
+from datetime import datetime
+from db.supabase_client import supabase
+
+# Fields that change between otherwise identical artifacts and do not affect the score
+VOLATILE_KEYS = {
+    'id', 'student_id', 'tutor_id', 'created_at', 'updated_at',
+    'sandbox_id', 'sandbox_url', 'attempts_needed'
+}
+
+MEMORY_CACHE_SIZE = 256
+
+
+def normalize_content(value: Any) -> Any:
+    """Drop volatile keys and collapse whitespace so cosmetic differences hash equally"""
+    if isinstance(value, dict):
+        return {k: normalize_content(v) for k, v in sorted(value.items()) if k not in VOLATILE_KEYS}
+    if isinstance(value, list):
+        return [normalize_content(v) for v in value]
+    if isinstance(value, str):
+        return re.sub(r'\s+', ' ', value).strip()
+    return value
+
+
+def evaluation_cache_key(
+    content_type: str,
+    content: Any,
+    student: Dict[str, Any],
+    student_fields: Iterable[str],
+    rubric_version: str,
+    extra: Optional[Dict[str, Any]] = None
+) -> str:
+    """
+    Stable hash for an evaluation request
+
+    Args:
+        student_fields: Profile fields the rubric prompt reads (others don't affect the score)
+        extra: Other prompt inputs (e.g. deployment status)
+    """
+    payload = {
+        'type': content_type,
+        'content': normalize_content(content),
+        'student': {field: student.get(field) for field in student_fields},
+        'rubric': rubric_version,
+        'extra': extra or {}
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class EvaluationCache:
+    """Small in-process LRU in front of the evaluation_cache table"""
+
+    def __init__(self, max_entries: int = MEMORY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._memory: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, key: str, evaluation: Dict[str, Any]):
+        self._memory[key] = evaluation
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached evaluation or None (lookup failures count as misses)"""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._memory[key]
+
+        try:
+            result = supabase.table('evaluation_cache')\
+                .select('evaluation, hit_count')\
+                .eq('cache_key', key)\
+                .execute()
+
+            if result.data:
+                row = result.data[0]
+                supabase.table('evaluation_cache')\
+                    .update({
+                        'hit_count': (row.get('hit_count') or 0) + 1,
+                        'last_hit_at': datetime.now().isoformat()
+                    })\
+                    .eq('cache_key', key)\
+                    .execute()
+                self._remember(key, row['evaluation'])
+                self.hits += 1
+                return row['evaluation']
+
+        except Exception as e:
+            print(f"⚠️ Evaluation cache lookup failed: {str(e)}")
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, content_type: str, rubric_version: str, evaluation: Dict[str, Any]):
+        """Store an evaluation (failures are logged, never fatal)"""
+        self._remember(key, evaluation)
+        try:
+            supabase.table('evaluation_cache').upsert({
+                'cache_key': key,
+                'content_type': content_type,
+                'rubric_version': rubric_version,
+                'evaluation': evaluation,
+                'created_at': datetime.now().isoformat()
+            }, on_conflict='cache_key').execute()
+        except Exception as e:
+            print(f"⚠️ Failed to cache evaluation: {str(e)}")
+
+
+# Global instance
+evaluation_cache = EvaluationCache()
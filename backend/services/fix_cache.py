@@ -0,0 +1,251 @@
+"""
+Fix Cache
+Learned error-signature → fix index for the activity auto-debugger
+
+Sandbox error logs are normalized into a signature (paths, line/column numbers,
+URLs, sandbox ids and code frames stripped) so the same defect in different
+deployments maps to the same key. Fixes that led to a successful deployment are
+stored as small line edits anchored on code content, not positions, so they can be
+replayed on new code without a model call. Larger rewrites are kept as few-shot
+examples for the closest signature. Entries live in platform_memory
+(category 'code_fix_cache') with success / failure counters.
+"""
+
+import re
+import time
+import difflib
+import hashlib
+from typing import List, Dict, Any, Optional
+from db.supabase_client import supabase
+from services.memory_service import upsert_memory, PLATFORM_ENTITY_ID
+
+MEMORY_CATEGORY = 'code_fix_cache'
+REFRESH_SECONDS = 300
+MAX_ENTRIES = 2000
+MAX_EDIT_LINES = 20  # Larger fixes are rewrites: kept as examples, not replayed
+MIN_EXAMPLE_SIMILARITY = 0.5
+
+ANSI_CODES = re.compile(r'\x1b\[[0-9;]*[A-Za-z]')
+URLS = re.compile(r'https?://\S+')
+UUIDS = re.compile(r'\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b', re.IGNORECASE)
+HEX_IDS = re.compile(r'\b(?=[0-9a-f]*\d)[0-9a-f]{8,}\b', re.IGNORECASE)
+PATHS = re.compile(r'(?:[A-Za-z]:)?(?:[\\/][\w.@+-]+){2,}')
+POSITIONS = re.compile(r'(?::\d+){1,2}\b|\(\d+:\d+\)|\b(?:line|column|col)\s*\d+', re.IGNORECASE)
+NUMBERS = re.compile(r'\b\d+\b')
+CODE_FRAME = re.compile(r'^\s*(?:>?\s*\d+\s*\||\|?\s*\^+)\s*')
+ERROR_LINE = re.compile(r'error|failed|unexpected|not defined|cannot|expected|missing|invalid', re.IGNORECASE)
+
+
+# ==========================================
+# SIGNATURES
+# ==========================================
+
+def normalize_error_line(line: str) -> str:
+    line = ANSI_CODES.sub('', line)
+    line = URLS.sub('<url>', line)
+    line = UUIDS.sub('<id>', line)
+    line = PATHS.sub(lambda m: re.split(r'[\\/]', m.group(0))[-1], line)
+    line = POSITIONS.sub('', line)
+    line = HEX_IDS.sub('<id>', line)
+    line = NUMBERS.sub('<n>', line)
+    return re.sub(r'\s+', ' ', line).strip(' :-')
+
+
+def error_signature(error_logs: str, max_lines: int = 3) -> str:
+    """
+    Normalized signature of the first distinct error lines in sandbox logs
+
+    Example:
+        "/home/daytona/app/src/App.jsx:12:5: ERROR: Expected \";\" but found \"const\""
+        → 'App.jsx: ERROR: Expected ";" but found "const"'
+    """
+    lines = []
+    for raw in ANSI_CODES.sub('', error_logs or '').splitlines():
+        if not raw.strip() or CODE_FRAME.match(raw):
+            continue
+        if ERROR_LINE.search(raw):
+            line = normalize_error_line(raw)
+            if line and line not in lines:
+                lines.append(line)
+        if len(lines) >= max_lines:
+            break
+
+    if not lines:
+        first = next((l for l in (error_logs or '').splitlines() if l.strip()), '')
+        lines = [normalize_error_line(first)] if first else []
+    return ' | '.join(lines)[:400]
+
+
+def signature_hash(signature: str) -> str:
+    return hashlib.sha256(signature.encode('utf-8')).hexdigest()[:16]
+
+
+# ==========================================
+# REPLAYABLE EDITS
+# ==========================================
+
+def extract_edits(original: str, fixed: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Line edits that turn `original` into `fixed`, anchored on content
+
+    Returns:
+        List of {'anchor', 'old', 'new'} (anchor = line before the change, None at the
+        top of the file), or None when the fix is too large to replay
+    """
+    old_lines = original.splitlines()
+    new_lines = fixed.splitlines()
+    edits = []
+    changed = 0
+    matcher = difflib.SequenceMatcher(a=old_lines, b=new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        changed += max(i2 - i1, j2 - j1)
+        if changed > MAX_EDIT_LINES:
+            return None
+        edits.append({
+            'anchor': old_lines[i1 - 1].strip() if i1 > 0 else None,
+            'old': [line.strip() for line in old_lines[i1:i2]],
+            'new': new_lines[j1:j2]
+        })
+    return edits
+
+
+def apply_edits(code: str, edits: List[Dict[str, Any]]) -> Optional[str]:
+    """
+    Replay stored edits on new code (whitespace-insensitive line matching)
+
+    Returns:
+        Patched code, or None if any edit doesn't match this code
+    """
+    lines = code.splitlines()
+    for edit in edits:
+        stripped = [line.strip() for line in lines]
+        old = edit.get('old') or []
+        position = None
+
+        if old:
+            for i in range(len(stripped) - len(old) + 1):
+                if stripped[i:i + len(old)] == old:
+                    position = i
+                    break
+        elif edit.get('anchor') is None:
+            position = 0
+        elif edit['anchor'] in stripped:
+            position = stripped.index(edit['anchor']) + 1
+
+        if position is None:
+            return None
+        lines[position:position + len(old)] = edit.get('new') or []
+
+    return "\n".join(lines) + ("\n" if code.endswith("\n") else "")
+
+
+def _edits_hash(edits: Optional[List[Dict[str, Any]]], fixed: str) -> str:
+    payload = repr(edits) if edits is not None else fixed
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:8]
+
+
+def format_edits(edits: List[Dict[str, Any]], max_lines: int = 30) -> str:
+    """Unified-diff style text of stored edits (few-shot examples)"""
+    lines = []
+    for edit in edits:
+        if edit.get('anchor'):
+            lines.append(f"  {edit['anchor']}")
+        lines.extend(f"- {line}" for line in edit.get('old') or [])
+        lines.extend(f"+ {line.strip()}" for line in edit.get('new') or [])
+    return "\n".join(lines[:max_lines])
+
+
+# ==========================================
+# CACHE
+# ==========================================
+
+class FixCache:
+    """
+    In-process view of the stored fixes, refreshed from platform_memory
+
+    Entries are grouped by signature hash; each holds the edits (None for rewrites),
+    an example diff and success / failure counters.
+    """
+
+    def __init__(self):
+        self.entries: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.loaded_at = 0.0
+
+    def _index(self, key: str, value: Dict[str, Any]) -> None:
+        sig_hash = value.get('signature_hash')
+        if sig_hash:
+            self.entries.setdefault(sig_hash, {})[key] = value
+
+    def refresh(self, force: bool = False) -> None:
+        if not force and time.monotonic() - self.loaded_at < REFRESH_SECONDS:
+            return
+        self.loaded_at = time.monotonic()
+        try:
+            rows = supabase.table('platform_memory')\
+                .select('memory_key, memory_value')\
+                .eq('entity_type', 'platform')\
+                .eq('memory_category', MEMORY_CATEGORY)\
+                .order('last_updated', desc=True)\
+                .limit(MAX_ENTRIES)\
+                .execute().data or []
+            self.entries = {}
+            for row in rows:
+                self._index(row['memory_key'], row.get('memory_value') or {})
+        except Exception as e:
+            print(f"⚠️ Fix cache refresh failed: {str(e)}")
+
+    def known_fixes(self, signature: str) -> List[Dict[str, Any]]:
+        """Replayable fixes for this exact signature, most reliable first"""
+        self.refresh()
+        candidates = [
+            {**entry, 'key': key}
+            for key, entry in self.entries.get(signature_hash(signature), {}).items()
+            if entry.get('edits') and (entry.get('successes') or 0) > (entry.get('failures') or 0)
+        ]
+        return sorted(candidates, key=lambda e: (e.get('failures') or 0) - (e.get('successes') or 0))
+
+    def closest_example(self, signature: str) -> Optional[Dict[str, Any]]:
+        """Successful past fix with the most similar signature (few-shot example)"""
+        self.refresh()
+        best, best_ratio = None, MIN_EXAMPLE_SIMILARITY
+        for entries in self.entries.values():
+            for entry in entries.values():
+                if not entry.get('successes') or not entry.get('example'):
+                    continue
+                ratio = difflib.SequenceMatcher(a=signature, b=entry.get('signature', '')).ratio()
+                if ratio > best_ratio:
+                    best, best_ratio = entry, ratio
+        return {**best, 'similarity': round(best_ratio, 2)} if best else None
+
+    async def record(self, signature: str, original: str, fixed: str, success: bool) -> None:
+        """Store the outcome of a fix (only successful fixes create entries)"""
+        sig_hash = signature_hash(signature)
+        edits = extract_edits(original, fixed)
+        key = f"{sig_hash}_{_edits_hash(edits, fixed)}"
+        existing = self.entries.get(sig_hash, {}).get(key)
+        if not success and not existing:
+            return
+
+        value = {
+            'signature': signature,
+            'signature_hash': sig_hash,
+            'edits': edits,
+            'example': format_edits(edits) if edits else
+                "\n".join(difflib.unified_diff(original.splitlines(), fixed.splitlines(), lineterm='', n=1))[:1500]
+        }
+        counter = 'successes' if success else 'failures'
+        await upsert_memory(
+            'platform', PLATFORM_ENTITY_ID, MEMORY_CATEGORY, key, value,
+            confidence_score=0.8 if success else 0.3,
+            accumulate={counter: 1}
+        )
+        local = existing or {}
+        local.update(value)
+        local[counter] = (local.get(counter) or 0) + 1
+        self._index(key, local)
+
+
+# Global instance
+fix_cache = FixCache()
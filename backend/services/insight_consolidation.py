@@ -0,0 +1,245 @@
+"""
+Insight Consolidation
+Merges near-duplicate learning insights so the active set stays small
+
+Similarity is local: cosine over stemmed word counts. Writes check the insight index
+for a near-duplicate first and strengthen it instead of inserting; the consolidation
+job clusters whatever still slipped through (e.g. rows written concurrently) and
+folds each cluster into its most confident member. Evidence counts add up,
+confidence combines as independent evidence (1 - Π(1 - c)) and superseded rows are
+deprecated with a pointer to the survivor.
+"""
+
+import os
+import math
+from collections import Counter
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+from db.supabase_client import supabase
+from services.insight_index import (
+    tokenize,
+    InsightIndex,
+    learning_insight_index,
+    agent_insight_index,
+    PAGE_SIZE
+)
+from services.insight_digest import invalidate_insight_digests
+
+SIMILARITY_THRESHOLD = float(os.getenv("INSIGHT_SIMILARITY_THRESHOLD", "0.6"))
+MAX_MERGED_CONFIDENCE = 0.95
+MAX_EVIDENCE_ITEMS = 10
+PRIORITY_ORDER = ['low', 'medium', 'high', 'critical']
+
+
+# ==========================================
+# SIMILARITY
+# ==========================================
+
+def _stem(token: str) -> str:
+    for suffix in ('ing', 'ed', 'es', 's'):
+        if len(token) > len(suffix) + 2 and token.endswith(suffix):
+            return token[:-len(suffix)]
+    return token
+
+
+def text_vector(text: str) -> Counter:
+    return Counter(_stem(t) for t in tokenize(text))
+
+
+def cosine(a: Counter, b: Counter) -> float:
+    if not a or not b:
+        return 0.0
+    dot = sum(count * b.get(term, 0) for term, count in a.items())
+    return dot / (math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values())))
+
+
+def combine_confidence(values: List[float]) -> float:
+    """Independent supporting evidence: 1 - Π(1 - c), capped"""
+    remaining = 1.0
+    for value in values:
+        remaining *= 1.0 - max(0.0, min(1.0, float(value or 0.0)))
+    return round(min(MAX_MERGED_CONFIDENCE, 1.0 - remaining), 3)
+
+
+def _merge_evidence(lists: List[Any]) -> List[Any]:
+    merged = []
+    for items in lists:
+        for item in (items if isinstance(items, list) else [items]):
+            if item and item not in merged:
+                merged.append(item)
+    return merged[-MAX_EVIDENCE_ITEMS:]
+
+
+def find_similar(
+    index: InsightIndex,
+    text: str,
+    agent: Optional[str] = None,
+    where: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    threshold: Optional[float] = None
+) -> Optional[Dict[str, Any]]:
+    """Active insight that says the same thing as `text`, if any"""
+    threshold = SIMILARITY_THRESHOLD if threshold is None else threshold
+    vector = text_vector(text)
+    for candidate in index.search(text, limit=3, agent=agent, where=where):
+        if cosine(vector, text_vector(index.text_fn(candidate))) >= threshold:
+            return candidate
+    return None
+
+
+# ==========================================
+# MERGES (one survivor absorbs the others)
+# ==========================================
+
+def merge_agent_insights(survivor: Dict[str, Any], others: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Update for a cross_agent_learning survivor"""
+    rows = [survivor] + others
+    return {
+        'evidence_count': sum(row.get('evidence_count') or 1 for row in rows),
+        'confidence_score': combine_confidence([row.get('confidence_score') for row in rows]),
+        'evidence': _merge_evidence([row.get('evidence') for row in rows]),
+        'action': survivor.get('action') or next((row['action'] for row in others if row.get('action')), None),
+        'contributing_agents': sorted({a for row in rows for a in (row.get('contributing_agents') or [])}),
+        'last_updated': datetime.now().isoformat()
+    }
+
+
+def merge_learning_insights(survivor: Dict[str, Any], others: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Update for a learning_insights survivor"""
+    rows = [survivor] + others
+    priorities = [row.get('priority') for row in rows if row.get('priority') in PRIORITY_ORDER]
+    return {
+        'supporting_evidence': _merge_evidence([row.get('supporting_evidence') or [] for row in rows]),
+        'priority': max(priorities, key=PRIORITY_ORDER.index) if priorities else survivor.get('priority')
+    }
+
+
+# ==========================================
+# CONSOLIDATION JOB
+# ==========================================
+
+TABLES = {
+    'cross_agent_learning': {
+        'index': agent_insight_index,
+        'active': ('neq', 'propagation_status', 'deprecated'),
+        'group': lambda row: tuple(sorted(row.get('contributing_agents') or [])),
+        'rank': lambda row: (float(row.get('confidence_score') or 0), str(row.get('created_at') or '')),
+        'merge': merge_agent_insights,
+        'deprecate': lambda survivor_id: {
+            'propagation_status': 'deprecated',
+            'superseded_by': survivor_id,
+            'last_updated': datetime.now().isoformat()
+        }
+    },
+    'learning_insights': {
+        'index': learning_insight_index,
+        'active': ('eq', 'status', 'validated'),
+        'group': lambda row: row.get('insight_type'),
+        'rank': lambda row: (
+            PRIORITY_ORDER.index(row['priority']) if row.get('priority') in PRIORITY_ORDER else 1,
+            len(row.get('supporting_evidence') or []),
+            str(row.get('created_at') or '')
+        ),
+        'merge': merge_learning_insights,
+        'deprecate': lambda survivor_id: {'status': 'deprecated', 'superseded_by': survivor_id}
+    }
+}
+
+
+def _load_active(table: str, active: tuple) -> List[Dict[str, Any]]:
+    op, column, value = active
+    rows: List[Dict[str, Any]] = []
+    while True:
+        query = getattr(supabase.table(table).select('*'), op)(column, value)
+        page = query.order('created_at', desc=False).range(len(rows), len(rows) + PAGE_SIZE - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+
+
+def cluster_insights(rows: List[Dict[str, Any]], text_fn, group_fn, rank_fn, threshold: float) -> List[List[Dict[str, Any]]]:
+    """
+    Greedy clustering: strongest insights first, each joins the first cluster whose
+    survivor it matches (within its group), otherwise starts a new one
+
+    Returns:
+        Clusters with the survivor first
+    """
+    clusters: Dict[Any, List[tuple]] = {}
+    for row in sorted(rows, key=rank_fn, reverse=True):
+        vector = text_vector(text_fn(row))
+        group = clusters.setdefault(group_fn(row), [])
+        for survivor_vector, members in group:
+            if cosine(vector, survivor_vector) >= threshold:
+                members.append(row)
+                break
+        else:
+            group.append((vector, [row]))
+    return [members for group in clusters.values() for _, members in group]
+
+
+async def consolidate_insights(
+    tables: Optional[List[str]] = None,
+    threshold: Optional[float] = None,
+    on_stage: Optional[Callable[..., Awaitable[None]]] = None
+) -> Dict[str, Any]:
+    """
+    Merge near-duplicate active insights and deprecate the superseded rows
+
+    Args:
+        tables: Subset of 'cross_agent_learning', 'learning_insights' (default: both)
+        threshold: Cosine similarity at which two insights count as duplicates
+        on_stage: Async callback (stage, detail=None); one event per table
+
+    Returns:
+        Per-table counts: active before/after, clusters merged, rows deprecated
+    """
+    threshold = SIMILARITY_THRESHOLD if threshold is None else threshold
+    tables = tables or list(TABLES)
+    unknown = [t for t in tables if t not in TABLES]
+    if unknown:
+        raise ValueError(f"Unknown insight table(s): {', '.join(unknown)}")
+
+    print(f"\n🧹 Consolidating insights ({', '.join(tables)}, similarity ≥ {threshold})...")
+    report = {}
+
+    for table in tables:
+        config = TABLES[table]
+        index: InsightIndex = config['index']
+        rows = _load_active(table, config['active'])
+        clusters = cluster_insights(rows, index.text_fn, config['group'], config['rank'], threshold)
+
+        stats = {'active_before': len(rows), 'clusters_merged': 0, 'deprecated': 0, 'failed': 0}
+        for survivor, *others in clusters:
+            if not others:
+                continue
+            try:
+                update = config['merge'](survivor, others)
+                supabase.table(table)\
+                    .update(update)\
+                    .eq('id', survivor['id'])\
+                    .execute()
+                supabase.table(table)\
+                    .update(config['deprecate'](survivor['id']))\
+                    .in_('id', [row['id'] for row in others])\
+                    .execute()
+            except Exception as e:
+                print(f"   ⚠️ Merging into {table} {survivor.get('id')} failed: {str(e)}")
+                stats['failed'] += 1
+                continue
+
+            index.add({**survivor, **update})
+            for row in others:
+                index.remove(row['id'])
+            stats['clusters_merged'] += 1
+            stats['deprecated'] += len(others)
+
+        stats['active_after'] = stats['active_before'] - stats['deprecated']
+        if table == 'learning_insights' and stats['clusters_merged']:
+            invalidate_insight_digests()
+        report[table] = stats
+        print(f"   ✅ {table}: {stats['active_before']} → {stats['active_after']} active "
+              f"({stats['clusters_merged']} clusters merged)")
+        if on_stage:
+            await on_stage(f"consolidate_{table}", stats)
+
+    return {'threshold': threshold, 'by_table': report}
@@ -0,0 +1,129 @@
+"""
+Insight Digests
+Ready-to-inject learning-insight prompt fragments per (agent, grade, subject)
+
+Every generation for the same agent, grade and subject used to rank, filter and
+format the same insights. The formatted text is stored once in insight_digests with
+its token estimate; agents read one row. Writes to learning_insights (new insight,
+reinforcement, consolidation) clear the table and digests are rebuilt lazily on the
+next request for their key. Every invalidation bumps a generation counter; a rebuild
+records the generation it started from and is discarded if it changed meanwhile, so
+a digest built from pre-invalidation insights is never stored after the clear.
+"""
+
+import math
+from typing import Dict, Any, Optional
+from db.supabase_client import supabase
+from services.insight_index import learning_insight_index
+
+DIGEST_INSIGHTS = 5
+CHARS_PER_TOKEN = 4  # Rough estimate for English prompt text
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def _current_generation() -> Optional[int]:
+    try:
+        result = supabase.table('insight_digest_state')\
+            .select('generation')\
+            .execute()
+        return result.data[0]['generation'] if result.data else None
+    except Exception as e:
+        print(f"⚠️ Insight digest generation lookup failed: {str(e)}")
+        return None
+
+
+def _key(agent_type: str, grade: Optional[str], subject: Optional[str]) -> Dict[str, str]:
+    return {'agent_type': agent_type, 'grade': str(grade or ''), 'subject': str(subject or '')}
+
+
+async def load_insight_digest(
+    agent_type: str,
+    grade: Optional[str],
+    subject: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Prompt fragment with the best learning insights for this agent/grade/subject
+
+    Args:
+        agent_type: 'strategy_planner', 'lesson_creator', 'activity_creator'
+        grade: Student grade
+        subject: Student subject
+
+    Returns:
+        Dict with prompt_text ('' when there are no insights), token_count and
+        insight_count
+    """
+    key = _key(agent_type, grade, subject)
+    try:
+        result = supabase.table('insight_digests')\
+            .select('prompt_text, token_count, insight_count')\
+            .eq('agent_type', key['agent_type'])\
+            .eq('grade', key['grade'])\
+            .eq('subject', key['subject'])\
+            .execute()
+        if result.data:
+            return result.data[0]
+    except Exception as e:
+        print(f"⚠️ Insight digest lookup failed: {str(e)}")
+
+    return await rebuild_insight_digest(agent_type, grade, subject)
+
+
+async def rebuild_insight_digest(
+    agent_type: str,
+    grade: Optional[str],
+    subject: Optional[str] = None
+) -> Dict[str, Any]:
+    """Rank, format and store the digest for one key"""
+    # memory_service invalidates digests on write, so import it lazily
+    from services.memory_service import load_learning_insights, format_insights_for_prompt
+
+    # Read before loading insights: an invalidation after this point makes the build stale
+    generation = _current_generation()
+
+    # Full reload: merges and deprecations made by other workers must not leak into the digest
+    learning_insight_index.refresh(force=True, rebuild=True)
+    insights = await load_learning_insights(grade, subject, limit=DIGEST_INSIGHTS, agent_type=agent_type)
+    prompt_text = format_insights_for_prompt(insights) if insights else ""
+
+    digest = {
+        **_key(agent_type, grade, subject),
+        'prompt_text': prompt_text,
+        'token_count': estimate_tokens(prompt_text),
+        'insight_count': len(insights),
+        'insight_ids': [insight['id'] for insight in insights if insight.get('id')]
+    }
+    if generation is None:
+        return {key: digest[key] for key in ('prompt_text', 'token_count', 'insight_count')}
+
+    try:
+        stored = supabase.rpc('store_insight_digest', {
+            'p_agent_type': digest['agent_type'],
+            'p_grade': digest['grade'],
+            'p_subject': digest['subject'],
+            'p_prompt_text': digest['prompt_text'],
+            'p_token_count': digest['token_count'],
+            'p_insight_count': digest['insight_count'],
+            'p_insight_ids': digest['insight_ids'],
+            'p_generation': generation
+        }).execute().data
+        if stored:
+            print(f"   📝 Rebuilt insight digest for {agent_type} (grade {grade}, {subject or 'any subject'}): "
+                  f"{digest['insight_count']} insights, ~{digest['token_count']} tokens")
+        else:
+            print(f"   ⏭️ Discarded insight digest for {agent_type}: insights changed during the rebuild")
+    except Exception as e:
+        print(f"⚠️ Storing insight digest failed: {str(e)}")
+
+    return {key: digest[key] for key in ('prompt_text', 'token_count', 'insight_count')}
+
+
+def invalidate_insight_digests() -> None:
+    """Drop every digest and bump the generation (called whenever learning_insights change)"""
+    try:
+        supabase.rpc('invalidate_insight_digests', {}).execute()
+    except Exception as e:
+        print(f"⚠️ Invalidating insight digests failed: {str(e)}")
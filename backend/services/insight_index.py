@@ -0,0 +1,234 @@
+"""
+Insight Index
+In-process BM25 retrieval over learning insights
+
+Insights are tokenized once into an inverted index, so picking the best few for a
+prompt (topic, grade, subject, agent) is a handful of dictionary lookups instead of
+reading the newest rows and hoping they apply. Relevance is blended with the
+insight's confidence and a recency decay. The index loads lazily, picks up rows
+written by other processes every REFRESH_SECONDS, is rebuilt every REBUILD_SECONDS
+(so merges and deprecations made elsewhere drop out) and is updated in place when
+this process stores or consolidates an insight.
+"""
+
+import os
+import re
+import math
+import time
+import heapq
+from collections import Counter
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable, Iterable
+from db.supabase_client import supabase
+
+REFRESH_SECONDS = float(os.getenv("INSIGHT_INDEX_REFRESH_SECONDS", "60"))
+REBUILD_SECONDS = float(os.getenv("INSIGHT_INDEX_REBUILD_SECONDS", "900"))
+PAGE_SIZE = 1000
+
+# Final score = relevance (BM25, scaled to 0-1) + confidence + recency (half-life decay)
+RELEVANCE_WEIGHT = 0.6
+CONFIDENCE_WEIGHT = 0.25
+RECENCY_WEIGHT = 0.15
+HALF_LIFE_DAYS = 30.0
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'into', 'is',
+    'it', 'of', 'on', 'or', 'that', 'the', 'their', 'this', 'to', 'when', 'with'
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords"""
+    return [t for t in re.findall(r'[a-z0-9]+', (text or '').lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def _timestamp(value: Any) -> float:
+    try:
+        return datetime.fromisoformat(str(value)[:19]).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+class InsightIndex:
+    """
+    Incremental BM25 index over one insight table
+
+    Args:
+        table: Supabase table to load from
+        text_fn: Row -> searchable text
+        confidence_fn: Row -> confidence in 0-1
+        agents_fn: Row -> agent names the insight applies to (empty = all)
+        active_filter: (operator, column, value) selecting active rows when loading,
+                       e.g. ('eq', 'status', 'validated')
+    """
+
+    def __init__(
+        self,
+        table: str,
+        text_fn: Callable[[Dict[str, Any]], str],
+        confidence_fn: Callable[[Dict[str, Any]], float],
+        agents_fn: Callable[[Dict[str, Any]], Iterable[str]],
+        active_filter: Optional[tuple] = None,
+        k1: float = 1.5,
+        b: float = 0.75
+    ):
+        self.table = table
+        self.text_fn = text_fn
+        self.confidence_fn = confidence_fn
+        self.agents_fn = agents_fn
+        self.active_filter = active_filter
+        self.k1 = k1
+        self.b = b
+
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.total_length = 0
+        self.loaded_until: Optional[str] = None
+        self.refreshed_at = 0.0
+        self.built_at = 0.0
+
+    def add(self, row: Dict[str, Any]) -> None:
+        """Index (or re-index) one row; rows without an id are left to the next refresh"""
+        doc_id = row.get('id')
+        if not doc_id:
+            return
+        self.remove(doc_id)
+
+        terms = Counter(tokenize(self.text_fn(row)))
+        for term, count in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = count
+        length = sum(terms.values())
+        self.total_length += length
+        self.docs[doc_id] = {
+            'row': row,
+            'terms': list(terms),
+            'length': length,
+            'confidence': max(0.0, min(1.0, float(self.confidence_fn(row) or 0.0))),
+            'agents': set(self.agents_fn(row) or []),
+            'created': _timestamp(row.get('created_at'))
+        }
+
+    def remove(self, doc_id: str) -> None:
+        doc = self.docs.pop(doc_id, None)
+        if not doc:
+            return
+        self.total_length -= doc['length']
+        for term in doc['terms']:
+            postings = self.postings.get(term, {})
+            postings.pop(doc_id, None)
+            if not postings:
+                self.postings.pop(term, None)
+
+    def refresh(self, force: bool = False, rebuild: bool = False) -> None:
+        """Load rows created since the last load (whole table on first use or rebuild)"""
+        if not force and not rebuild and time.monotonic() - self.refreshed_at < REFRESH_SECONDS:
+            return
+        self.refreshed_at = time.monotonic()
+
+        if rebuild or time.monotonic() - self.built_at >= REBUILD_SECONDS:
+            self.docs, self.postings, self.total_length, self.loaded_until = {}, {}, 0, None
+            self.built_at = time.monotonic()
+
+        try:
+            start = 0
+            while True:
+                query = supabase.table(self.table).select('*')
+                if self.active_filter:
+                    op, column, value = self.active_filter
+                    query = getattr(query, op)(column, value)
+                if self.loaded_until:
+                    query = query.gt('created_at', self.loaded_until)
+                rows = query.order('created_at', desc=False).range(start, start + PAGE_SIZE - 1).execute().data or []
+                for row in rows:
+                    self.add(row)
+                    if row.get('created_at') and (not self.loaded_until or str(row['created_at']) > self.loaded_until):
+                        self.loaded_until = str(row['created_at'])
+                if len(rows) < PAGE_SIZE:
+                    break
+                start += PAGE_SIZE
+        except Exception as e:
+            print(f"⚠️ Insight index refresh failed for {self.table}: {str(e)}")
+
+    def _bm25(self, query_terms: List[str]) -> Dict[str, float]:
+        scores: Dict[str, float] = {}
+        count = len(self.docs)
+        avg_length = self.total_length / count if count else 0.0
+        for term in set(query_terms):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = 1 - self.b + self.b * (self.docs[doc_id]['length'] / avg_length if avg_length else 1)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        return scores
+
+    def search(
+        self,
+        query: str = '',
+        limit: int = 5,
+        agent: Optional[str] = None,
+        where: Optional[Callable[[Dict[str, Any]], bool]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Best insights for a query
+
+        Args:
+            query: Free text (topic, subject, grade, agent)
+            limit: Insights to return
+            agent: Only insights that apply to this agent (or to all agents)
+            where: Extra row predicate (e.g. grade applicability)
+
+        Returns:
+            Rows, best first, each with a `relevance` score
+        """
+        self.refresh()
+        relevance = self._bm25(tokenize(query))
+        top_relevance = max(relevance.values(), default=0.0) or 1.0
+        now = time.time()
+
+        def score(doc_id: str) -> float:
+            doc = self.docs[doc_id]
+            age_days = max(0.0, now - doc['created']) / 86400
+            return (
+                RELEVANCE_WEIGHT * relevance.get(doc_id, 0.0) / top_relevance
+                + CONFIDENCE_WEIGHT * doc['confidence']
+                + RECENCY_WEIGHT * 0.5 ** (age_days / HALF_LIFE_DAYS)
+            )
+
+        candidates = [
+            doc_id for doc_id, doc in self.docs.items()
+            if (not agent or not doc['agents'] or agent in doc['agents'])
+            and (where is None or where(doc['row']))
+        ]
+        ranked = heapq.nlargest(limit, candidates, key=score)
+        return [{**self.docs[doc_id]['row'], 'relevance': round(score(doc_id), 3)} for doc_id in ranked]
+
+
+PRIORITY_CONFIDENCE = {'low': 0.4, 'medium': 0.6, 'high': 0.8, 'critical': 1.0}
+
+# Validated learning_insights (used by the generation agents)
+learning_insight_index = InsightIndex(
+    table='learning_insights',
+    text_fn=lambda row: ' '.join([
+        str(row.get('insight_type') or '').replace('_', ' '),
+        str(row.get('description') or ''),
+        ' '.join(map(str, (row.get('applicability') or {}).get('subjects', []) or []))
+    ]),
+    confidence_fn=lambda row: PRIORITY_CONFIDENCE.get(row.get('priority'), 0.6),
+    agents_fn=lambda row: (row.get('applicability') or {}).get('agents', []),
+    active_filter=('eq', 'status', 'validated')
+)
+
+# Reflection insights (cross_agent_learning)
+agent_insight_index = InsightIndex(
+    table='cross_agent_learning',
+    text_fn=lambda row: ' '.join([
+        str(row.get('insight_type') or '').replace('_', ' '),
+        str(row.get('pattern_detected') or ''),
+        str(row.get('action') or '')
+    ]),
+    confidence_fn=lambda row: row.get('confidence_score', 0.5),
+    agents_fn=lambda row: row.get('contributing_agents') or [],
+    active_filter=('neq', 'propagation_status', 'deprecated')
+)
@@ -0,0 +1,172 @@
+"""
+Job Queue Service
+Durable Postgres-backed queue for long-running agent pipelines
+
+The API enqueues jobs and returns immediately; worker processes (see worker.py)
+claim them with claim_agent_job() (FOR UPDATE SKIP LOCKED), report stage progress
+and store the final result on the job row.
+"""
+
+from typing import List, Dict, Any, Optional
+from datetime import datetime, timedelta, timezone
+from db.supabase_client import supabase
+
+# Running jobs whose heartbeat is older than this are reclaimed by another worker
+STALE_JOB_SECONDS = 300
+
+# Retry backoff: 30s after the first failed attempt, doubling up to 10 minutes, so a
+# provider rate limit or sandbox outage doesn't burn every attempt within seconds
+RETRY_BACKOFF_SECONDS = 30
+MAX_RETRY_BACKOFF_SECONDS = 600
+
+
+def retry_delay(attempts: int) -> int:
+    """Seconds before a job that failed its `attempts`-th attempt may be claimed again"""
+    return min(RETRY_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0), MAX_RETRY_BACKOFF_SECONDS)
+
+
+async def enqueue_job(
+    job_type: str,
+    payload: Dict[str, Any],
+    max_attempts: int = 3
+) -> Dict[str, Any]:
+    """
+    Enqueue an agent job
+
+    Args:
+        job_type: 'strategy', 'lesson' or 'activity'
+        payload: Request body passed to the agent
+        max_attempts: How many times a worker may pick the job up
+
+    Returns:
+        The created job row
+    """
+    result = supabase.table('agent_jobs').insert({
+        'job_type': job_type,
+        'payload': payload,
+        'status': 'queued',
+        'max_attempts': max_attempts,
+        'created_at': datetime.now().isoformat(),
+        'updated_at': datetime.now().isoformat()
+    }).execute()
+
+    job = result.data[0]
+    print(f"📥 Enqueued {job_type} job {job['id']}")
+    return job
+
+
+async def claim_job(
+    worker_id: str,
+    job_types: Optional[List[str]] = None
+) -> Optional[Dict[str, Any]]:
+    """Claim the oldest available job (None if the queue is empty)"""
+    result = supabase.rpc('claim_agent_job', {
+        'p_worker_id': worker_id,
+        'p_job_types': job_types,
+        'p_stale_after_seconds': STALE_JOB_SECONDS
+    }).execute()
+
+    return result.data[0] if result.data else None
+
+
+async def record_stage(
+    job_id: str,
+    worker_id: str,
+    stage: str,
+    detail: Optional[Dict[str, Any]] = None
+) -> None:
+    """Append a stage event to the job's progress (also refreshes the heartbeat)"""
+    try:
+        supabase.rpc('record_agent_job_stage', {
+            'p_job_id': job_id,
+            'p_worker_id': worker_id,
+            'p_stage': stage,
+            'p_detail': detail
+        }).execute()
+    except Exception as e:
+        print(f"⚠️ Failed to record stage {stage} for job {job_id}: {str(e)}")
+
+
+async def heartbeat(job_id: str, worker_id: str) -> None:
+    """Keep a long-running job claimed by this worker"""
+    try:
+        supabase.table('agent_jobs')\
+            .update({'heartbeat_at': datetime.now().isoformat()})\
+            .eq('id', job_id)\
+            .eq('worker_id', worker_id)\
+            .eq('status', 'running')\
+            .execute()
+    except Exception as e:
+        print(f"⚠️ Heartbeat failed for job {job_id}: {str(e)}")
+
+
+async def complete_job(job_id: str, worker_id: str, result: Dict[str, Any]) -> None:
+    """Mark a job as succeeded and store its result"""
+    supabase.table('agent_jobs')\
+        .update({
+            'status': 'succeeded',
+            'stage': 'done',
+            'result': result,
+            'error': None,
+            'finished_at': datetime.now().isoformat(),
+            'updated_at': datetime.now().isoformat()
+        })\
+        .eq('id', job_id)\
+        .eq('worker_id', worker_id)\
+        .execute()
+
+
+async def fail_job(job: Dict[str, Any], worker_id: str, error: str) -> None:
+    """Requeue a failed job (after retry_delay) if it has attempts left, otherwise mark it failed"""
+    attempts = job.get('attempts', 1)
+    retry = attempts < job.get('max_attempts', 3)
+
+    update = {
+        'status': 'queued' if retry else 'failed',
+        'error': error[:2000],
+        'updated_at': datetime.now().isoformat()
+    }
+    if retry:
+        # Compared with the database's now(), so the timestamp carries its time zone
+        delay = retry_delay(attempts)
+        update['available_at'] = (datetime.now(timezone.utc) + timedelta(seconds=delay)).isoformat()
+        print(f"🔁 Job {job['id']} requeued, next attempt in {delay}s")
+    else:
+        update['finished_at'] = datetime.now().isoformat()
+
+    supabase.table('agent_jobs')\
+        .update(update)\
+        .eq('id', job['id'])\
+        .eq('worker_id', worker_id)\
+        .execute()
+
+
+async def release_job(job: Dict[str, Any], worker_id: str) -> None:
+    """
+    Requeue a job interrupted by worker shutdown
+
+    The interrupted attempt is given back and the job is claimable right away,
+    instead of staying 'running' until its heartbeat goes stale.
+    """
+    supabase.table('agent_jobs')\
+        .update({
+            'status': 'queued',
+            'worker_id': None,
+            'attempts': max(job.get('attempts', 1) - 1, 0),
+            'available_at': datetime.now(timezone.utc).isoformat(),
+            'updated_at': datetime.now().isoformat()
+        })\
+        .eq('id', job['id'])\
+        .eq('worker_id', worker_id)\
+        .eq('status', 'running')\
+        .execute()
+
+
+async def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Fetch a job row"""
+    result = supabase.table('agent_jobs')\
+        .select('*')\
+        .eq('id', job_id)\
+        .execute()
+
+    return result.data[0] if result.data else None
@@ -3,14 +3,78 @@ Memory Service
 Handles platform memory, learning insights, and performance metrics
 """
 
+import os
+import re
+import asyncio
+from collections import Counter, defaultdict
 from typing import List, Dict, Any, Optional
-from datetime import datetime
-from uuid import UUID
+from datetime import datetime, timedelta
+from uuid import UUID, uuid5, NAMESPACE_URL
 from db.supabase_client import supabase
+from services.insight_index import learning_insight_index
+from services.insight_consolidation import find_similar, merge_learning_insights
+from services.insight_digest import invalidate_insight_digests
+
+
+# Platform-wide memories (e.g. auto-fix statistics) live under one fixed entity id
+PLATFORM_ENTITY_ID = str(uuid5(NAMESPACE_URL, 'tutorpilot/platform'))
+
+# Compaction keeps each student's top-k memories and folds older ones into summaries
+MEMORY_TOP_K = 10
+MEMORY_COMPACT_AFTER_DAYS = 30
+SUMMARY_KEY = 'summary'
+
+
+def normalize_memory_key(key: str) -> str:
+    """Stable memory key: lowercase, timestamps and uuids removed, non-alphanumerics → _"""
+    key = str(key or '').strip().lower()
+    key = re.sub(r'\d{4}-\d{2}-\d{2}([t ][\d:.]+)?(z|[+-]\d{2}:?\d{2})?', '', key)
+    key = re.sub(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', '', key)
+    return re.sub(r'[^a-z0-9]+', '_', key).strip('_') or 'default'
+
+
+async def upsert_memory(
+    entity_type: str,
+    entity_id: str,
+    memory_category: str,
+    memory_key: str,
+    memory_value: Dict[str, Any],
+    confidence_score: float = 0.5,
+    accumulate: Optional[Dict[str, float]] = None
+) -> Optional[Dict]:
+    """
+    Store a memory, updating the existing row for the same (entity, category, key)
+    
+    Args:
+        entity_type: 'student', 'session', 'content', 'platform'
+        entity_id: Entity uuid (PLATFORM_ENTITY_ID for platform-wide memories)
+        memory_category: e.g. 'learning_preference', 'code_debugging'
+        memory_key: Normalized before storing
+        memory_value: Fields merged over the stored value
+        confidence_score: 0-1, replaces the stored confidence
+        accumulate: Numeric fields added to the stored values (counters, totals)
+        
+    Returns:
+        Dict with id and update_count, or None on failure
+    """
+    try:
+        result = supabase.rpc('upsert_platform_memory', {
+            'p_entity_type': entity_type,
+            'p_entity_id': entity_id,
+            'p_memory_category': memory_category,
+            'p_memory_key': normalize_memory_key(memory_key),
+            'p_memory_value': memory_value,
+            'p_confidence_score': max(0.0, min(1.0, confidence_score)),
+            'p_accumulate': accumulate or {}
+        }).execute()
+        return result.data
+    except Exception as e:
+        print(f"Error storing memory: {str(e)}")
+        return None
 
 
 async def load_student_memories(student_id: str, limit: int = 10) -> List[Dict]:
-    """Load student-specific memories for personalization"""
+    """Load student-specific memories for personalization (top-k by confidence)"""
     try:
         response = supabase.table('platform_memory') \
             .select('*') \
@@ -27,35 +91,185 @@ async def load_student_memories(student_id: str, limit: int = 10) -> List[Dict]:
         return []
 
 
+def _summarize_memories(
+    rows: List[Dict[str, Any]],
+    previous: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """Fold memory rows (and an existing summary) into one summary value"""
+    value = dict((previous or {}).get('memory_value') or {})
+    keys = Counter(value.get('keys') or {})
+    keys.update(row['memory_key'] for row in rows)
+    latest = sorted(rows, key=lambda row: str(row.get('last_updated') or ''), reverse=True)[:5]
+
+    return {
+        'memories_folded': int(value.get('memories_folded') or 0) + len(rows),
+        'updates_folded': int(value.get('updates_folded') or 0) + sum(row.get('update_count') or 1 for row in rows),
+        'keys': dict(keys.most_common(20)),
+        'latest': [
+            {'key': row['memory_key'], 'value': row.get('memory_value'), 'at': row.get('last_updated')}
+            for row in latest
+        ] + list(value.get('latest') or [])[:max(0, 5 - len(latest))],
+        'folded_until': max(
+            [str(row.get('last_updated') or '') for row in rows] + [str(value.get('folded_until') or '')]
+        )
+    }
+
+
+async def compact_student_memories(
+    keep: int = MEMORY_TOP_K,
+    older_than_days: int = MEMORY_COMPACT_AFTER_DAYS
+) -> Dict[str, int]:
+    """
+    Fold each student's old, low-ranked memories into one summary row per category
+    
+    The `keep` highest-confidence memories always stay; anything else not updated for
+    `older_than_days` is summarized (key counts, latest values) and deleted.
+    """
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+    stats = {'students': 0, 'folded': 0, 'summaries': 0}
+
+    old_rows = supabase.table('platform_memory') \
+        .select('entity_id') \
+        .eq('entity_type', 'student') \
+        .neq('memory_key', SUMMARY_KEY) \
+        .lt('last_updated', cutoff) \
+        .execute()
+    student_ids = sorted({row['entity_id'] for row in (old_rows.data or [])})
+
+    for student_id in student_ids:
+        rows = supabase.table('platform_memory') \
+            .select('*') \
+            .eq('entity_type', 'student') \
+            .eq('entity_id', student_id) \
+            .order('confidence_score', desc=True) \
+            .execute().data or []
+        memories = [row for row in rows if row['memory_key'] != SUMMARY_KEY]
+        summaries = {row['memory_category']: row for row in rows if row['memory_key'] == SUMMARY_KEY}
+        fold = [row for row in memories[keep:] if str(row.get('last_updated') or '') < cutoff]
+        if not fold:
+            continue
+
+        by_category = defaultdict(list)
+        for row in fold:
+            by_category[row['memory_category']].append(row)
+
+        for category, category_rows in by_category.items():
+            confidences = [float(row.get('confidence_score') or 0.5) for row in category_rows]
+            summary = await upsert_memory(
+                'student', student_id, category, SUMMARY_KEY,
+                _summarize_memories(category_rows, summaries.get(category)),
+                confidence_score=sum(confidences) / len(confidences)
+            )
+            if summary is None:
+                continue
+            supabase.table('platform_memory') \
+                .delete() \
+                .in_('id', [row['id'] for row in category_rows]) \
+                .execute()
+            stats['folded'] += len(category_rows)
+            stats['summaries'] += 1
+        stats['students'] += 1
+
+    return stats
+
+
+async def compact_fix_attempts(batch_size: int = 500) -> int:
+    """Fold legacy one-row-per-attempt auto-fix memories into the per-error-type rows"""
+    folded = 0
+    while True:
+        rows = supabase.table('platform_memory') \
+            .select('id, memory_value') \
+            .eq('memory_category', 'code_debugging') \
+            .eq('memory_key', 'fix_attempt') \
+            .limit(batch_size) \
+            .execute().data or []
+        if not rows:
+            return folded
+
+        totals = defaultdict(lambda: {'attempts': 0, 'attempt_number_total': 0, 'code_length_change_total': 0})
+        ids_by_type = defaultdict(list)
+        for row in rows:
+            value = row.get('memory_value') or {}
+            error_type = value.get('error_type') or 'unknown'
+            bucket = totals[error_type]
+            bucket['attempts'] += 1
+            bucket['attempt_number_total'] += value.get('attempt_number') or 0
+            bucket['code_length_change_total'] += value.get('code_length_change') or 0
+            ids_by_type[error_type].append(row['id'])
+
+        failed = False
+        for error_type, accumulate in totals.items():
+            merged = await upsert_memory(
+                'platform', PLATFORM_ENTITY_ID, 'code_debugging', f"fix_attempt_{error_type}",
+                {'error_type': error_type}, confidence_score=0.6, accumulate=accumulate
+            )
+            if merged is None:
+                # Keep the legacy rows: deleting them would lose these attempts
+                failed = True
+                continue
+            supabase.table('platform_memory') \
+                .delete() \
+                .in_('id', ids_by_type[error_type]) \
+                .execute()
+            folded += len(ids_by_type[error_type])
+
+        if failed:
+            # The same rows would come back on the next page: retry on the next compaction run
+            return folded
+
+
+async def start_memory_compaction_loop(interval_seconds: Optional[float] = None):
+    """
+    Periodic platform memory compaction (MEMORY_COMPACTION_INTERVAL_SECONDS, default 6h)
+    """
+    interval_seconds = interval_seconds or float(os.getenv("MEMORY_COMPACTION_INTERVAL_SECONDS", "21600"))
+    print(f"🗜️ Memory compaction loop started (every {interval_seconds:.0f}s)")
+
+    while True:
+        try:
+            stats = await compact_student_memories()
+            legacy = await compact_fix_attempts()
+            if stats['folded'] or legacy:
+                print(f"🗜️ Compacted memories: {stats['folded']} student memories into "
+                      f"{stats['summaries']} summaries, {legacy} legacy fix attempts")
+        except Exception as e:
+            print(f"Error compacting memories: {str(e)}")
+        await asyncio.sleep(interval_seconds)
+
+
 async def load_learning_insights(
     grade: str,
     subject: Optional[str] = None,
-    limit: int = 5
+    limit: int = 5,
+    topic: Optional[str] = None,
+    agent_type: Optional[str] = None
 ) -> List[Dict]:
-    """Load validated learning insights for adaptive prompting"""
+    """
+    Load the validated learning insights most relevant to this generation
+
+    Args:
+        grade: Student grade (insights scoped to other grades are skipped)
+        subject: Subject (insights scoped to other subjects are skipped)
+        limit: Insights to return
+        topic: Current topic, ranks insights by text relevance
+        agent_type: Requesting agent ('strategy_planner', 'lesson_creator', 'activity_creator')
+
+    Returns:
+        Insights ranked by relevance, confidence and recency
+    """
     try:
-        response = supabase.table('learning_insights') \
-            .select('*') \
-            .eq('status', 'validated') \
-            .order('created_at', desc=True) \
-            .limit(20) \
-            .execute()
-        
-        # Filter client-side for applicability
-        insights = response.data if response.data else []
-        filtered = []
-        
-        for insight in insights:
-            applicability = insight.get('applicability', {})
+        def applicable(insight: Dict) -> bool:
+            applicability = insight.get('applicability') or {}
             grade_levels = applicability.get('grade_levels', [])
             subjects = applicability.get('subjects', [])
             
             # Check if applicable to this grade/subject
-            if not grade_levels or grade in grade_levels:
-                if not subject or not subjects or subject in subjects:
-                    filtered.append(insight)
+            if grade_levels and grade not in grade_levels:
+                return False
+            return not subject or not subjects or subject in subjects
         
-        return filtered[:limit]
+        query = ' '.join(filter(None, [topic, subject, f"grade {grade}" if grade else None, agent_type]))
+        return learning_insight_index.search(query, limit=limit, agent=agent_type, where=applicable)
     except Exception as e:
         print(f"Error loading learning insights: {str(e)}")
         return []
@@ -94,6 +308,7 @@ async def store_performance_metric(
             'error_count': 0 if overall_score >= 7.0 else 1,
             'last_error': None if overall_score >= 7.0 else str(evaluation.get('weaknesses', [])),
             'evaluation_details': evaluation,
+            'rubric_version': evaluation.get('rubric_version'),
             'created_at': datetime.now().isoformat(),
             'last_updated': datetime.now().isoformat()
         }
@@ -114,6 +329,7 @@ async def store_learning_insight(
 ) -> None:
     """
     Store a new learning insight discovered by reflection loop
+    (merged into an active near-duplicate of the same type if one exists)
     
     Args:
         insight_type: 'pattern_recognition', 'effectiveness_correlation', etc.
@@ -123,6 +339,26 @@ async def store_learning_insight(
         priority: 'low', 'medium', 'high', 'critical'
     """
     try:
+        # Restating an active insight adds evidence to it instead of a new row
+        duplicate = find_similar(
+            learning_insight_index,
+            description,
+            where=lambda row: row.get('insight_type') == insight_type
+        )
+        if duplicate:
+            update = merge_learning_insights(duplicate, [{
+                'supporting_evidence': supporting_evidence,
+                'priority': priority
+            }])
+            supabase.table('learning_insights') \
+                .update(update) \
+                .eq('id', duplicate['id']) \
+                .execute()
+            learning_insight_index.add({**duplicate, **update})
+            invalidate_insight_digests()
+            print(f"🔁 Reinforced learning insight: {description[:50]}...")
+            return
+        
         insight = {
             'insight_type': insight_type,
             'description': description,
@@ -135,7 +371,10 @@ async def store_learning_insight(
             'validated_at': datetime.now().isoformat()
         }
         
-        supabase.table('learning_insights').insert(insight).execute()
+        result = supabase.table('learning_insights').insert(insight).execute()
+        for row in (result.data or []):
+            learning_insight_index.add(row)
+        invalidate_insight_digests()
         print(f"✅ Stored learning insight: {description[:50]}...")
         
     except Exception as e:
@@ -156,7 +395,7 @@ def format_insights_for_prompt(insights: List[Dict]) -> str:
         return "No previous learnings available."
     
     result = []
-    for insight in insights[:5]:  # Top 5 most relevant
+    for insight in insights[:5]:  # Already ranked by the insight index
         result.append(f"""
 📊 **{insight['insight_type'].replace('_', ' ').title()}**
    Description: {insight['description']}
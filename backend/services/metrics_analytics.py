@@ -0,0 +1,227 @@
+"""
+Metrics Analytics
+Vectorized statistics over agent_performance_metrics for the reflection prompt
+
+Criteria scores from evaluation_details are loaded into a (rows x criteria) array
+(NaN where a criterion wasn't scored) so means, variance, trends and low-score
+clusters over thousands of generations cost a few array operations, and the LLM
+gets a compact summary instead of raw rows. Heuristic-only evaluations (estimates
+computed from the heuristic's own formula) are excluded.
+"""
+
+from typing import List, Dict, Any, Optional
+import numpy as np
+from db.supabase_client import supabase
+
+LOW_SCORE = 7.0
+PAGE_SIZE = 1000
+SECONDS_PER_DAY = 86400.0
+
+# PostgREST filter keeping LLM-scored metrics (rows without a source predate the heuristic)
+MEASURED_METRICS_FILTER = 'evaluation_details->>source.is.null,evaluation_details->>source.neq.heuristic'
+
+
+def metric_arrays(metrics: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Load metric rows into arrays
+
+    Returns:
+        Dict with criteria (names), scores (rows x criteria, NaN = missing),
+        overall (rows,) and days (rows,) since the first metric
+    """
+    evaluations = [m.get('evaluation_details') or {} for m in metrics]
+    criteria = sorted({
+        name for e in evaluations
+        for name, value in (e.get('criteria') or {}).items()
+        if isinstance(value, dict) and isinstance(value.get('score'), (int, float))
+    })
+    index = {name: i for i, name in enumerate(criteria)}
+
+    scores = np.full((len(metrics), len(criteria)), np.nan)
+    for row, evaluation in enumerate(evaluations):
+        for name, value in (evaluation.get('criteria') or {}).items():
+            if name in index and isinstance(value, dict) and isinstance(value.get('score'), (int, float)):
+                scores[row, index[name]] = value['score']
+
+    overall = np.array([
+        e.get('overall_score') if isinstance(e.get('overall_score'), (int, float)) else np.nan
+        for e in evaluations
+    ], dtype=float)
+
+    timestamps = np.array([str(m.get('created_at') or '')[:19] or 'NaT' for m in metrics], dtype='datetime64[s]')
+    seconds = timestamps.astype('int64').astype(float)
+    seconds[np.isnat(timestamps)] = np.nan
+    days = (seconds - np.nanmin(seconds)) / SECONDS_PER_DAY if len(metrics) and not np.all(np.isnan(seconds)) else seconds
+
+    return {'criteria': criteria, 'scores': scores, 'overall': overall, 'days': days}
+
+
+def _trend_per_30_days(days: np.ndarray, values: np.ndarray) -> Optional[float]:
+    """Least-squares slope of values over time (points per 30 days), None without spread"""
+    mask = ~np.isnan(days) & ~np.isnan(values)
+    if mask.sum() < 3 or np.ptp(days[mask]) < 1:
+        return None
+    slope = np.polyfit(days[mask], values[mask], 1)[0]
+    return round(float(slope) * 30, 2)
+
+
+def summarize_metrics(metrics: List[Dict[str, Any]], low_score: float = LOW_SCORE, top_clusters: int = 5) -> Dict[str, Any]:
+    """
+    Per-criterion statistics and low-score clusters
+
+    Args:
+        metrics: agent_performance_metrics rows (evaluation_details, created_at)
+        low_score: Scores below this count as low
+        top_clusters: Most frequent low-score combinations to report
+
+    Returns:
+        Dict with count, overall stats, per-criterion stats, low-score clusters and
+        the most frequent pairs of criteria that score low together
+    """
+    arrays = metric_arrays(metrics)
+    scores, overall, days, criteria = arrays['scores'], arrays['overall'], arrays['days'], arrays['criteria']
+    count = len(metrics)
+    if not count:
+        return {'count': 0, 'overall': {}, 'criteria': {}, 'low_clusters': [], 'low_pairs': []}
+
+    valid_overall = overall[~np.isnan(overall)]
+    summary = {
+        'count': count,
+        'low_score': low_score,
+        'overall': {
+            'mean': round(float(valid_overall.mean()), 2) if valid_overall.size else None,
+            'std': round(float(valid_overall.std()), 2) if valid_overall.size else None,
+            'p10': round(float(np.percentile(valid_overall, 10)), 2) if valid_overall.size else None,
+            'p90': round(float(np.percentile(valid_overall, 90)), 2) if valid_overall.size else None,
+            'low_rate': round(float((valid_overall < low_score).mean()), 2) if valid_overall.size else None,
+            'trend_per_30_days': _trend_per_30_days(days, overall)
+        },
+        'criteria': {},
+        'low_clusters': [],
+        'low_pairs': []
+    }
+
+    if not criteria:
+        return summary
+
+    scored = ~np.isnan(scores)
+    counts = scored.sum(axis=0)
+    with np.errstate(invalid='ignore'):
+        means = np.nanmean(scores, axis=0)
+        variances = np.nanvar(scores, axis=0)
+    low = scored & (np.nan_to_num(scores, nan=np.inf) < low_score)
+    low_rates = low.sum(axis=0) / np.maximum(counts, 1)
+
+    for i, name in enumerate(criteria):
+        if not counts[i]:
+            continue
+        summary['criteria'][name] = {
+            'n': int(counts[i]),
+            'mean': round(float(means[i]), 2),
+            'variance': round(float(variances[i]), 2),
+            'low_rate': round(float(low_rates[i]), 2),
+            'trend_per_30_days': _trend_per_30_days(days, scores[:, i])
+        }
+
+    # Rows with the same set of low criteria form a cluster
+    low_rows = low[low.any(axis=1)]
+    if low_rows.size:
+        patterns, pattern_counts = np.unique(low_rows, axis=0, return_counts=True)
+        for pattern_index in np.argsort(-pattern_counts)[:top_clusters]:
+            summary['low_clusters'].append({
+                'criteria': [criteria[i] for i in np.flatnonzero(patterns[pattern_index])],
+                'count': int(pattern_counts[pattern_index]),
+                'share': round(float(pattern_counts[pattern_index]) / count, 2)
+            })
+
+        # Co-occurrence of low scores across criteria pairs
+        low_int = low.astype(np.int32)
+        together = low_int.T @ low_int
+        upper_i, upper_j = np.triu_indices(len(criteria), k=1)
+        pair_counts = together[upper_i, upper_j]
+        for k in np.argsort(-pair_counts)[:3]:
+            if pair_counts[k]:
+                summary['low_pairs'].append({
+                    'criteria': [criteria[upper_i[k]], criteria[upper_j[k]]],
+                    'count': int(pair_counts[k])
+                })
+
+    return summary
+
+
+def format_metric_summary(summary: Dict[str, Any], baseline_score: Optional[float] = None) -> str:
+    """Compact text for the reflection prompt"""
+    if not summary.get('count'):
+        return "No metrics available"
+
+    overall = summary['overall']
+    lines = [
+        f"Generations analyzed: {summary['count']}",
+        f"Overall: mean {overall.get('mean')}/10, std {overall.get('std')}, "
+        f"p10-p90 {overall.get('p10')}-{overall.get('p90')}, "
+        f"{int((overall.get('low_rate') or 0) * 100)}% below {summary.get('low_score', LOW_SCORE):g}"
+        + (f", trend {overall['trend_per_30_days']:+} per 30 days" if overall.get('trend_per_30_days') is not None else "")
+    ]
+    if baseline_score is not None:
+        lines.append(f"Average of all previously analyzed generations: {baseline_score:.2f}/10")
+
+    ranked = sorted(summary['criteria'].items(), key=lambda item: item[1]['mean'])
+    if ranked:
+        lines.append("\nPer criterion (weakest first):")
+    for name, stats in ranked:
+        trend = stats.get('trend_per_30_days')
+        lines.append(
+            f"- {name.replace('_', ' ')}: mean {stats['mean']}, variance {stats['variance']}, "
+            f"{int(stats['low_rate'] * 100)}% low (n={stats['n']})"
+            + (f", trend {trend:+}/30d" if trend is not None else "")
+        )
+
+    if summary['low_clusters']:
+        lines.append("\nMost common low-score combinations:")
+        for cluster in summary['low_clusters']:
+            lines.append(
+                f"- {', '.join(c.replace('_', ' ') for c in cluster['criteria'])}: "
+                f"{cluster['count']} generations ({int(cluster['share'] * 100)}%)"
+            )
+
+    if summary['low_pairs']:
+        pairs = '; '.join(f"{' + '.join(p['criteria'])} ({p['count']})" for p in summary['low_pairs'])
+        lines.append(f"Criteria that score low together: {pairs}")
+
+    return "\n".join(lines)
+
+
+async def load_metrics(
+    agent_type: str,
+    since: Optional[str] = None,
+    limit: int = 5000,
+    rubric_version: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Load LLM-scored metric rows for analysis in pages (only the columns the summary reads)
+
+    Args:
+        agent_type: Stored agent_type ('strategy_planner', 'lesson_creator', 'activity_creator')
+        since: ISO timestamp lower bound (inclusive)
+        limit: Max rows (most recent first)
+        rubric_version: Only metrics scored under this rubric (scores from different
+                        rubrics aren't comparable)
+    """
+    rows: List[Dict[str, Any]] = []
+    while len(rows) < limit:
+        query = supabase.table('agent_performance_metrics')\
+            .select('evaluation_details, created_at')\
+            .eq('agent_type', agent_type)\
+            .or_(MEASURED_METRICS_FILTER)
+        if since:
+            query = query.gte('created_at', since)
+        if rubric_version:
+            query = query.eq('rubric_version', rubric_version)
+
+        start = len(rows)
+        end = min(start + PAGE_SIZE, limit) - 1
+        page = query.order('created_at', desc=True).range(start, end).execute().data or []
+        rows.extend(page)
+        if len(page) < end - start + 1:
+            break
+    return rows
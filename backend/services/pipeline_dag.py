@@ -0,0 +1,263 @@
+"""
+Pipeline DAG
+Small dependency-graph executor the agents declare their stages on
+
+Each node names the nodes it depends on; the executor starts every node whose
+dependencies are done (up to `max_concurrency` at once), checkpoints node outputs
+through PipelineCheckpoints and records per-node timings.
+"""
+
+import asyncio
+import time
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Iterable
+
+from services.checkpoint_service import PipelineCheckpoints
+
+NodeFn = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class PipelineNode:
+    """One stage of a pipeline"""
+
+    def __init__(self, name: str, fn: NodeFn, depends_on: Iterable[str] = (), checkpoint: bool = True):
+        self.name = name
+        self.fn = fn
+        self.depends_on = list(depends_on)
+        self.checkpoint = checkpoint
+
+
+class PipelineDAG:
+    """
+    Declarative stage graph for an agent pipeline
+
+    Usage:
+        dag = PipelineDAG('lesson')
+        dag.add('profile', load_profile)
+        dag.add('research', research, depends_on=['profile'])
+        results = await dag.run(checkpoints, on_stage)
+    """
+
+    def __init__(self, pipeline: str, max_concurrency: int = 4):
+        self.pipeline = pipeline
+        self.max_concurrency = max_concurrency
+        self.nodes: Dict[str, PipelineNode] = {}
+        self.timings: Dict[str, Dict[str, Any]] = {}
+
+    def add(
+        self,
+        name: str,
+        fn: NodeFn,
+        depends_on: Iterable[str] = (),
+        checkpoint: bool = True
+    ) -> 'PipelineDAG':
+        """
+        Declare a node
+
+        Args:
+            name: Stage name (also the checkpoint key and the on_stage event)
+            fn: Async callable receiving the outputs of all completed nodes by name
+            depends_on: Nodes that must finish before this one starts
+            checkpoint: Persist the output so a resumed run skips this node
+        """
+        if name in self.nodes:
+            raise ValueError(f"Duplicate pipeline node: {name}")
+        self.nodes[name] = PipelineNode(name, fn, depends_on, checkpoint)
+        return self
+
+    def _validate(self):
+        for node in self.nodes.values():
+            missing = [d for d in node.depends_on if d not in self.nodes]
+            if missing:
+                raise ValueError(f"Node '{node.name}' depends on unknown node(s): {', '.join(missing)}")
+
+        # Kahn's algorithm: every node must be reachable in topological order
+        remaining = {name: set(node.depends_on) for name, node in self.nodes.items()}
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                raise ValueError(f"Cycle in {self.pipeline} pipeline: {', '.join(remaining)}")
+            for name in ready:
+                remaining.pop(name)
+            for deps in remaining.values():
+                deps.difference_update(ready)
+
+    async def _run_node(
+        self,
+        node: PipelineNode,
+        results: Dict[str, Any],
+        checkpoints: Optional[PipelineCheckpoints],
+        on_stage: Optional[Callable[[str], Awaitable[None]]],
+        semaphore: asyncio.Semaphore,
+        preloaded: Dict[str, Any]
+    ) -> Any:
+        if node.name in preloaded:
+            self.timings[node.name] = {'seconds': 0.0, 'resumed': False, 'shared': True}
+            return preloaded[node.name]
+
+        if checkpoints and node.checkpoint and checkpoints.has(node.name):
+            print(f"   ⏭️ Resuming: skipping completed stage '{node.name}'")
+            self.timings[node.name] = {'seconds': 0.0, 'resumed': True}
+            return checkpoints.get(node.name)
+
+        async with semaphore:
+            if on_stage:
+                await on_stage(node.name)
+            started = time.monotonic()
+            output = await node.fn(results)
+            elapsed = time.monotonic() - started
+
+        self.timings[node.name] = {'seconds': round(elapsed, 3), 'resumed': False}
+        if checkpoints and node.checkpoint:
+            await checkpoints.save(node.name, output)
+        return output
+
+    async def run(
+        self,
+        checkpoints: Optional[PipelineCheckpoints] = None,
+        on_stage: Optional[Callable[[str], Awaitable[None]]] = None,
+        preloaded: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Execute the graph
+
+        Args:
+            checkpoints: Stage outputs of an earlier attempt (skipped nodes)
+            on_stage: Async callback invoked with each node name as it starts
+            preloaded: Node outputs supplied by the caller (e.g. context shared
+                       across a batch); these nodes are not run or checkpointed
+
+        Returns:
+            Outputs of every node by name (timings are on `self.timings`)
+
+        Raises:
+            The first node exception; nodes still running are cancelled
+        """
+        self._validate()
+        results: Dict[str, Any] = {}
+        running: Dict[asyncio.Task, str] = {}
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        started = time.monotonic()
+
+        def start_ready():
+            for name, node in self.nodes.items():
+                if name in results or name in running.values():
+                    continue
+                if all(dep in results for dep in node.depends_on):
+                    task = asyncio.create_task(
+                        self._run_node(node, results, checkpoints, on_stage, semaphore, preloaded or {})
+                    )
+                    running[task] = name
+
+        try:
+            start_ready()
+            while running:
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = running.pop(task)
+                    results[name] = task.result()  # Re-raises node failures
+                start_ready()
+        finally:
+            for task in running:
+                task.cancel()
+
+        total = time.monotonic() - started
+        self.timings['total'] = {'seconds': round(total, 3), 'resumed': False}
+        print(f"   ⏱️ {self.pipeline} pipeline finished in {total:.1f}s ({self.format_timings()})")
+        return results
+
+    def format_timings(self) -> str:
+        """One-line summary, e.g. 'profile (shared), research 12.1s, draft (resumed)'"""
+        parts: List[str] = []
+        for name, timing in self.timings.items():
+            if name == 'total':
+                continue
+            if timing.get('shared'):
+                parts.append(f"{name} (shared)")
+            elif timing['resumed']:
+                parts.append(f"{name} (resumed)")
+            else:
+                parts.append(f"{name} {timing['seconds']:.1f}s")
+        return ', '.join(parts)
+
+
+# ==========================================
+# SELF-EVALUATION SCHEDULING
+# ==========================================
+
+# 'sync': evaluate, then persist with the evaluation
+# 'overlap': evaluate as soon as content exists, alongside deployment/persistence (default)
+# 'background': return once content is stored; the evaluation is patched in later
+EVALUATION_MODES = ('sync', 'overlap', 'background')
+
+_background_tasks = set()
+
+
+def add_evaluation_stages(
+    dag: PipelineDAG,
+    evaluation_mode: str,
+    evaluate: NodeFn,
+    persist: NodeFn,
+    finalize: NodeFn,
+    evaluate_after: List[str],
+    persist_after: List[str]
+) -> PipelineDAG:
+    """
+    Wire the evaluation / persistence / finalize nodes for an evaluation mode
+
+    Args:
+        evaluate_after: Nodes evaluation needs in overlap mode (the content only)
+        persist_after: Nodes persistence needs
+    """
+    if evaluation_mode not in EVALUATION_MODES:
+        raise ValueError(f"Unknown evaluation_mode '{evaluation_mode}' (expected one of {', '.join(EVALUATION_MODES)})")
+
+    if evaluation_mode == 'background':
+        return dag.add('persistence', persist, depends_on=persist_after)
+
+    if evaluation_mode == 'sync':
+        dag.add('evaluation', evaluate, depends_on=list(dict.fromkeys(evaluate_after + persist_after)))
+        dag.add('persistence', persist, depends_on=persist_after + ['evaluation'])
+    else:
+        dag.add('evaluation', evaluate, depends_on=evaluate_after)
+        dag.add('persistence', persist, depends_on=persist_after)
+
+    return dag.add('finalize', finalize, depends_on=['evaluation', 'persistence'])
+
+
+def evaluate_in_background(
+    results: Dict[str, Any],
+    evaluate: NodeFn,
+    finalize: NodeFn,
+    checkpoints: Optional[PipelineCheckpoints] = None,
+    label: str = 'evaluation'
+) -> asyncio.Task:
+    """Run evaluation + finalize after the pipeline has returned (errors are logged)"""
+    async def finish():
+        try:
+            outputs = dict(results)
+            if checkpoints:
+                outputs['evaluation'] = await checkpoints.run('evaluation', lambda: evaluate(outputs))
+                await checkpoints.run('finalize', lambda: finalize(outputs))
+            else:
+                outputs['evaluation'] = await evaluate(outputs)
+                await finalize(outputs)
+            print(f"   ✅ Background {label} stored")
+        except Exception as e:
+            print(f"   ⚠️ Background {label} failed: {str(e)}")
+
+    return spawn_background(finish())
+
+
+def spawn_background(coro: Awaitable[Any]) -> asyncio.Task:
+    """Start a fire-and-forget task that shutdown still waits for"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)  # Keep a reference until done
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def drain_background_evaluations(timeout: float = 60.0):
+    """Wait for pending background evaluations (called on shutdown)"""
+    if _background_tasks:
+        print(f"⏳ Waiting for {len(_background_tasks)} background evaluation(s)...")
+        await asyncio.wait(list(_background_tasks), timeout=timeout)
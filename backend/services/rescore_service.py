@@ -0,0 +1,249 @@
+"""
+Rescore Service
+Re-evaluates historical strategies, lessons and activities under the current rubric
+
+Rows are streamed in id order one page at a time, scored through the batched
+evaluator (evaluation cache + bounded concurrency) and written to evaluation_scores
+tagged with the rubric version. The page cursor and the ids of rows that failed to
+score are checkpointed and rows already scored for this rubric are skipped, so a
+requeued job resumes where it stopped; failed rows are retried at the end of each
+content type and again on resume.
+"""
+
+import time
+import asyncio
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+from datetime import datetime
+from db.supabase_client import supabase
+from services.checkpoint_service import load_checkpoints
+from agents.evaluator import evaluator, RUBRIC_VERSION, BATCH_SIZE
+
+CONTENT_TABLES = {
+    'strategy': ('strategies', 'id, student_id, content, self_evaluation'),
+    'lesson': ('lessons', 'id, student_id, content, duration, knowledge_context, self_evaluation'),
+    'activity': ('activities', 'id, student_id, content, code, deployment_status, self_evaluation')
+}
+
+
+def _score(evaluation: Optional[Dict[str, Any]]) -> Optional[float]:
+    score = (evaluation or {}).get('overall_score')
+    return float(score) if isinstance(score, (int, float)) else None
+
+
+def _to_item(content_type: str, row: Dict[str, Any], student: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape a stored row like the evaluate_batch item its pipeline would have produced"""
+    content = row.get('content') or {}
+    item = {'content': content, 'student': student}
+
+    if content_type == 'lesson':
+        item['heuristic_context'] = {
+            'duration': row.get('duration'),
+            'sources': (row.get('knowledge_context') or {}).get('sources', [])
+        }
+    elif content_type == 'activity':
+        if row.get('code') and not content.get('code'):
+            item['content'] = {**content, 'code': row['code']}
+        item['extra'] = {'deployment_status': row.get('deployment_status') or 'success'}
+    return item
+
+
+async def _already_scored(content_type: str, ids: List[str]) -> set:
+    result = supabase.table('evaluation_scores')\
+        .select('content_id')\
+        .eq('content_type', content_type)\
+        .eq('rubric_version', RUBRIC_VERSION)\
+        .in_('content_id', ids)\
+        .execute()
+    return {row['content_id'] for row in (result.data or [])}
+
+
+async def _load_students(student_ids: List[str], students: Dict[str, Dict]) -> None:
+    """Fill the student cache with any profiles not loaded yet"""
+    missing = [sid for sid in set(student_ids) if sid and sid not in students]
+    if not missing:
+        return
+    result = supabase.table('students')\
+        .select('*')\
+        .in_('id', missing)\
+        .execute()
+    for student in (result.data or []):
+        students[student['id']] = student
+
+
+async def rescore_history(
+    content_types: Optional[List[str]] = None,
+    page_size: int = 50,
+    concurrency: int = 4,
+    limit: Optional[int] = None,
+    on_stage: Optional[Callable[..., Awaitable[None]]] = None,
+    request_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Re-score stored content with the current rubric
+
+    Args:
+        content_types: Subset of 'strategy', 'lesson', 'activity' (default: all)
+        page_size: Rows read per page
+        concurrency: Batched evaluation calls in flight at once
+        limit: Stop after this many rows per content type (default: all)
+        on_stage: Async callback (stage, detail=None); emits a progress event per page
+        request_id: Resume key; page cursors are checkpointed under it
+
+    Returns:
+        Per-type and total counts, throughput and the mean shift against the
+        stored self_evaluation scores
+    """
+    content_types = content_types or list(CONTENT_TABLES)
+    unknown = [t for t in content_types if t not in CONTENT_TABLES]
+    if unknown:
+        raise ValueError(f"Unknown content type(s): {', '.join(unknown)}")
+
+    print(f"\n🔁 Re-scoring {', '.join(content_types)} under rubric v{RUBRIC_VERSION} "
+          f"(page_size={page_size}, concurrency={concurrency})...")
+
+    checkpoints = await load_checkpoints(f"{request_id}:rescore" if request_id else None, 'rescore')
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    students: Dict[str, Dict] = {}
+    report: Dict[str, Dict[str, Any]] = {}
+    started = time.monotonic()
+
+    for content_type in content_types:
+        table, columns = CONTENT_TABLES[content_type]
+        stats = {'rows': 0, 'scored': 0, 'skipped': 0, 'cached': 0, 'failed': 0, 'seconds': 0.0}
+        shifts: List[float] = []
+        type_started = time.monotonic()
+
+        # Rows whose evaluation failed: retried at the end of the type, kept across resumes
+        failed_ids: List[str] = list(checkpoints.get(f"{content_type}_failed") or [])
+        cursor = checkpoints.get(f"{content_type}_cursor")
+        if cursor == 'done' and not failed_ids:
+            print(f"   ⏭️ {content_type}: already re-scored")
+            report[content_type] = {**stats, 'resumed': True}
+            continue
+
+        async def score_rows(rows: List[Dict[str, Any]]) -> List[str]:
+            """Score the rows not yet scored under this rubric; returns the ids that failed"""
+            done = await _already_scored(content_type, [row['id'] for row in rows])
+            todo = [row for row in rows if row['id'] not in done]
+            stats['skipped'] += len(rows) - len(todo)
+            await _load_students([row.get('student_id') for row in todo], students)
+            failed: List[str] = []
+
+            async def score_chunk(chunk: List[Dict[str, Any]]):
+                items = [_to_item(content_type, row, students.get(row.get('student_id')) or {}) for row in chunk]
+                async with semaphore:
+                    try:
+                        evaluations = await evaluator.evaluate_batch(content_type, items, force_llm=True)
+                    except Exception as e:
+                        print(f"   ⚠️ Re-scoring {len(chunk)} {content_type}(s) failed: {str(e)}")
+                        failed.extend(row['id'] for row in chunk)
+                        return
+
+                records = []
+                for row, evaluation in zip(chunk, evaluations):
+                    if evaluation.get('parse_failed'):
+                        failed.append(row['id'])
+                        continue
+                    previous = _score(row.get('self_evaluation'))
+                    current = _score(evaluation)
+                    if previous is not None and current is not None:
+                        shifts.append(current - previous)
+                    stats['cached'] += 1 if evaluation.get('cached') else 0
+                    records.append({
+                        'content_type': content_type,
+                        'content_id': row['id'],
+                        'rubric_version': RUBRIC_VERSION,
+                        'overall_score': current,
+                        'previous_score': previous,
+                        'evaluation': evaluation,
+                        'created_at': datetime.now().isoformat()
+                    })
+
+                if records:
+                    try:
+                        supabase.table('evaluation_scores')\
+                            .upsert(records, on_conflict='content_type,content_id,rubric_version')\
+                            .execute()
+                        stats['scored'] += len(records)
+                    except Exception as e:
+                        print(f"   ⚠️ Storing {len(records)} {content_type} score(s) failed: {str(e)}")
+                        failed.extend(record['content_id'] for record in records)
+
+            await asyncio.gather(*(
+                score_chunk(todo[i:i + BATCH_SIZE]) for i in range(0, len(todo), BATCH_SIZE)
+            ))
+            return failed
+
+        while cursor != 'done' and (limit is None or stats['rows'] < limit):
+            query = supabase.table(table)\
+                .select(columns)\
+                .not_.is_('content', 'null')\
+                .order('id', desc=False)\
+                .limit(page_size if limit is None else min(page_size, limit - stats['rows']))
+            if cursor:
+                query = query.gt('id', cursor)
+            rows = query.execute().data or []
+            if not rows:
+                break
+
+            stats['rows'] += len(rows)
+            page_failed = await score_rows(rows)
+
+            # Advance only after the whole page is stored or recorded as failed
+            if page_failed:
+                failed_ids.extend(page_failed)
+                await checkpoints.save(f"{content_type}_failed", failed_ids)
+            cursor = rows[-1]['id']
+            await checkpoints.save(f"{content_type}_cursor", cursor)
+
+            elapsed = time.monotonic() - type_started
+            rate = round(stats['rows'] / elapsed * 60, 1) if elapsed else 0.0
+            print(f"   📄 {content_type}: {stats['rows']} rows ({stats['scored']} scored, "
+                  f"{stats['skipped']} skipped, {len(failed_ids)} failed) - {rate} rows/min")
+            if on_stage:
+                await on_stage(f"rescore_{content_type}", {**stats, 'failed': len(failed_ids), 'rows_per_minute': rate})
+
+            if len(rows) < page_size:
+                break
+
+        # One more attempt for the failed rows (a resumed run retries what is still left)
+        if failed_ids:
+            print(f"   🔁 {content_type}: retrying {len(failed_ids)} failed row(s)")
+            still_failed: List[str] = []
+            for i in range(0, len(failed_ids), page_size):
+                ids = failed_ids[i:i + page_size]
+                rows = supabase.table(table)\
+                    .select(columns)\
+                    .in_('id', ids)\
+                    .execute().data or []
+                still_failed.extend(await score_rows(rows))
+            failed_ids = still_failed
+            await checkpoints.save(f"{content_type}_failed", failed_ids)
+        stats['failed'] = len(failed_ids)
+
+        if limit is None and cursor != 'done':
+            await checkpoints.save(f"{content_type}_cursor", 'done')
+
+        elapsed = time.monotonic() - type_started
+        stats['seconds'] = round(elapsed, 1)
+        stats['rows_per_minute'] = round(stats['rows'] / elapsed * 60, 1) if elapsed else 0.0
+        stats['mean_score_shift'] = round(sum(shifts) / len(shifts), 2) if shifts else None
+        report[content_type] = stats
+
+    elapsed = time.monotonic() - started
+    total_seconds = round(elapsed, 1)
+    totals = {
+        key: sum(stats.get(key, 0) for stats in report.values())
+        for key in ('rows', 'scored', 'skipped', 'cached', 'failed')
+    }
+    totals['seconds'] = total_seconds
+    totals['rows_per_minute'] = round(totals['rows'] / elapsed * 60, 1) if elapsed else 0.0
+
+    print(f"   ✅ Re-scored {totals['scored']} item(s) in {total_seconds}s "
+          f"({totals['rows_per_minute']} rows/min, {totals['cached']} from cache)")
+
+    return {
+        'rubric_version': RUBRIC_VERSION,
+        'by_type': report,
+        'totals': totals
+    }
@@ -0,0 +1,253 @@
+"""
+Save Coalescer
+Buffers rapid autosaves per (content_type, content_id, tutor) and commits one version
+
+Every edit inside the debounce window replaces the buffered content and merges its
+edit notes; the version is written once the document has been quiet for
+`debounce_seconds` (or `max_wait_seconds` after the first buffered edit).
+
+A failed commit is retried up to `max_attempts` times; invalid edits (ValueError) are
+not retried. Dropped edits are kept per document (with their content) and reported by
+failed_saves() and the next acknowledgement, so the tutor can re-save them.
+"""
+
+import os
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from db.supabase_client import supabase
+from services.version_service import save_content_version, PARENT_TABLES
+
+BufferKey = Tuple[str, str, str]
+
+# Dropped edits remembered per document
+MAX_FAILED_SAVES = 5
+
+# Errors that fail the same way on every retry
+NON_RETRYABLE_ERRORS = (ValueError, LookupError)
+
+
+class SaveCoalescer:
+    """In-process debounce buffer in front of save_content_version"""
+
+    def __init__(self, debounce_seconds: float = 5.0, max_wait_seconds: float = 30.0, max_attempts: int = 3):
+        self.debounce_seconds = debounce_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.max_attempts = max_attempts
+        self._pending: Dict[BufferKey, Dict[str, Any]] = {}
+        self._failed: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self._lock = asyncio.Lock()
+
+    def _validate(self, content_type: str, content_id: str):
+        """Reject edits that could never be committed before acknowledging them"""
+        table_name = PARENT_TABLES.get(content_type)
+        if not table_name:
+            raise ValueError(f"Unsupported content type: {content_type}")
+
+        parent = supabase.table(table_name)\
+            .select('id')\
+            .eq('id', content_id)\
+            .execute()
+        if not parent.data:
+            raise LookupError(f"{content_type.capitalize()} {content_id} not found")
+
+    async def submit(
+        self,
+        content_type: str,
+        content_id: str,
+        tutor_id: str,
+        content: Dict[str, Any],
+        edit_notes: Optional[str] = None,
+        changes_summary: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Buffer an edit and acknowledge immediately
+
+        The document is validated when a new buffer is opened for it.
+
+        Returns:
+            Acknowledgement describing the buffered state (plus this tutor's
+            dropped edits of the document, if any)
+
+        Raises:
+            ValueError: Unsupported content type
+            LookupError: The document does not exist
+        """
+        key = (content_type, content_id, tutor_id)
+        if key not in self._pending:
+            self._validate(content_type, content_id)
+        now = time.monotonic()
+
+        async with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = {
+                    'content': content,
+                    'edit_notes': [],
+                    'changes_summaries': [],
+                    'edit_count': 0,
+                    'attempts': 0,
+                    'first_buffered_at': now,
+                    'timer': None
+                }
+                self._pending[key] = entry
+
+            entry['content'] = content  # Only the latest content is kept
+            entry['edit_count'] += 1
+            if edit_notes and edit_notes not in entry['edit_notes']:
+                entry['edit_notes'].append(edit_notes)
+            if changes_summary and changes_summary not in entry['changes_summaries']:
+                entry['changes_summaries'].append(changes_summary)
+
+            # Debounce, but never hold an edit longer than max_wait_seconds
+            waited = now - entry['first_buffered_at']
+            delay = max(0.0, min(self.debounce_seconds, self.max_wait_seconds - waited))
+
+            if entry['timer']:
+                entry['timer'].cancel()
+            entry['timer'] = asyncio.create_task(self._flush_after(key, delay))
+
+            ack = {
+                'status': 'buffered',
+                'buffered_edits': entry['edit_count'],
+                'commit_in_seconds': round(delay, 2),
+                'edit_notes': ' | '.join(entry['edit_notes']) or None
+            }
+            failed = self.failed_saves(content_type, content_id, tutor_id)
+            if failed:
+                ack['failed_saves'] = failed
+            return ack
+
+    async def _flush_after(self, key: BufferKey, delay: float):
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            return
+        await self.flush(key)
+
+    async def flush(self, key: BufferKey) -> Optional[Dict[str, Any]]:
+        """Commit the buffered edit for one key (no-op if nothing is pending)"""
+        async with self._lock:
+            entry = self._pending.pop(key, None)
+            if entry is None:
+                return None
+            timer = entry.get('timer')
+            if timer and timer is not asyncio.current_task():
+                timer.cancel()
+
+        content_type, content_id, tutor_id = key
+        try:
+            saved = await save_content_version(
+                content_type=content_type,
+                content_id=content_id,
+                content=entry['content'],
+                tutor_id=tutor_id,
+                edit_type='manual_edit',
+                edit_notes=' | '.join(entry['edit_notes']) or None,
+                changes_summary='; '.join(entry['changes_summaries']) or None
+            )
+            print(f"💾 Committed {entry['edit_count']} buffered edit(s) as "
+                  f"{content_type} v{saved['version_number']}")
+            # The committed content supersedes this tutor's earlier dropped edits
+            failed = self._failed.get((content_type, content_id))
+            if failed:
+                failed[:] = [f for f in failed if f['tutor_id'] != tutor_id]
+            return saved
+        except Exception as e:
+            entry['attempts'] += 1
+            print(f"⚠️ Coalesced save failed for {content_type} {content_id} "
+                  f"(attempt {entry['attempts']}/{self.max_attempts}): {str(e)}")
+            await self._requeue(key, entry, e)
+            return None
+
+    def _drop(self, key: BufferKey, entry: Dict[str, Any], error: Exception):
+        """Give up on an edit and remember it for the tutor"""
+        content_type, content_id, tutor_id = key
+        print(f"❌ Dropped {entry['edit_count']} buffered edit(s) of {content_type} {content_id}: {str(error)}")
+        failed = self._failed.setdefault((content_type, content_id), [])
+        failed.append({
+            'tutor_id': tutor_id,
+            'edit_count': entry['edit_count'],
+            'attempts': entry['attempts'],
+            'error': str(error),
+            'failed_at': datetime.now().isoformat(),
+            'edit_notes': ' | '.join(entry['edit_notes']) or None,
+            'content': entry['content']
+        })
+        del failed[:-MAX_FAILED_SAVES]
+
+    async def _requeue(self, key: BufferKey, entry: Dict[str, Any], error: Exception):
+        """
+        Put a failed flush back in the buffer (newer edits win) and retry later
+
+        Invalid edits and edits out of attempts are dropped instead.
+        """
+        async with self._lock:
+            newer = self._pending.get(key)
+            if newer is not None:
+                newer['edit_notes'] = entry['edit_notes'] + [
+                    n for n in newer['edit_notes'] if n not in entry['edit_notes']
+                ]
+                newer['changes_summaries'] = entry['changes_summaries'] + [
+                    c for c in newer['changes_summaries'] if c not in entry['changes_summaries']
+                ]
+                newer['edit_count'] += entry['edit_count']
+                return
+
+            if isinstance(error, NON_RETRYABLE_ERRORS) or entry['attempts'] >= self.max_attempts:
+                self._drop(key, entry, error)
+                return
+
+            entry['first_buffered_at'] = time.monotonic()
+            entry['timer'] = asyncio.create_task(self._flush_after(key, self.debounce_seconds))
+            self._pending[key] = entry
+
+    async def flush_content(self, content_type: str, content_id: str) -> int:
+        """
+        Commit pending edits for a document from every tutor (read-your-writes)
+
+        Returns:
+            Number of buffers flushed
+        """
+        return await self.flush_contents(content_type, [content_id])
+
+    async def flush_contents(self, content_type: str, content_ids: List[str]) -> int:
+        """Commit pending edits for several documents (e.g. a student's strategies)"""
+        ids = set(content_ids)
+        keys = [k for k in list(self._pending) if k[0] == content_type and k[1] in ids]
+        for key in keys:
+            await self.flush(key)
+        return len(keys)
+
+    def pending_edits(self, content_type: str, content_id: str, tutor_id: Optional[str] = None) -> int:
+        """Edits of a document waiting in the buffer"""
+        return sum(
+            entry['edit_count'] for (ctype, cid, tid), entry in self._pending.items()
+            if ctype == content_type and cid == content_id and (tutor_id is None or tid == tutor_id)
+        )
+
+    def failed_saves(
+        self,
+        content_type: str,
+        content_id: str,
+        tutor_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Edits of a document that were dropped after failing to commit (newest last)"""
+        return [
+            f for f in self._failed.get((content_type, content_id), [])
+            if tutor_id is None or f['tutor_id'] == tutor_id
+        ]
+
+    async def flush_all(self):
+        """Commit everything that is buffered (called on shutdown)"""
+        for key in list(self._pending):
+            await self.flush(key)
+
+
+# Global instance
+save_coalescer = SaveCoalescer(
+    debounce_seconds=float(os.getenv("SAVE_COALESCE_SECONDS", "5")),
+    max_wait_seconds=float(os.getenv("SAVE_COALESCE_MAX_WAIT_SECONDS", "30")),
+    max_attempts=int(os.getenv("SAVE_COALESCE_MAX_ATTEMPTS", "3"))
+)
@@ -0,0 +1,243 @@
+"""
+Strategy Index
+Structured per-week records for strategies (strategy_weeks)
+
+Written when a strategy is generated and re-synced on every saved version, so lesson
+creation reads one indexed row instead of downloading and re-parsing the strategy.
+"""
+
+import re
+import html
+from typing import List, Dict, Any, Optional
+from datetime import datetime
+from db.supabase_client import supabase
+
+EXCERPT_CHARS = 500
+
+# Labels used in the strategy prompt's "Week N" sections
+OBJECTIVE_LABELS = ('learning goals', 'learning objectives', 'objectives')
+KEY_CONCEPT_LABELS = ('key concepts',)
+
+
+def html_to_text(value: str) -> str:
+    """Rough HTML → markdown-ish text (headings become '## ' lines, list items '- ' lines)"""
+    value = re.sub(r'<h[1-6][^>]*>', '\n## ', value, flags=re.IGNORECASE)
+    value = re.sub(r'<li[^>]*>', '\n- ', value, flags=re.IGNORECASE)
+    value = re.sub(r'<br\s*/?>|</p>|</h\d>|</li>|</ul>|</ol>', '\n', value, flags=re.IGNORECASE)
+    value = re.sub(r'<[^>]+>', '', value)
+    return html.unescape(value)
+
+
+def _strip_markup(value: str) -> str:
+    return re.sub(r'[*_`#]+', '', value).strip(' -:\t')
+
+
+def _week_section(text: str, week_number: int) -> str:
+    pattern = rf"(?:Week|WEEK)\s*{week_number}[:\s]+.*?(?=(?:Week|WEEK)\s*\d+|$)"
+    match = re.search(pattern, text, re.DOTALL | re.IGNORECASE)
+    return match.group(0) if match else ""
+
+
+def _labelled_items(section: str, labels: tuple) -> List[str]:
+    """
+    Items under a '**Label**:' line of a week section
+
+    Takes the inline text after the label plus the more-indented bullets below it,
+    stopping at the next labelled line.
+    """
+    lines = section.split('\n')
+    for i, line in enumerate(lines):
+        plain = _strip_markup(line).lower()
+        label = next((l for l in labels if plain.startswith(l)), None)
+        if not label:
+            continue
+
+        items = []
+        inline = _strip_markup(_strip_markup(line)[len(label):])
+        if inline:
+            items.append(inline)
+
+        indent = len(line) - len(line.lstrip())
+        for follow in lines[i + 1:]:
+            if not follow.strip():
+                continue
+            follow_indent = len(follow) - len(follow.lstrip())
+            if follow_indent <= indent or re.match(r'\s*[-*]\s*\*\*[^*]+\*\*\s*:', follow):
+                break
+            item = _strip_markup(follow)
+            if item:
+                items.append(item)
+        return items[:8]
+
+    return []
+
+
+def build_week_index(
+    content: Any,
+    knowledge_contexts: Optional[List[Dict]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Build per-week records from strategy content
+
+    Args:
+        content: Strategy content (markdown/html document or legacy JSON with 'weeks')
+        knowledge_contexts: The strategy's stored research (one entry per week)
+
+    Returns:
+        List of {week_number, topic, objectives, key_concepts, excerpt, research_index}
+    """
+    knowledge_contexts = knowledge_contexts or []
+    if not isinstance(content, dict):
+        return []
+
+    def research_index(week_number: int, topic: str) -> Optional[int]:
+        index = week_number - 1
+        if index < len(knowledge_contexts) and (knowledge_contexts[index] or {}).get('topic') == topic:
+            return index
+        return None
+
+    # Legacy JSON format
+    if isinstance(content.get('weeks'), list):
+        return [
+            {
+                'week_number': week.get('week_number', i + 1),
+                'topic': week.get('topic', ''),
+                'objectives': week.get('learning_objectives', []),
+                'key_concepts': week.get('key_concepts', []),
+                'excerpt': week.get('focus_area', ''),
+                'research_index': research_index(week.get('week_number', i + 1), week.get('topic', ''))
+            }
+            for i, week in enumerate(content['weeks'])
+        ]
+
+    # Markdown / HTML document (topics fall back to the research when an edit dropped them)
+    topics = content.get('topics') or [(kc or {}).get('topic', '') for kc in knowledge_contexts]
+    text = content.get('content', '') or ''
+    if content.get('format') == 'html':
+        text = html_to_text(text)
+
+    weeks = []
+    for i, topic in enumerate(topics):
+        week_number = i + 1
+        section = _week_section(text, week_number)
+        weeks.append({
+            'week_number': week_number,
+            'topic': topic,
+            'objectives': _labelled_items(section, OBJECTIVE_LABELS),
+            'key_concepts': _labelled_items(section, KEY_CONCEPT_LABELS),
+            'excerpt': section[:EXCERPT_CHARS],
+            'research_index': research_index(week_number, topic)
+        })
+    return weeks
+
+
+async def sync_strategy_weeks(
+    strategy_id: str,
+    content: Any,
+    knowledge_contexts: Optional[List[Dict]] = None,
+    version_number: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Rewrite the week index for a strategy (failures are logged, never fatal)
+
+    Args:
+        knowledge_contexts: Stored research; loaded from the strategy when None
+        version_number: Strategy version the index was built from
+
+    Returns:
+        The indexed week records (empty if nothing could be indexed)
+    """
+    try:
+        if knowledge_contexts is None:
+            strategy = supabase.table('strategies')\
+                .select('knowledge_contexts')\
+                .eq('id', strategy_id)\
+                .execute()
+            knowledge_contexts = (strategy.data[0].get('knowledge_contexts') if strategy.data else None) or []
+
+        weeks = build_week_index(content, knowledge_contexts)
+        if not weeks:
+            return []
+
+        now = datetime.now().isoformat()
+        supabase.table('strategy_weeks').upsert([
+            {**week, 'strategy_id': strategy_id, 'source_version': version_number, 'updated_at': now}
+            for week in weeks
+        ], on_conflict='strategy_id,week_number').execute()
+
+        # Drop weeks an edit removed
+        supabase.table('strategy_weeks')\
+            .delete()\
+            .eq('strategy_id', strategy_id)\
+            .gt('week_number', len(weeks))\
+            .execute()
+
+        print(f"   🗂️ Indexed {len(weeks)} weeks for strategy {strategy_id}")
+        return weeks
+
+    except Exception as e:
+        print(f"⚠️ Failed to index weeks for strategy {strategy_id}: {str(e)}")
+        return []
+
+
+async def load_strategy_weeks(
+    strategy_id: str,
+    week_number: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """Indexed week records for a strategy (optionally a single week), ordered by week"""
+    query = supabase.table('strategy_weeks')\
+        .select('*')\
+        .eq('strategy_id', strategy_id)
+
+    if week_number is not None:
+        query = query.eq('week_number', week_number)
+
+    result = query.order('week_number', desc=False).execute()
+    return result.data or []
+
+
+async def ensure_strategy_weeks(
+    strategy_id: str,
+    week_number: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Indexed weeks for a strategy, backfilling the index for strategies created
+    before it existed (the only path that still downloads and parses the content)
+
+    Raises:
+        ValueError: If the strategy does not exist
+    """
+    weeks = await load_strategy_weeks(strategy_id, week_number)
+    if weeks:
+        return weeks
+
+    strategy = supabase.table('strategies')\
+        .select('content, knowledge_contexts, current_version')\
+        .eq('id', strategy_id)\
+        .execute()
+
+    if not strategy.data:
+        raise ValueError(f"Strategy {strategy_id} not found")
+
+    row = strategy.data[0]
+    weeks = await sync_strategy_weeks(
+        strategy_id,
+        row.get('content'),
+        row.get('knowledge_contexts') or [],
+        row.get('current_version')
+    )
+    if week_number is not None:
+        weeks = [w for w in weeks if w['week_number'] == week_number]
+    return weeks
+
+
+def week_record_to_context(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape an index row like the strategy_context the lesson prompt expects"""
+    return {
+        'topic': record['topic'],
+        'strategy_excerpt': record.get('excerpt') or '',
+        'learning_objectives': record.get('objectives') or [],
+        'key_concepts': record.get('key_concepts') or [],
+        'research_index': record.get('research_index'),
+        'week_number': record['week_number']
+    }
@@ -0,0 +1,398 @@
+"""
+Version Service
+Delta-encoded version history for strategies/lessons and activity chat code snapshots
+
+Content versions are stored as JSON Patches against the previous version (long text
+bodies as text deltas), with a full checkpoint every CONTENT_CHECKPOINT_INTERVAL
+versions or whenever the patch would not be smaller than the content. Chat code
+snapshots are stored as line deltas with a checkpoint every CODE_CHECKPOINT_INTERVAL
+responses.
+"""
+
+import json
+from typing import List, Dict, Any, Optional
+from db.supabase_client import supabase
+from services.delta_service import (
+    diff_json,
+    apply_json_patch,
+    diff_text,
+    apply_text_diff,
+    text_fingerprint,
+    CONTENT_CHECKPOINT_INTERVAL,
+    CODE_CHECKPOINT_INTERVAL
+)
+from services.strategy_index import sync_strategy_weeks
+from services.pipeline_dag import spawn_background
+
+PARENT_TABLES = {
+    'strategy': 'strategies',
+    'lesson': 'lessons'
+}
+
+
+# ==========================================
+# CONTENT VERSIONS (strategies & lessons)
+# ==========================================
+
+async def save_content_version(
+    content_type: str,
+    content_id: str,
+    content: Dict[str, Any],
+    tutor_id: str,
+    edit_type: str = 'manual_edit',
+    edit_notes: Optional[str] = None,
+    changes_summary: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Save a new version as a delta against the parent's current content
+
+    A patch that is not smaller than the new content (e.g. a generated strategy first
+    saved as an edited HTML body) is dropped for a full copy. The RPC then decides
+    atomically whether to keep the delta or store a full checkpoint (first version,
+    every CONTENT_CHECKPOINT_INTERVAL versions, or when a concurrent save moved the
+    base version).
+
+    Strategy saves also re-sync the strategy_weeks index; tutor edits re-score the
+    affected evaluation criteria in the background (self_evaluation_delta).
+
+    Returns:
+        Dict with id, version_number and storage_format
+    """
+    table_name = PARENT_TABLES.get(content_type)
+    if not table_name:
+        raise ValueError(f"Unsupported content type: {content_type}")
+
+    parent = supabase.table(table_name)\
+        .select('current_version, content, student_id, self_evaluation')\
+        .eq('id', content_id)\
+        .execute()
+
+    delta = None
+    base_version = None
+    if parent.data and parent.data[0].get('content') is not None:
+        base_version = parent.data[0].get('current_version')
+        delta = diff_json(parent.data[0]['content'], content)
+        if len(json.dumps(delta)) >= len(json.dumps(content)):
+            delta = None
+
+    result = supabase.rpc('create_content_version', {
+        'p_content_type': content_type,
+        'p_content_id': content_id,
+        'p_new_content': content,
+        'p_edited_by': tutor_id,
+        'p_edit_type': edit_type,
+        'p_edit_notes': edit_notes,
+        'p_changes_summary': changes_summary,
+        'p_delta': delta,
+        'p_base_version': base_version,
+        'p_checkpoint_interval': CONTENT_CHECKPOINT_INTERVAL
+    }).execute()
+
+    # Keep the per-week index in step with the edited strategy
+    if content_type == 'strategy':
+        await sync_strategy_weeks(content_id, content, version_number=result.data.get('version_number'))
+
+    # Tutor edits: re-score only the affected criteria without delaying the save
+    if edit_type in ('manual_edit', 'tutor_refinement') and parent.data and parent.data[0].get('self_evaluation'):
+        row = parent.data[0]
+        spawn_background(rescore_content_version(
+            content_type=content_type,
+            content_id=content_id,
+            version_number=result.data.get('version_number'),
+            old_content=row.get('content'),
+            new_content=content,
+            student_id=row.get('student_id'),
+            base_evaluation=row['self_evaluation']
+        ))
+
+    return result.data
+
+
+async def load_current_evaluation(
+    content_type: str,
+    content_id: str,
+    base_evaluation: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Generation-time evaluation with every stored self_evaluation_delta applied in order"""
+    deltas = supabase.table('content_versions')\
+        .select('version_number, self_evaluation_delta')\
+        .eq('content_type', content_type)\
+        .eq('content_id', content_id)\
+        .not_.is_('self_evaluation_delta', 'null')\
+        .order('version_number', desc=False)\
+        .execute()
+
+    criteria = dict(base_evaluation.get('criteria') or {})
+    overall = base_evaluation.get('overall_score')
+    for row in deltas.data or []:
+        delta = row['self_evaluation_delta']
+        if delta.get('full_rescore'):
+            criteria = {}
+        for name, value in (delta.get('criteria') or {}).items():
+            criteria[name] = {k: v for k, v in value.items() if k != 'previous_score'}
+        overall = delta.get('overall_score', overall)
+
+    return {**base_evaluation, 'criteria': criteria, 'overall_score': overall}
+
+
+async def rescore_content_version(
+    content_type: str,
+    content_id: str,
+    version_number: int,
+    old_content: Dict[str, Any],
+    new_content: Dict[str, Any],
+    student_id: Optional[str],
+    base_evaluation: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    """
+    Partially re-evaluate an edited version and store content_versions.self_evaluation_delta
+
+    Returns:
+        The stored delta, or None if nothing was re-scored
+    """
+    from agents.evaluator import evaluator
+    from db.supabase_client import get_student
+
+    try:
+        student = await get_student(student_id) if student_id else None
+        previous = await load_current_evaluation(content_type, content_id, base_evaluation)
+        delta = await evaluator.evaluate_edit(content_type, old_content, new_content, student or {}, previous)
+        if not delta:
+            return None
+
+        supabase.table('content_versions')\
+            .update({'self_evaluation_delta': delta})\
+            .eq('content_type', content_type)\
+            .eq('content_id', content_id)\
+            .eq('version_number', version_number)\
+            .execute()
+        return delta
+
+    except Exception as e:
+        print(f"⚠️ Re-evaluation failed for {content_type} {content_id} v{version_number}: {str(e)}")
+        return None
+
+
+def reconstruct_versions(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Rebuild full content for a run of version rows
+
+    Args:
+        rows: Version rows sorted by version_number ascending, starting at a checkpoint
+
+    Returns:
+        Same rows with `content` filled in (delta fields removed)
+    """
+    rebuilt = []
+    previous = None
+    previous_number = None
+
+    for row in rows:
+        row = dict(row)
+        if row.get('storage_format', 'full') == 'delta':
+            if previous is None or row.get('base_version') != previous_number:
+                print(f"⚠️ Missing base for version {row.get('version_number')}, cannot rebuild")
+                row['content'] = None
+            else:
+                row['content'] = apply_json_patch(previous, row.get('content_delta') or [])
+        previous = row.get('content')
+        previous_number = row.get('version_number')
+
+        row.pop('content_delta', None)
+        rebuilt.append(row)
+
+    return rebuilt
+
+
+# Columns needed to render the history list (no content payloads)
+VERSION_METADATA_COLUMNS = (
+    'id, version_number, edited_by, edit_type, changes_summary, '
+    'edit_notes, content_size, storage_format, created_at'
+)
+
+
+async def load_version_history(
+    content_type: str,
+    content_id: str,
+    format: str = 'metadata'
+) -> List[Dict[str, Any]]:
+    """
+    Load version history for a strategy or lesson
+
+    Args:
+        format: 'metadata' returns listing fields only (default, no content),
+                'full' rebuilds content for every version,
+                'delta' returns rows as stored (checkpoints + JSON Patches)
+
+    Returns:
+        Versions sorted by version_number descending
+    """
+    if format == 'metadata':
+        versions = supabase.table('content_versions')\
+            .select(VERSION_METADATA_COLUMNS)\
+            .eq('content_type', content_type)\
+            .eq('content_id', content_id)\
+            .order('version_number', desc=True)\
+            .execute()
+        return versions.data or []
+
+    versions = supabase.table('content_versions')\
+        .select('*')\
+        .eq('content_type', content_type)\
+        .eq('content_id', content_id)\
+        .order('version_number', desc=False)\
+        .execute()
+
+    rows = versions.data or []
+    if format == 'full':
+        rows = reconstruct_versions(rows)
+
+    return list(reversed(rows))
+
+
+async def load_version_content(
+    content_type: str,
+    content_id: str,
+    version_number: int
+) -> Optional[Dict[str, Any]]:
+    """Rebuild one version from its nearest checkpoint (at most a checkpoint interval of rows)"""
+    checkpoint = supabase.table('content_versions')\
+        .select('version_number')\
+        .eq('content_type', content_type)\
+        .eq('content_id', content_id)\
+        .eq('storage_format', 'full')\
+        .lte('version_number', version_number)\
+        .order('version_number', desc=True)\
+        .limit(1)\
+        .execute()
+
+    if not checkpoint.data:
+        return None
+
+    chain = supabase.table('content_versions')\
+        .select('*')\
+        .eq('content_type', content_type)\
+        .eq('content_id', content_id)\
+        .gte('version_number', checkpoint.data[0]['version_number'])\
+        .lte('version_number', version_number)\
+        .order('version_number', desc=False)\
+        .execute()
+
+    rebuilt = reconstruct_versions(chain.data or [])
+    return rebuilt[-1] if rebuilt else None
+
+
+async def load_version_diff(
+    content_type: str,
+    content_id: str,
+    from_version: int,
+    to_version: int
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    JSON Patch that turns `from_version` into `to_version`
+
+    Adjacent versions reuse the stored delta; anything else is rebuilt and diffed.
+    Returns None if either version does not exist.
+    """
+    if to_version == from_version + 1:
+        stored = supabase.table('content_versions')\
+            .select('storage_format, base_version, content_delta')\
+            .eq('content_type', content_type)\
+            .eq('content_id', content_id)\
+            .eq('version_number', to_version)\
+            .execute()
+        if stored.data:
+            row = stored.data[0]
+            if row.get('storage_format') == 'delta' and row.get('base_version') == from_version:
+                return row.get('content_delta') or []
+
+    old = await load_version_content(content_type, content_id, from_version)
+    new = await load_version_content(content_type, content_id, to_version)
+    if not old or not new:
+        return None
+
+    return diff_json(old.get('content'), new.get('content'))
+
+
+# ==========================================
+# ACTIVITY CHAT CODE SNAPSHOTS
+# ==========================================
+
+async def encode_code_snapshot(
+    activity_id: str,
+    previous_code: str,
+    new_code: str
+) -> Dict[str, Any]:
+    """
+    Build the snapshot columns for an agent_response chat row
+
+    Stores a line delta against `previous_code` when it matches the latest stored
+    snapshot, otherwise (first response, checkpoint due, out-of-band edit) a full copy.
+    """
+    recent = supabase.table('activity_chat_history')\
+        .select('snapshot_format, code_sha1')\
+        .eq('activity_id', activity_id)\
+        .eq('message_type', 'agent_response')\
+        .order('created_at', desc=True)\
+        .limit(CODE_CHECKPOINT_INTERVAL)\
+        .execute()
+
+    rows = [r for r in (recent.data or []) if r.get('code_sha1')]
+    new_sha1 = text_fingerprint(new_code)
+
+    consecutive_deltas = 0
+    for row in rows:
+        if row.get('snapshot_format') != 'delta':
+            break
+        consecutive_deltas += 1
+
+    use_delta = (
+        bool(rows)
+        and rows[0]['code_sha1'] == text_fingerprint(previous_code)
+        and consecutive_deltas < CODE_CHECKPOINT_INTERVAL - 1
+    )
+
+    if use_delta:
+        return {
+            'snapshot_format': 'delta',
+            'code_delta': diff_text(previous_code, new_code),
+            'code_snapshot': None,
+            'code_sha1': new_sha1
+        }
+
+    return {
+        'snapshot_format': 'full',
+        'code_delta': None,
+        'code_snapshot': new_code,
+        'code_sha1': new_sha1
+    }
+
+
+def reconstruct_chat_history(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Rebuild full code snapshots for chat rows (sorted by created_at ascending)
+    """
+    rebuilt = []
+    previous_code = None
+    previous_sha1 = None
+
+    for row in rows:
+        row = dict(row)
+        if row.get('snapshot_format') == 'delta':
+            delta = row.get('code_delta') or []
+            if previous_code is None:
+                print(f"⚠️ Missing base snapshot for chat message {row.get('id')}")
+                row['code_snapshot'] = None
+            else:
+                row['code_snapshot'] = apply_text_diff(previous_code, delta)
+                if row.get('code_sha1') and text_fingerprint(row['code_snapshot']) != row['code_sha1']:
+                    print(f"⚠️ Snapshot checksum mismatch for chat message {row.get('id')} (base {previous_sha1})")
+
+        if row.get('code_snapshot') is not None:
+            previous_code = row['code_snapshot']
+            previous_sha1 = row.get('code_sha1')
+
+        row.pop('code_delta', None)
+        rebuilt.append(row)
+
+    return rebuilt
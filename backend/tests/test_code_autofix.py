@@ -0,0 +1,237 @@
+"""
+Tests for the rule-based auto-fixer (services/code_autofix.py)
+
+Run from backend/: python -m pytest tests
+"""
+
+from services.code_autofix import (
+    autofix_code,
+    insert_semicolons,
+    remove_unsupported_imports,
+    _statement_line_ends
+)
+
+
+# ==========================================
+# UNSUPPORTED IMPORTS
+# ==========================================
+
+UI_KIT_ACTIVITY = """import React, { useState } from 'react';
+import { Button } from '@/components/ui/button';
+import { Card, CardContent } from '@/components/ui/card';
+
+export default function App() {
+  const [count, setCount] = useState(0);
+  return (
+    <Card className="p-4">
+      <CardContent>
+        <p>Count: {count}</p>
+        <Button onClick={() => setCount(count + 1)}>Add one</Button>
+      </CardContent>
+    </Card>
+  );
+}
+"""
+
+
+def test_ui_kit_components_are_not_stubbed():
+    result = autofix_code(UI_KIT_ACTIVITY)
+
+    assert "from '@/components/ui/button'" in result['code']
+    assert "from '@/components/ui/card'" in result['code']
+    assert 'Stand-ins' not in result['code']
+    assert not [r for r in result['rewrites'] if r['rule'] == 'unsupported_imports']
+    unresolved = ' '.join(result['unresolved'])
+    assert 'Button' in unresolved and 'Card' in unresolved and 'CardContent' in unresolved
+
+
+def test_self_closing_icons_get_pass_through_stand_ins():
+    code = """import React from 'react';
+import { Star, Heart } from 'lucide-react';
+
+export default function App() {
+  return <div><Star className="w-4 h-4" /> Favourites <Heart size={16} /></div>;
+}
+"""
+    fixed, rewrites, unresolved = remove_unsupported_imports(code)
+
+    assert 'lucide-react' not in fixed
+    assert "const Star = ({ children, ...props }) => <span aria-hidden=\"true\" {...props}>{children ?? '•'}</span>;" in fixed
+    assert 'const Heart = ' in fixed
+    assert fixed.index('const Star') < fixed.index('const Heart')
+    assert unresolved == []
+    assert rewrites[0]['rule'] == 'unsupported_imports' and rewrites[0]['line'] == 2
+
+
+def test_icon_with_event_handler_is_unresolved():
+    code = """import { X } from 'lucide-react';
+
+export default function App() {
+  return <X onClick={() => alert('closed')} />;
+}
+"""
+    fixed, rewrites, unresolved = remove_unsupported_imports(code)
+
+    assert fixed == code
+    assert rewrites == []
+    assert 'X' in unresolved[0]
+
+
+def test_one_content_component_keeps_the_whole_import():
+    code = """import { Star, Badge } from 'some-ui';
+
+export default function App() {
+  return <Badge><Star /> Top score</Badge>;
+}
+"""
+    fixed, rewrites, unresolved = remove_unsupported_imports(code)
+
+    assert fixed == code
+    assert 'Badge' in unresolved[0] and 'Star' not in unresolved[0].split(':')[-1]
+
+
+def test_values_from_unsupported_packages_are_unresolved():
+    code = """import axios from 'axios';
+
+export default function App() {
+  axios.get('/questions');
+  return <div />;
+}
+"""
+    fixed, rewrites, unresolved = remove_unsupported_imports(code)
+
+    assert fixed == code
+    assert 'axios' in unresolved[0]
+
+
+def test_stylesheets_and_framer_motion_are_removed():
+    code = """import './App.css';
+import { motion } from 'framer-motion';
+
+export default function App() {
+  return <motion.div initial={{ opacity: 0 }} animate={{ opacity: 1 }} className="card">Hi</motion.div>;
+}
+"""
+    fixed, rewrites, unresolved = remove_unsupported_imports(code)
+
+    assert './App.css' not in fixed and 'framer-motion' not in fixed
+    assert '<div className="card">Hi</div>' in fixed
+    assert len(rewrites) == 2 and unresolved == []
+
+
+# ==========================================
+# SEMICOLON SCANNER
+# ==========================================
+
+def _semicolons(code):
+    fixed, rewrites, unresolved = insert_semicolons(code)
+    assert unresolved == []
+    return fixed, [r['line'] for r in rewrites]
+
+
+def test_statements_are_terminated():
+    fixed, lines = _semicolons("""function App() {
+  const [a, setA] = useState(0)
+  let i = 0
+  i++
+  setA(1)
+  return <div>{a}</div>
+}
+""")
+    assert lines == [2, 3, 4, 5, 6]
+    assert "  return <div>{a}</div>;\n}" in fixed
+
+
+def test_object_literals_and_destructuring_are_left_alone():
+    code = """import {
+  useState,
+  useMemo
+} from 'react';
+const style = {
+  color: 'red',
+  width: 10
+};
+const { a,
+  b } = props;
+"""
+    assert _semicolons(code) == (code, [])
+
+
+def test_multiline_jsx_expressions_are_left_alone():
+    code = """function App() {
+  return (
+    <div style={{
+      width: `${score}%`,
+      height: 10
+    }}>
+      Let's explore! Don't worry // not a comment
+      {items.map((item, i) => (
+        <p key={i}>{item}</p>
+      ))}
+    </div>
+  );
+}
+"""
+    assert _semicolons(code) == (code, [])
+
+
+def test_arrow_blocks_inside_jsx_are_scanned():
+    fixed, lines = _semicolons("""function App() {
+  return (
+    <button onClick={() => {
+      setScore(0)
+      setDone(false)
+    }}>Reset</button>
+  );
+}
+""")
+    assert lines == [4, 5]
+    assert 'setScore(0);' in fixed and 'setDone(false);' in fixed
+
+
+def test_control_headers_and_continuations_are_left_alone():
+    code = """function f() {
+  if (done)
+    reset();
+  const total = score
+    + bonus;
+  const label = ok
+    ? 'yes'
+    : 'no';
+  do {
+    n--;
+  } while (n > 0)
+}
+"""
+    assert _semicolons(code) == (code, [])
+
+
+def test_strings_templates_and_regexes_do_not_confuse_the_scanner():
+    fixed, lines = _semicolons("""const quote = "it's"
+const pattern = /['"{]+/g
+const msg = `Score: ${score > 1 ? `${score} pts` : '{'}`
+const done = true
+""")
+    assert lines == [1, 2, 3, 4]
+
+
+def test_unscannable_code_is_reported_and_unchanged():
+    code = 'function App() {\n  const x = "unterminated\n  return <div/>\n}\n'
+    fixed, rewrites, unresolved = insert_semicolons(code)
+
+    assert fixed == code and rewrites == []
+    assert unresolved
+    assert _statement_line_ends('function App() {\n') is None
+
+
+def test_autofix_is_idempotent():
+    code = """import { Star } from 'lucide-react'
+function App() {
+  const [a] = useState(0)
+  return <div><Star /> {a}</div>
+}
+"""
+    first = autofix_code(code)
+    assert first['changed']
+    assert {r['rule'] for r in first['rewrites']} == {'unsupported_imports', 'hook_imports', 'default_export', 'semicolons'}
+    assert not autofix_code(first['code'])['changed']
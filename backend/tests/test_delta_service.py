@@ -0,0 +1,68 @@
+"""
+Tests for version deltas (services/delta_service.py)
+
+Run from backend/: python -m pytest tests
+"""
+
+import json
+
+from services.delta_service import diff_json, apply_json_patch, diff_text, apply_text_diff
+
+WORDS = ' '.join(f'word{i}' for i in range(40))
+
+# Tutor saves from the rich text editor: one line of TipTap HTML
+HTML_BODY = ''.join(
+    f'<h2>Week {week}</h2><p>{WORDS}</p><ul><li>Practice {WORDS}</li></ul>'
+    for week in range(1, 21)
+)
+MARKDOWN_BODY = '\n'.join(f'## Week {week}\n{WORDS}\n- Practice {WORDS}' for week in range(1, 21))
+
+
+def _size(value):
+    return len(json.dumps(value))
+
+
+def test_one_word_html_edit_is_a_small_text_delta():
+    old = {'content': HTML_BODY, 'format': 'html'}
+    new = {'content': HTML_BODY.replace('word7 ', 'fractions ', 1), 'format': 'html'}
+
+    patch = diff_json(old, new)
+
+    assert [op['op'] for op in patch] == ['text']
+    assert _size(patch) < _size(new) // 10
+    assert apply_json_patch(old, patch) == new
+
+
+def test_markdown_edit_round_trips():
+    old = {'content': MARKDOWN_BODY, 'format': 'markdown'}
+    new = {'content': MARKDOWN_BODY.replace('## Week 3', '## Week 3: Fractions') + '\n## Review', 'format': 'markdown'}
+
+    patch = diff_json(old, new)
+
+    assert patch[0]['op'] == 'text'
+    assert apply_json_patch(old, patch) == new
+
+
+def test_text_delta_inside_lists_and_at_root():
+    edited = HTML_BODY.replace('<h2>Week 2</h2>', '<h2>Week 2: Review</h2>')
+
+    assert apply_json_patch([HTML_BODY], diff_json([HTML_BODY], [edited])) == [edited]
+    assert apply_json_patch(HTML_BODY, diff_json(HTML_BODY, edited)) == edited
+
+
+def test_short_or_unrelated_strings_are_replaced():
+    assert diff_json({'title': 'Fractions'}, {'title': 'Decimals'}) == [
+        {'op': 'replace', 'path': '/title', 'value': 'Decimals'}
+    ]
+    rewritten = 'x' * len(HTML_BODY)
+    assert diff_json(HTML_BODY, rewritten) == [{'op': 'replace', 'path': '', 'value': rewritten}]
+
+
+def test_code_diff_stays_line_based():
+    old = 'const a = <b>1</b>;\nconst c = 2;\n'
+    new = 'const a = <b>1</b>;\nconst c = 3;\n'
+
+    ops = diff_text(old, new)
+
+    assert ops == [['=', 1], ['-', 1], ['+', ['const c = 3;\n']]]
+    assert apply_text_diff(old, ops) == new
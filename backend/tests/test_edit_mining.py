@@ -0,0 +1,108 @@
+"""
+Tests for tutor edit mining (services/edit_mining.py)
+
+Run from backend/: python -m pytest tests
+"""
+
+from services.edit_mining import change_records, aggregate_patterns, section_path
+
+# A generated lesson as stored by the lesson pipeline
+LESSON = {
+    'title': 'Comparing Fractions',
+    'session_overview': 'Students compare fractions using visual models and benchmarks.',
+    'learning_objectives': [
+        'Compare fractions with like denominators',
+        'Use one half as a benchmark'
+    ],
+    'class_activities': [
+        {
+            'name': 'Fraction Pizza',
+            'duration': 15,
+            'description': 'Students cut paper pizzas into equal slices and compare portions.',
+            'materials': ['Paper plates', 'Markers'],
+            'teacher_notes': 'Check that slices are equal before comparing.'
+        },
+        {
+            'name': 'Number Line Race',
+            'duration': 10,
+            'description': 'Teams place fraction cards on a floor number line.'
+        }
+    ],
+    'materials_summary': ['Paper plates', 'Markers', 'Fraction cards'],
+    'student_id': '6f1c1f7e-1d8e-4f5a-9a51-3c2b7d9e0a11'
+}
+
+
+def render(lesson, objectives=None, activity_title=None):
+    """The lesson as the editor saves it (frontend formatLessonToHTML, then TipTap getHTML)"""
+    html = f"<h1>{lesson['title']}</h1>"
+    html += f"<h2>📋 Session Overview</h2><p>{lesson['session_overview']}</p>"
+    html += '<h2>🎯 Learning Objectives</h2><ul>'
+    html += ''.join(f'<li><p>{o}</p></li>' for o in (objectives or lesson['learning_objectives'])) + '</ul>'
+    html += '<h2>🎓 Class Activities</h2>'
+    for i, activity in enumerate(lesson['class_activities']):
+        name = activity_title if activity_title and i == 0 else activity['name']
+        html += f"<h3>Activity {i + 1}: {name} ({activity['duration']} min)</h3><p>{activity['description']}</p>"
+        if activity.get('materials'):
+            html += '<p><strong>Materials:</strong></p><ul>'
+            html += ''.join(f'<li><p>{m}</p></li>' for m in activity['materials']) + '</ul>'
+        if activity.get('teacher_notes'):
+            html += f"<p><strong>Teacher Notes:</strong> <em>{activity['teacher_notes']}</em></p>"
+    html += '<h2>📦 Materials Summary</h2><ul>'
+    html += ''.join(f'<li><p>{m}</p></li>' for m in lesson['materials_summary']) + '</ul>'
+    return {'content': html, 'format': 'html'}
+
+
+OBJECTIVES = LESSON['learning_objectives'] + ['Order three fractions from least to greatest']
+
+
+def test_first_html_save_reports_only_the_edit():
+    records = change_records(LESSON, render(LESSON, objectives=OBJECTIVES))
+
+    assert [(r['path'], r['kind']) for r in records] == [('learning_objectives', 'added')]
+    assert records[0]['chars_after'] > 0
+
+
+def test_unchanged_html_save_has_no_records():
+    assert change_records(LESSON, render(LESSON)) == []
+
+
+def test_html_edits_are_diffed_per_section():
+    base = render(LESSON)
+
+    added = change_records(base, render(LESSON, objectives=OBJECTIVES))
+    retitled = change_records(base, render(LESSON, activity_title='Pizza Fractions'))
+
+    assert [(r['path'], r['kind']) for r in added] == [('learning_objectives', 'added')]
+    assert [(r['path'], r['kind']) for r in retitled] == [('activity_#', 'rewritten')]
+
+
+def test_different_edits_form_different_patterns():
+    base = render(LESSON)
+    patterns = aggregate_patterns([
+        change_records(base, render(LESSON, objectives=OBJECTIVES)),
+        change_records(base, render(LESSON, activity_title='Pizza Fractions'))
+    ])
+
+    assert {(p['path'], p['kind']) for p in patterns} == {
+        ('learning_objectives', 'added'), ('activity_#', 'rewritten')
+    }
+
+
+def test_markdown_week_retitle():
+    old = {'content': '## Week 1: Fractions\nPizza models\n## Week 2: Decimals\nMoney', 'format': 'markdown'}
+    new = {'content': '## Week 1: Fractions\nPizza models\n## Week 2: Percentages\nMoney', 'format': 'markdown'}
+
+    assert [(r['path'], r['kind']) for r in change_records(old, new)] == [('week_#', 'rewritten')]
+
+
+def test_structured_edits_keep_json_paths():
+    edited = {**LESSON, 'learning_objectives': OBJECTIVES}
+
+    assert [(r['path'], r['kind']) for r in change_records(LESSON, edited)] == [('learning_objectives[]', 'added')]
+
+
+def test_section_path():
+    assert section_path('🎯 Learning Objectives') == 'learning_objectives'
+    assert section_path('Week 12: Ratios and rates') == 'week_#'
+    assert section_path('class_activities') == 'class_activities'
@@ -0,0 +1,374 @@
+"""
+TutorPilot Job Worker
+Claims agent jobs from the durable queue (agent_jobs) and runs the generation pipelines
+
+Run as many worker processes as needed to scale generation horizontally:
+    python worker.py
+
+The API also starts an in-process worker unless JOB_WORKER_INPROCESS=false.
+"""
+
+import os
+import json
+import signal
+import asyncio
+import socket
+from uuid import uuid4
+from typing import Dict, Any, Optional, List, Callable, Awaitable
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+from services.job_queue import (
+    claim_job,
+    record_stage,
+    heartbeat,
+    complete_job,
+    fail_job,
+    release_job
+)
+
+HEARTBEAT_SECONDS = 30
+# Bad input: raised the same way on every attempt (missing student, malformed payload)
+NON_RETRYABLE_ERRORS = (ValueError, KeyError, TypeError)
+
+
+# ==========================================
+# JOB HANDLERS
+# ==========================================
+
+async def run_strategy_job(
+    payload: Dict[str, Any],
+    on_stage: Callable[[str], Awaitable[None]],
+    request_id: str
+) -> Dict[str, Any]:
+    """Generate a personalized learning strategy"""
+    from agents.strategy_planner import generate_strategy
+
+    result = await generate_strategy(
+        student_id=payload['student_id'],
+        tutor_id=payload['tutor_id'],
+        subject=payload['subject'],
+        weeks=payload.get('weeks', 4),
+        on_stage=on_stage,
+        request_id=request_id,
+        evaluation_mode=payload.get('evaluation_mode', 'overlap')
+    )
+    return {
+        "success": True,
+        "strategy_id": result['strategy_id'],
+        "content": result['content'],
+        "evaluation": result['evaluation'],
+        "evaluation_status": result.get('evaluation_status'),
+        "student": result['student'],
+        "tutor": result['tutor'],
+        "timings": result.get('timings')
+    }
+
+
+async def run_strategy_cohort_job(
+    payload: Dict[str, Any],
+    on_stage: Callable[..., Awaitable[None]],
+    request_id: str
+) -> Dict[str, Any]:
+    """Generate strategies for a cohort of students with shared research"""
+    from agents.strategy_planner import generate_cohort_strategies
+
+    result = await generate_cohort_strategies(
+        student_ids=payload['student_ids'],
+        tutor_id=payload['tutor_id'],
+        subject=payload['subject'],
+        weeks=payload.get('weeks', 4),
+        concurrency=payload.get('concurrency', 3),
+        on_stage=on_stage,
+        request_id=request_id
+    )
+    return {
+        "success": True,
+        **result
+    }
+
+
+async def run_lesson_job(
+    payload: Dict[str, Any],
+    on_stage: Callable[[str], Awaitable[None]],
+    request_id: str
+) -> Dict[str, Any]:
+    """Generate a 5E lesson plan"""
+    from agents.lesson_creator import generate_lesson
+
+    result = await generate_lesson(
+        student_id=payload['student_id'],
+        tutor_id=payload['tutor_id'],
+        topic=payload.get('topic'),
+        duration=payload.get('duration', 60),
+        strategy_id=payload.get('strategy_id'),
+        strategy_week_number=payload.get('strategy_week_number'),
+        on_stage=on_stage,
+        request_id=request_id,
+        evaluation_mode=payload.get('evaluation_mode', 'overlap')
+    )
+    return {
+        "success": True,
+        "lesson_id": result['lesson_id'],
+        "content": result['content'],
+        "evaluation": result['evaluation'],
+        "evaluation_status": result.get('evaluation_status'),
+        "student": result['student'],
+        "tutor": result['tutor'],
+        "timings": result.get('timings')
+    }
+
+
+async def run_activity_job(
+    payload: Dict[str, Any],
+    on_stage: Callable[[str], Awaitable[None]],
+    request_id: str
+) -> Dict[str, Any]:
+    """Generate an interactive React activity with auto-debugging"""
+    from agents.activity_creator import generate_activity
+
+    result = await generate_activity(
+        student_id=payload['student_id'],
+        tutor_id=payload['tutor_id'],
+        topic=payload.get('topic'),
+        activity_description=payload.get('activity_description'),
+        duration=payload.get('duration', 20),
+        lesson_id=payload.get('lesson_id'),
+        lesson_phase=payload.get('lesson_phase'),
+        max_attempts=payload.get('max_attempts', 3),
+        on_stage=on_stage,
+        request_id=request_id,
+        evaluation_mode=payload.get('evaluation_mode', 'overlap')
+    )
+    return {
+        "success": True,
+        "activity_id": result['activity_id'],
+        "content": result['content'],
+        "evaluation": result['evaluation'],
+        "evaluation_status": result.get('evaluation_status'),
+        "deployment": result['deployment'],
+        "student": result['student'],
+        "tutor": result['tutor'],
+        "sandbox_url": result['deployment'].get('url'),
+        "timings": result.get('timings')
+    }
+
+
+async def run_lesson_batch_job(
+    payload: Dict[str, Any],
+    on_stage: Callable[..., Awaitable[None]],
+    request_id: str
+) -> Dict[str, Any]:
+    """Generate every week's lesson (optionally with activities) of a strategy"""
+    from agents.lesson_creator import generate_strategy_lessons
+
+    result = await generate_strategy_lessons(
+        strategy_id=payload['strategy_id'],
+        tutor_id=payload.get('tutor_id'),
+        duration=payload.get('duration', 60),
+        include_activities=payload.get('include_activities', False),
+        concurrency=payload.get('concurrency', 2),
+        on_stage=on_stage,
+        request_id=request_id
+    )
+    return {
+        "success": True,
+        **result
+    }
+
+
+async def run_rescore_job(
+    payload: Dict[str, Any],
+    on_stage: Callable[..., Awaitable[None]],
+    request_id: str
+) -> Dict[str, Any]:
+    """Re-score historical content under the current evaluation rubric"""
+    from services.rescore_service import rescore_history
+
+    result = await rescore_history(
+        content_types=payload.get('content_types'),
+        page_size=payload.get('page_size', 50),
+        concurrency=payload.get('concurrency', 4),
+        limit=payload.get('limit'),
+        on_stage=on_stage,
+        request_id=request_id
+    )
+    return {
+        "success": True,
+        **result
+    }
+
+
+async def run_insight_consolidation_job(
+    payload: Dict[str, Any],
+    on_stage: Callable[..., Awaitable[None]],
+    request_id: str
+) -> Dict[str, Any]:
+    """Merge near-duplicate learning insights and deprecate the superseded rows"""
+    from services.insight_consolidation import consolidate_insights
+
+    result = await consolidate_insights(
+        tables=payload.get('tables'),
+        threshold=payload.get('similarity_threshold'),
+        on_stage=on_stage
+    )
+    return {
+        "success": True,
+        **result
+    }
+
+
+JOB_HANDLERS = {
+    'strategy': run_strategy_job,
+    'strategy_cohort': run_strategy_cohort_job,
+    'lesson': run_lesson_job,
+    'activity': run_activity_job,
+    'lesson_batch': run_lesson_batch_job,
+    'rescore': run_rescore_job,
+    'insight_consolidation': run_insight_consolidation_job
+}
+
+
+# ==========================================
+# WORKER LOOP
+# ==========================================
+
+async def _keep_alive(job_id: str, worker_id: str):
+    """Refresh the heartbeat while a long stage (LLM call, sandbox boot) is running"""
+    while True:
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+        await heartbeat(job_id, worker_id)
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Validation errors are final; model, network and sandbox failures are retried"""
+    if isinstance(error, json.JSONDecodeError):
+        return True  # Unparseable model output: another attempt may succeed
+    return not isinstance(error, NON_RETRYABLE_ERRORS)
+
+
+async def process_job(job: Dict[str, Any], worker_id: str) -> None:
+    """Run one claimed job and store its result (or requeue/fail it)"""
+    job_id = job['id']
+    handler = JOB_HANDLERS.get(job['job_type'])
+    print(f"\n🛠️ Worker {worker_id} running {job['job_type']} job {job_id} "
+          f"(attempt {job.get('attempts', 1)}/{job.get('max_attempts', 3)})")
+
+    if not handler:
+        await fail_job({**job, 'attempts': job.get('max_attempts', 3)}, worker_id,
+                       f"Unknown job type: {job['job_type']}")
+        return
+
+    async def on_stage(stage: str, detail: Optional[Dict[str, Any]] = None):
+        await record_stage(job_id, worker_id, stage, detail)
+
+    keep_alive = asyncio.create_task(_keep_alive(job_id, worker_id))
+    try:
+        # Checkpoints are keyed by the client's request_id when given, else by the job,
+        # so a requeued attempt resumes from the last completed stage
+        request_id = job['payload'].get('request_id') or job_id
+        result = await handler(job['payload'], on_stage, request_id)
+        await complete_job(job_id, worker_id, result)
+        print(f"✅ Job {job_id} succeeded")
+    except asyncio.CancelledError:
+        # Worker shutting down: hand the job back instead of leaving it 'running'
+        print(f"⏸️ Job {job_id} interrupted, requeued")
+        try:
+            await release_job(job, worker_id)
+        except Exception as e:
+            print(f"⚠️ Failed to requeue job {job_id}: {str(e)}")
+        raise
+    except Exception as e:
+        if _is_retryable(e):
+            print(f"❌ Job {job_id} failed: {str(e)}")
+            await fail_job(job, worker_id, str(e))
+        else:
+            print(f"❌ Job {job_id} failed (not retryable): {str(e)}")
+            await fail_job({**job, 'attempts': job.get('max_attempts', 3)}, worker_id, str(e))
+    finally:
+        keep_alive.cancel()
+
+
+async def _worker_slot(
+    worker_id: str,
+    job_types: Optional[List[str]],
+    poll_interval: float
+):
+    while True:
+        try:
+            job = await claim_job(worker_id, job_types)
+        except Exception as e:
+            print(f"⚠️ Worker {worker_id} failed to claim job: {str(e)}")
+            job = None
+
+        if not job:
+            await asyncio.sleep(poll_interval)
+            continue
+
+        await process_job(job, worker_id)
+
+
+async def run_worker(
+    worker_id: Optional[str] = None,
+    job_types: Optional[List[str]] = None,
+    concurrency: int = 1,
+    poll_interval: float = 2.0
+):
+    """
+    Poll the queue and run jobs until cancelled
+
+    Args:
+        worker_id: Identifier stored on claimed jobs (default: hostname + random suffix)
+        job_types: Restrict to these job types (default: all)
+        concurrency: Jobs this process runs at the same time
+        poll_interval: Seconds to wait when the queue is empty
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{uuid4().hex[:8]}"
+    print(f"👷 Job worker {worker_id} started (concurrency={concurrency})")
+
+    slots = [
+        asyncio.create_task(_worker_slot(f"{worker_id}/{i}", job_types, poll_interval))
+        for i in range(concurrency)
+    ]
+    try:
+        await asyncio.gather(*slots)
+    finally:
+        for slot in slots:
+            slot.cancel()
+        print(f"👋 Job worker {worker_id} stopped")
+
+
+async def run_standalone_worker(**kwargs) -> None:
+    """
+    run_worker for `python worker.py`: stops on SIGINT/SIGTERM, then waits for
+    background evaluations started by its jobs (as the API does on shutdown)
+    """
+    from services.pipeline_dag import drain_background_evaluations
+
+    task = asyncio.create_task(run_worker(**kwargs))
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, task.cancel)
+        except NotImplementedError:
+            pass  # Windows: Ctrl+C still raises KeyboardInterrupt
+
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await drain_background_evaluations()
+
+
+if __name__ == "__main__":
+    import weave
+    weave.init(os.getenv("WEAVE_PROJECT_NAME", "tutorpilot-weavehacks"))
+
+    job_types = os.getenv("JOB_WORKER_TYPES")
+    asyncio.run(run_standalone_worker(
+        job_types=job_types.split(',') if job_types else None,
+        concurrency=int(os.getenv("JOB_WORKER_CONCURRENCY", "2"))
+    ))
@@ -80,6 +80,22 @@ COMMENT ON COLUMN strategies.self_evaluation IS 'AI self-critique: scores on ped
 CREATE INDEX idx_strategies_student ON strategies(student_id);
 CREATE INDEX idx_strategies_latest ON strategies(is_latest) WHERE is_latest = true;
 
+-- Strategy weeks (structured per-week index, rebuilt on generation and on every saved version)
+CREATE TABLE strategy_weeks (
+  strategy_id uuid REFERENCES strategies(id) ON DELETE CASCADE,
+  week_number integer NOT NULL,
+  topic text NOT NULL,
+  objectives jsonb DEFAULT '[]',
+  key_concepts jsonb DEFAULT '[]',
+  excerpt text, -- Start of the week's section in the strategy document
+  research_index integer, -- Position of this week's research in strategies.knowledge_contexts
+  source_version integer, -- Strategy version the row was built from
+  updated_at timestamptz DEFAULT now(),
+  PRIMARY KEY (strategy_id, week_number)
+);
+
+COMMENT ON TABLE strategy_weeks IS 'Per-week strategy records read by Lesson Creator (no markdown re-parsing)';
+
 -- Lessons table (comprehensive lesson plans)
 CREATE TABLE lessons (
   id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -146,20 +162,31 @@ CREATE TABLE content_versions (
   content_type text NOT NULL CHECK (content_type IN ('strategy', 'lesson')),
   content_id uuid NOT NULL,
   version_number integer NOT NULL,
-  content jsonb NOT NULL,
+  content jsonb, -- Full copy (checkpoints only, see storage_format)
+  content_delta jsonb, -- JSON Patch against base_version (delta rows only)
+  base_version integer,
+  storage_format text NOT NULL DEFAULT 'full' CHECK (storage_format IN ('full', 'delta')),
+  content_size integer, -- Size in bytes of the full content (for history listings)
   changes_summary text,
   edited_by uuid REFERENCES tutors(id),
   edit_type text NOT NULL CHECK (edit_type IN ('ai_generated', 'manual_edit', 'ai_iteration', 'tutor_refinement')),
   edit_notes text, -- WHY tutor edited (feeds learning insights!)
   self_evaluation_delta jsonb,
-  created_at timestamptz DEFAULT now()
+  created_at timestamptz DEFAULT now(),
+  CHECK (
+    (storage_format = 'full' AND content IS NOT NULL) OR
+    (storage_format = 'delta' AND content_delta IS NOT NULL AND base_version IS NOT NULL)
+  )
 );
 
 COMMENT ON TABLE content_versions IS 'Version history for strategies and lessons (collaborative editing)';
 COMMENT ON COLUMN content_versions.edit_notes IS 'Tutors explanation of why they edited - feeds into learning_insights!';
+COMMENT ON COLUMN content_versions.self_evaluation_delta IS 'Criteria re-scored after a tutor edit (only the affected ones) and the new overall score';
+COMMENT ON COLUMN content_versions.content_delta IS 'JSON Patch (RFC 6902, plus a "text" op holding a line delta for long text bodies) from base_version; full checkpoints are stored every N versions or when the patch is not smaller than the content';
 
-CREATE INDEX idx_content_versions_lookup ON content_versions(content_type, content_id, version_number DESC);
+CREATE UNIQUE INDEX idx_content_versions_lookup ON content_versions(content_type, content_id, version_number DESC);
 CREATE INDEX idx_content_versions_by_content ON content_versions(content_type, content_id);
+CREATE INDEX idx_content_versions_edits ON content_versions(content_type, edit_type, created_at); -- Reflection watermark scans
 
 -- Activity chat history (conversational editing)
 CREATE TABLE activity_chat_history (
@@ -168,7 +195,10 @@ CREATE TABLE activity_chat_history (
   tutor_id uuid REFERENCES tutors(id),
   message_type text NOT NULL CHECK (message_type IN ('tutor_request', 'agent_response', 'agent_action', 'system_message')),
   message_content text NOT NULL,
-  code_snapshot text,
+  code_snapshot text, -- Full code (checkpoints only, see snapshot_format)
+  code_delta jsonb, -- Line delta against the previous agent_response snapshot
+  code_sha1 text, -- Hash of the resulting code (verifies delta bases)
+  snapshot_format text CHECK (snapshot_format IN ('full', 'delta')),
   sandbox_url text,
   deployment_result jsonb,
   created_at timestamptz DEFAULT now()
@@ -177,6 +207,7 @@ CREATE TABLE activity_chat_history (
 COMMENT ON TABLE activity_chat_history IS 'Chat-based conversational editing for activities ("Make molecules bigger")';
 
 CREATE INDEX idx_activity_chat_lookup ON activity_chat_history(activity_id, created_at);
+CREATE INDEX idx_activity_chat_snapshots ON activity_chat_history(activity_id, created_at DESC) WHERE message_type = 'agent_response';
 
 -- ============================================================================
 -- SELF-IMPROVEMENT SYSTEM
@@ -193,6 +224,7 @@ CREATE TABLE agent_performance_metrics (
   error_count integer DEFAULT 0,
   last_error text,
   evaluation_details jsonb, -- Full self-evaluation with criteria, weaknesses, improvements
+  rubric_version text, -- Evaluator rubric the score was produced under (compare within one version)
   created_at timestamptz DEFAULT now(),
   last_updated timestamptz DEFAULT now()
 );
@@ -202,6 +234,36 @@ COMMENT ON TABLE agent_performance_metrics IS 'Tracks agent self-evaluations for
 CREATE INDEX idx_agent_performance_type ON agent_performance_metrics(agent_type);
 CREATE INDEX idx_agent_performance_success ON agent_performance_metrics(success_rate);
 CREATE INDEX idx_agent_performance_created ON agent_performance_metrics(created_at DESC);
+CREATE INDEX idx_agent_performance_type_created ON agent_performance_metrics(agent_type, created_at); -- Reflection watermark scans
+
+-- Evaluation cache (self-evaluations keyed by content hash + rubric version)
+CREATE TABLE evaluation_cache (
+  cache_key text PRIMARY KEY, -- sha256 of (content type, normalized content, student fields, rubric version)
+  content_type text NOT NULL CHECK (content_type IN ('strategy', 'lesson', 'activity')),
+  rubric_version text NOT NULL,
+  evaluation jsonb NOT NULL,
+  hit_count integer DEFAULT 0,
+  created_at timestamptz DEFAULT now(),
+  last_hit_at timestamptz
+);
+
+COMMENT ON TABLE evaluation_cache IS 'Reused self-evaluations for identical content (redeploys, restored versions)';
+
+-- Evaluation scores per rubric version (historical re-scoring job)
+CREATE TABLE evaluation_scores (
+  content_type text NOT NULL CHECK (content_type IN ('strategy', 'lesson', 'activity')),
+  content_id uuid NOT NULL,
+  rubric_version text NOT NULL,
+  overall_score numeric,
+  previous_score numeric, -- Stored self_evaluation score when the row was re-scored
+  evaluation jsonb NOT NULL,
+  created_at timestamptz DEFAULT now(),
+  PRIMARY KEY (content_type, content_id, rubric_version)
+);
+
+COMMENT ON TABLE evaluation_scores IS 'Scores of stored content re-evaluated under a given rubric version (comparable across content ages)';
+
+CREATE INDEX idx_evaluation_scores_version ON evaluation_scores(rubric_version, content_type);
 
 -- Learning insights (reflection loop outputs)
 CREATE TABLE learning_insights (
@@ -215,7 +277,8 @@ CREATE TABLE learning_insights (
   status varchar DEFAULT 'pending' CHECK (status IN ('pending', 'validated', 'applied', 'deprecated')),
   created_at timestamptz DEFAULT now(),
   validated_at timestamptz,
-  applied_at timestamptz
+  applied_at timestamptz,
+  superseded_by uuid REFERENCES learning_insights(id) -- Set when consolidation merges this row into another
 );
 
 COMMENT ON TABLE learning_insights IS 'System-generated insights from low-scoring outputs (reflection loop)';
@@ -223,6 +286,32 @@ COMMENT ON TABLE learning_insights IS 'System-generated insights from low-scorin
 CREATE INDEX idx_learning_insights_status ON learning_insights(status);
 CREATE INDEX idx_learning_insights_type ON learning_insights(insight_type);
 
+-- Insight digests (formatted learning insights per agent/grade/subject)
+CREATE TABLE insight_digests (
+  agent_type text NOT NULL, -- strategy_planner, lesson_creator, activity_creator
+  grade text NOT NULL DEFAULT '',
+  subject text NOT NULL DEFAULT '', -- '' = any subject
+  prompt_text text NOT NULL DEFAULT '', -- Ready-to-inject prompt fragment ('' = no insights)
+  token_count integer NOT NULL DEFAULT 0, -- Estimated tokens of prompt_text
+  insight_count integer NOT NULL DEFAULT 0,
+  insight_ids uuid[] DEFAULT '{}',
+  built_at timestamptz DEFAULT now(),
+  generation bigint NOT NULL DEFAULT 0, -- insight_digest_state.generation the digest was built from
+  PRIMARY KEY (agent_type, grade, subject)
+);
+
+COMMENT ON TABLE insight_digests IS 'Cleared whenever learning_insights change; rebuilt lazily per key';
+
+-- Insight digest generation (single row): bumped by every invalidation so a rebuild
+-- that started before it is discarded instead of storing a stale digest
+CREATE TABLE insight_digest_state (
+  id boolean PRIMARY KEY DEFAULT true CHECK (id),
+  generation bigint NOT NULL DEFAULT 0,
+  invalidated_at timestamptz DEFAULT now()
+);
+
+INSERT INTO insight_digest_state (id) VALUES (true);
+
 -- Platform memory (agentic memory for personalization)
 CREATE TABLE platform_memory (
   id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -239,14 +328,21 @@ CREATE TABLE platform_memory (
 
 COMMENT ON TABLE platform_memory IS 'Agentic memory: engagement patterns, learning preferences, effectiveness data';
 
-CREATE INDEX idx_platform_memory_entity ON platform_memory(entity_type, entity_id);
-CREATE INDEX idx_platform_memory_confidence ON platform_memory(confidence_score);
+-- One row per (entity, category, key): writes go through upsert_platform_memory
+CREATE UNIQUE INDEX idx_platform_memory_key ON platform_memory(entity_type, entity_id, memory_category, memory_key);
+-- Top-k reads per entity (load_student_memories)
+CREATE INDEX idx_platform_memory_entity ON platform_memory(entity_type, entity_id, confidence_score DESC);
+CREATE INDEX idx_platform_memory_updated ON platform_memory(entity_type, last_updated);
 
 -- Cross-agent learning
 CREATE TABLE cross_agent_learning (
   id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
-  pattern_detected varchar NOT NULL,
+  pattern_detected varchar NOT NULL, -- The insight itself
   contributing_agents text[] NOT NULL,
+  insight_type text, -- weakness_pattern, tutor_preference, success_pattern, contextual_insight
+  evidence jsonb DEFAULT '[]', -- Supporting evidence statements (merged on consolidation)
+  action text, -- What future generations should do
+  evidence_count integer DEFAULT 1, -- Reflection runs that produced this insight
   confidence_score numeric DEFAULT 0.5 CHECK (confidence_score >= 0 AND confidence_score <= 1),
   applications jsonb DEFAULT '[]',
   propagation_status varchar DEFAULT 'identified' CHECK (propagation_status IN ('identified', 'testing', 'validated', 'applied', 'deprecated')),
@@ -254,54 +350,298 @@ CREATE TABLE cross_agent_learning (
   created_at timestamptz DEFAULT now(),
   last_updated timestamptz DEFAULT now(),
   usage_count integer DEFAULT 0,
-  success_rate numeric DEFAULT 0.0
+  success_rate numeric DEFAULT 0.0,
+  superseded_by uuid REFERENCES cross_agent_learning(id) -- Set when consolidation merges this row into another
 );
 
 COMMENT ON TABLE cross_agent_learning IS 'Patterns learned by one agent propagated to others';
 
+CREATE INDEX idx_cross_agent_learning_status ON cross_agent_learning(propagation_status, created_at);
+
+-- Reflection watermarks (incremental reflection loop)
+CREATE TABLE reflection_watermarks (
+  agent_type text PRIMARY KEY, -- Reflection agent name (strategy_creator, lesson_creator, activity_creator)
+  last_metric_at timestamptz, -- created_at of the last analyzed agent_performance_metrics row
+  last_edit_at timestamptz, -- created_at of the last analyzed manual edit (content_versions)
+  metrics_processed integer DEFAULT 0,
+  edits_processed integer DEFAULT 0,
+  score_sum numeric DEFAULT 0, -- Running total for the baseline average in prompts
+  rubric_version text, -- Rubric of the metrics in score_sum (the baseline restarts when it changes)
+  last_run_at timestamptz,
+  last_insight_count integer DEFAULT 0
+);
+
+COMMENT ON TABLE reflection_watermarks IS 'Per-agent progress of the background reflector so each run analyzes only new evidence';
+
+-- ============================================================================
+-- BACKGROUND JOBS (durable agent pipelines)
+-- ============================================================================
+
+-- Agent jobs (strategy / lesson / activity generation run by worker processes)
+CREATE TABLE agent_jobs (
+  id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+  job_type text NOT NULL CHECK (job_type IN ('strategy', 'lesson', 'activity', 'lesson_batch', 'strategy_cohort', 'rescore', 'insight_consolidation')),
+  payload jsonb NOT NULL, -- Request body for the agent
+  status text NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'succeeded', 'failed')),
+  stage text, -- Current pipeline stage (profile, research, draft, evaluation, ...)
+  progress jsonb DEFAULT '[]', -- Stage events: [{"stage": "...", "at": "...", "detail": {...}}]
+  result jsonb, -- Same shape as the synchronous endpoint response
+  error text,
+  attempts integer DEFAULT 0,
+  max_attempts integer DEFAULT 3,
+  worker_id text,
+  heartbeat_at timestamptz,
+  available_at timestamptz DEFAULT now(), -- Queued jobs are not claimed before this (retry backoff)
+  created_at timestamptz DEFAULT now(),
+  started_at timestamptz,
+  finished_at timestamptz,
+  updated_at timestamptz DEFAULT now()
+);
+
+COMMENT ON TABLE agent_jobs IS 'Durable queue for long-running agent pipelines (claimed with FOR UPDATE SKIP LOCKED)';
+COMMENT ON COLUMN agent_jobs.heartbeat_at IS 'Refreshed by the worker; running jobs with a stale heartbeat are reclaimed';
+COMMENT ON COLUMN agent_jobs.available_at IS 'Earliest claim time of a queued job; failed attempts are requeued with exponential backoff';
+
+CREATE INDEX idx_agent_jobs_queue ON agent_jobs(status, created_at) WHERE status IN ('queued', 'running');
+
+-- Pipeline checkpoints (stage outputs keyed by request id, reused on retry/resume)
+CREATE TABLE pipeline_checkpoints (
+  request_id text NOT NULL, -- Job id or client-provided request_id
+  pipeline text NOT NULL CHECK (pipeline IN ('strategy', 'lesson', 'activity', 'rescore')),
+  stage text NOT NULL, -- DAG node name (profile, research, draft, deployment, evaluation, ...)
+  output jsonb, -- Stage output as returned by the agent step
+  created_at timestamptz DEFAULT now(),
+  PRIMARY KEY (request_id, pipeline, stage) -- Pipelines share stage names (profile, evaluate, ...)
+);
+
+COMMENT ON TABLE pipeline_checkpoints IS 'Completed agent pipeline stages; a retried run with the same request id skips them';
+
 -- ============================================================================
 -- HELPER FUNCTIONS
 -- ============================================================================
 
 -- Create content version atomically
+-- Allocates the next version number, stores the version and updates the parent
+-- strategy/lesson in a single transaction (one round trip from the API).
+DROP FUNCTION IF EXISTS create_content_version(text, uuid, jsonb, uuid, text, text);
+DROP FUNCTION IF EXISTS create_content_version(text, uuid, jsonb, uuid, text, text, text);
+
 CREATE OR REPLACE FUNCTION create_content_version(
   p_content_type text,
   p_content_id uuid,
   p_new_content jsonb,
   p_edited_by uuid,
   p_edit_type text,
-  p_edit_notes text DEFAULT NULL
-) RETURNS uuid AS $$
+  p_edit_notes text DEFAULT NULL,
+  p_changes_summary text DEFAULT NULL,
+  p_delta jsonb DEFAULT NULL, -- JSON Patch from p_base_version (NULL = store full copy)
+  p_base_version integer DEFAULT NULL,
+  p_checkpoint_interval integer DEFAULT 10
+) RETURNS jsonb AS $$
 DECLARE
   v_new_version_number integer;
   v_version_id uuid;
+  v_is_checkpoint boolean;
 BEGIN
+  -- Serialize concurrent saves of the same document so version numbers never collide
+  PERFORM pg_advisory_xact_lock(hashtext(p_content_type || ':' || p_content_id::text));
+
   -- Get next version number
   SELECT COALESCE(MAX(version_number), 0) + 1 INTO v_new_version_number
   FROM content_versions
   WHERE content_type = p_content_type AND content_id = p_content_id;
   
+  -- Keep the delta only if it was computed against the immediately previous version;
+  -- otherwise (or when a checkpoint is due) store a full copy
+  v_is_checkpoint := p_delta IS NULL
+    OR p_base_version IS DISTINCT FROM v_new_version_number - 1
+    OR (v_new_version_number - 1) % GREATEST(p_checkpoint_interval, 1) = 0;
+  
   -- Insert new version
   INSERT INTO content_versions (
-    content_type, content_id, version_number, content,
-    edited_by, edit_type, edit_notes
+    content_type, content_id, version_number, content, content_delta,
+    base_version, storage_format, content_size, changes_summary, edited_by, edit_type, edit_notes
   ) VALUES (
-    p_content_type, p_content_id, v_new_version_number, p_new_content,
-    p_edited_by, p_edit_type, p_edit_notes
+    p_content_type, p_content_id, v_new_version_number,
+    CASE WHEN v_is_checkpoint THEN p_new_content END,
+    CASE WHEN v_is_checkpoint THEN NULL ELSE p_delta END,
+    CASE WHEN v_is_checkpoint THEN NULL ELSE p_base_version END,
+    CASE WHEN v_is_checkpoint THEN 'full' ELSE 'delta' END,
+    octet_length(p_new_content::text),
+    p_changes_summary, p_edited_by, p_edit_type, p_edit_notes
   ) RETURNING id INTO v_version_id;
   
-  -- Update parent table
+  -- Update parent table (latest content + version pointer)
   IF p_content_type = 'strategy' THEN
     UPDATE strategies 
-    SET current_version = v_new_version_number, updated_at = now()
+    SET current_version = v_new_version_number, content = p_new_content, updated_at = now()
     WHERE id = p_content_id;
   ELSIF p_content_type = 'lesson' THEN
     UPDATE lessons 
-    SET current_version = v_new_version_number, updated_at = now()
+    SET current_version = v_new_version_number, content = p_new_content, updated_at = now()
     WHERE id = p_content_id;
   END IF;
   
-  RETURN v_version_id;
+  RETURN jsonb_build_object(
+    'id', v_version_id,
+    'version_number', v_new_version_number,
+    'storage_format', CASE WHEN v_is_checkpoint THEN 'full' ELSE 'delta' END
+  );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Upsert a platform memory
+-- Repeats of the same (entity, category, key) update the existing row (update_count,
+-- last_updated) instead of appending. p_accumulate holds numeric fields that are added
+-- to the stored values (counters, totals) atomically, so concurrent writers never
+-- lose increments.
+CREATE OR REPLACE FUNCTION upsert_platform_memory(
+  p_entity_type text,
+  p_entity_id uuid,
+  p_memory_category text,
+  p_memory_key text,
+  p_memory_value jsonb,
+  p_confidence_score numeric DEFAULT 0.5,
+  p_accumulate jsonb DEFAULT '{}'::jsonb
+) RETURNS jsonb AS $$
+DECLARE
+  v_id uuid;
+  v_update_count integer;
+BEGIN
+  INSERT INTO platform_memory AS m (
+    entity_type, entity_id, memory_category, memory_key, memory_value, confidence_score
+  ) VALUES (
+    p_entity_type, p_entity_id, p_memory_category, p_memory_key,
+    p_memory_value || COALESCE(p_accumulate, '{}'::jsonb), p_confidence_score
+  )
+  ON CONFLICT (entity_type, entity_id, memory_category, memory_key) DO UPDATE SET
+    memory_value = m.memory_value || p_memory_value || COALESCE((
+      SELECT jsonb_object_agg(a.key, COALESCE((m.memory_value->>a.key)::numeric, 0) + a.value::numeric)
+      FROM jsonb_each_text(COALESCE(p_accumulate, '{}'::jsonb)) a
+    ), '{}'::jsonb),
+    confidence_score = EXCLUDED.confidence_score,
+    update_count = m.update_count + 1,
+    last_updated = now()
+  RETURNING id, update_count INTO v_id, v_update_count;
+
+  RETURN jsonb_build_object('id', v_id, 'update_count', v_update_count);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Invalidate every insight digest
+-- Bumps the generation and clears the digests in one transaction; returns the new generation.
+CREATE OR REPLACE FUNCTION invalidate_insight_digests() RETURNS bigint AS $$
+DECLARE
+  v_generation bigint;
+BEGIN
+  UPDATE insight_digest_state
+  SET generation = generation + 1,
+      invalidated_at = now()
+  WHERE id
+  RETURNING generation INTO v_generation;
+
+  DELETE FROM insight_digests;
+  RETURN v_generation;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Store a rebuilt insight digest unless digests were invalidated since the rebuild began
+-- The share lock on the state row orders this against invalidate_insight_digests: either
+-- the invalidation waits and then deletes this row, or this sees the bumped generation.
+CREATE OR REPLACE FUNCTION store_insight_digest(
+  p_agent_type text,
+  p_grade text,
+  p_subject text,
+  p_prompt_text text,
+  p_token_count integer,
+  p_insight_count integer,
+  p_insight_ids uuid[],
+  p_generation bigint
+) RETURNS boolean AS $$
+DECLARE
+  v_generation bigint;
+BEGIN
+  SELECT generation INTO v_generation FROM insight_digest_state WHERE id FOR SHARE;
+  IF v_generation IS DISTINCT FROM p_generation THEN
+    RETURN false;
+  END IF;
+
+  INSERT INTO insight_digests (
+    agent_type, grade, subject, prompt_text, token_count, insight_count, insight_ids, built_at, generation
+  ) VALUES (
+    p_agent_type, p_grade, p_subject, p_prompt_text, p_token_count, p_insight_count,
+    COALESCE(p_insight_ids, '{}'), now(), p_generation
+  )
+  ON CONFLICT (agent_type, grade, subject) DO UPDATE SET
+    prompt_text = EXCLUDED.prompt_text,
+    token_count = EXCLUDED.token_count,
+    insight_count = EXCLUDED.insight_count,
+    insight_ids = EXCLUDED.insight_ids,
+    built_at = EXCLUDED.built_at,
+    generation = EXCLUDED.generation;
+  RETURN true;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Claim the oldest available job for a worker
+-- Queued jobs whose backoff has elapsed, and running jobs whose worker stopped heartbeating, are eligible.
+-- SKIP LOCKED lets any number of workers poll concurrently without blocking.
+CREATE OR REPLACE FUNCTION claim_agent_job(
+  p_worker_id text,
+  p_job_types text[] DEFAULT NULL,
+  p_stale_after_seconds integer DEFAULT 300
+) RETURNS SETOF agent_jobs AS $$
+BEGIN
+  -- Give up on stale jobs that have used all their attempts
+  UPDATE agent_jobs
+  SET status = 'failed',
+      error = COALESCE(error, 'Worker lost heartbeat after final attempt'),
+      finished_at = now(),
+      updated_at = now()
+  WHERE status = 'running'
+    AND attempts >= max_attempts
+    AND heartbeat_at < now() - make_interval(secs => p_stale_after_seconds);
+
+  RETURN QUERY
+  UPDATE agent_jobs
+  SET status = 'running',
+      worker_id = p_worker_id,
+      attempts = attempts + 1,
+      heartbeat_at = now(),
+      started_at = COALESCE(started_at, now()),
+      updated_at = now()
+  WHERE id = (
+    SELECT id FROM agent_jobs
+    WHERE (
+        (status = 'queued' AND COALESCE(available_at, created_at) <= now())
+        OR (status = 'running' AND heartbeat_at < now() - make_interval(secs => p_stale_after_seconds))
+      )
+      AND attempts < max_attempts
+      AND (p_job_types IS NULL OR job_type = ANY(p_job_types))
+    ORDER BY created_at
+    FOR UPDATE SKIP LOCKED
+    LIMIT 1
+  )
+  RETURNING *;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Record a pipeline stage for a job (appends to progress and refreshes the heartbeat)
+CREATE OR REPLACE FUNCTION record_agent_job_stage(
+  p_job_id uuid,
+  p_worker_id text,
+  p_stage text,
+  p_detail jsonb DEFAULT NULL
+) RETURNS void AS $$
+BEGIN
+  UPDATE agent_jobs
+  SET stage = p_stage,
+      progress = COALESCE(progress, '[]'::jsonb) || jsonb_build_array(
+        jsonb_build_object('stage', p_stage, 'at', now(), 'detail', p_detail)
+      ),
+      heartbeat_at = now(),
+      updated_at = now()
+  WHERE id = p_job_id AND worker_id = p_worker_id AND status = 'running';
 END;
 $$ LANGUAGE plpgsql;
 
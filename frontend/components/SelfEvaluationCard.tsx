@@ -13,6 +13,7 @@ interface SelfEvaluationProps {
     };
     weaknesses?: string[];
     improvements?: string[];
+    estimated?: boolean;  // Heuristic estimate from structural signals (no LLM review)
   };
   agentName?: string;
 }
@@ -41,7 +42,9 @@ export function SelfEvaluationCard({ evaluation, agentName = "AI Agent" }: SelfE
         </div>
         <div>
         <h2 className="text-2xl font-bold text-gray-900">{agentName} Self-Evaluation</h2>
-        <p className="text-sm text-gray-500">AI agent's self-assessment</p>
+        <p className="text-sm text-gray-500">
+          {evaluation.estimated ? 'Estimated from structural checks (not reviewed by the AI)' : "AI agent's self-assessment"}
+        </p>
         </div>
       </div>
 
@@ -16,6 +16,8 @@ export function VersionHistory({ contentType, contentId }: VersionHistoryProps)
   const [versions, setVersions] = useState<Version[]>([]);
   const [loading, setLoading] = useState(true);
   const [selectedVersion, setSelectedVersion] = useState<Version | null>(null);
+  const [loadingContent, setLoadingContent] = useState(false);
+  const [contentCache, setContentCache] = useState<Record<number, Record<string, unknown>>>({});
 
   useEffect(() => {
     const loadVersions = async () => {
@@ -34,6 +36,28 @@ export function VersionHistory({ contentType, contentId }: VersionHistoryProps)
     loadVersions();
   }, [contentType, contentId]);
 
+  // List is metadata-only; fetch a version's content the first time it is opened
+  const selectVersion = async (version: Version) => {
+    setSelectedVersion(version);
+    if (contentCache[version.version_number]) return;
+
+    setLoadingContent(true);
+    try {
+      const api = contentType === 'strategy' ? strategyApi : lessonApi;
+      const response = await api.getVersionContent(contentId, version.version_number);
+      if (response.success) {
+        setContentCache((cache) => ({
+          ...cache,
+          [version.version_number]: response.version.content,
+        }));
+      }
+    } catch (error) {
+      console.error('Failed to load version content:', error);
+    } finally {
+      setLoadingContent(false);
+    }
+  };
+
   if (loading) {
     return (
       <div className="mt-8 p-6 bg-white rounded-lg shadow-lg border border-gray-200">
@@ -71,7 +95,7 @@ export function VersionHistory({ contentType, contentId }: VersionHistoryProps)
             className={`p-4 hover:bg-gray-50 cursor-pointer transition-colors ${
               selectedVersion?.version_number === version.version_number ? 'bg-blue-50' : ''
             }`}
-            onClick={() => setSelectedVersion(version)}
+            onClick={() => selectVersion(version)}
           >
             <div className="flex items-start justify-between">
               <div className="flex-1">
@@ -143,9 +167,13 @@ export function VersionHistory({ contentType, contentId }: VersionHistoryProps)
             Version {selectedVersion.version_number} Content Preview
           </h4>
           <div className="bg-white p-4 rounded border border-gray-200 max-h-96 overflow-auto">
-            <pre className="text-sm text-gray-700 whitespace-pre-wrap">
-              {JSON.stringify(selectedVersion.content, null, 2)}
-            </pre>
+            {loadingContent && !contentCache[selectedVersion.version_number] ? (
+              <p className="text-sm text-gray-500">Loading content...</p>
+            ) : (
+              <pre className="text-sm text-gray-700 whitespace-pre-wrap">
+                {JSON.stringify(contentCache[selectedVersion.version_number], null, 2)}
+              </pre>
+            )}
           </div>
         </div>
       )}
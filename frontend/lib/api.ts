@@ -10,6 +10,52 @@ export const api = axios.create({
   },
 });
 
+// Agent endpoints enqueue a background job; poll until the pipeline finishes
+export const jobApi = {
+  get: async (jobId: string) => {
+    const response = await api.get(`/api/v1/jobs/${jobId}`);
+    return response.data;
+  },
+
+  // Rejects once timeoutMs passes (e.g. the job sits in 'queued' because no worker is running)
+  waitForResult: async (jobId: string, intervalMs = 2000, timeoutMs = 15 * 60 * 1000) => {
+    const deadline = Date.now() + timeoutMs;
+    for (;;) {
+      const { job } = await jobApi.get(jobId);
+      if (job.status === 'succeeded') return job.result;
+      if (job.status === 'failed') throw new Error(job.error || 'Generation failed');
+      if (Date.now() + intervalMs > deadline) {
+        const minutes = Math.round(timeoutMs / 60000);
+        throw new Error(
+          job.status === 'queued'
+            ? `Job ${jobId} was not picked up within ${minutes} min - is a job worker running?`
+            : `Job ${jobId} did not finish within ${minutes} min (status: ${job.status})`
+        );
+      }
+      await new Promise((resolve) => setTimeout(resolve, intervalMs));
+    }
+  },
+
+  // Server-Sent Events: calls onStage for each progress entry, resolves with the result
+  stream: (
+    jobId: string,
+    onStage: (entry: { stage: string; at: string; detail?: Record<string, unknown> | null }) => void
+  ) =>
+    new Promise<any>((resolve, reject) => {
+      const source = new EventSource(`${API_URL}/api/v1/jobs/${jobId}/stream`);
+      source.addEventListener('stage', (event) => onStage(JSON.parse((event as MessageEvent).data)));
+      source.addEventListener('result', (event) => {
+        source.close();
+        resolve(JSON.parse((event as MessageEvent).data));
+      });
+      source.addEventListener('error', (event) => {
+        source.close();
+        const data = (event as MessageEvent).data;
+        reject(new Error(data ? JSON.parse(data).error : 'Generation stream failed'));
+      });
+    }),
+};
+
 // Database queries for dropdowns
 export const dataApi = {
   getStudents: async () => {
@@ -48,7 +94,24 @@ export const strategyApi = {
     weeks: number;
   }) => {
     const response = await api.post('/api/v1/agents/strategy', data);
-    return response.data;
+    return jobApi.waitForResult(response.data.job_id);
+  },
+
+  // Strategies for several students with shared research; onStrategy fires per student
+  createForCohort: async (
+    data: {
+      student_ids: string[];
+      tutor_id: string;
+      subject: string;
+      weeks?: number;
+      concurrency?: number;
+    },
+    onStrategy?: (strategy: Record<string, unknown>) => void
+  ) => {
+    const response = await api.post('/api/v1/agents/strategy/cohort', data);
+    return jobApi.stream(response.data.job_id, (entry) => {
+      if (entry.stage === 'strategy_completed' && entry.detail && onStrategy) onStrategy(entry.detail);
+    });
   },
   
   getVersions: async (strategyId: string) => {
@@ -56,6 +119,25 @@ export const strategyApi = {
     return response.data;
   },
   
+  getSaveStatus: async (strategyId: string, tutorId?: string) => {
+    const response = await api.get(`/api/v1/content/save-status/strategy/${strategyId}`, {
+      params: { tutor_id: tutorId },
+    });
+    return response.data;
+  },
+  
+  getVersionContent: async (strategyId: string, versionNumber: number) => {
+    const response = await api.get(`/api/v1/content/versions/strategy/${strategyId}/${versionNumber}`);
+    return response.data;
+  },
+  
+  getVersionDiff: async (strategyId: string, fromVersion: number, toVersion: number) => {
+    const response = await api.get(`/api/v1/content/versions/strategy/${strategyId}/diff`, {
+      params: { from_version: fromVersion, to_version: toVersion },
+    });
+    return response.data;
+  },
+  
   saveVersion: async (data: {
     content_type: string;
     content_id: string;
@@ -79,7 +161,24 @@ export const lessonApi = {
     strategy_week_number?: number;
   }) => {
     const response = await api.post('/api/v1/agents/lesson', data);
-    return response.data;
+    return jobApi.waitForResult(response.data.job_id);
+  },
+
+  // Generate every week of a strategy; onLesson fires as each week completes
+  createForStrategy: async (
+    data: {
+      strategy_id: string;
+      tutor_id?: string;
+      duration?: number;
+      include_activities?: boolean;
+      concurrency?: number;
+    },
+    onLesson?: (lesson: Record<string, unknown>) => void
+  ) => {
+    const response = await api.post('/api/v1/agents/lessons/batch', data);
+    return jobApi.stream(response.data.job_id, (entry) => {
+      if (entry.stage === 'lesson_completed' && entry.detail && onLesson) onLesson(entry.detail);
+    });
   },
   
   getVersions: async (lessonId: string) => {
@@ -87,6 +186,25 @@ export const lessonApi = {
     return response.data;
   },
   
+  getSaveStatus: async (lessonId: string, tutorId?: string) => {
+    const response = await api.get(`/api/v1/content/save-status/lesson/${lessonId}`, {
+      params: { tutor_id: tutorId },
+    });
+    return response.data;
+  },
+  
+  getVersionContent: async (lessonId: string, versionNumber: number) => {
+    const response = await api.get(`/api/v1/content/versions/lesson/${lessonId}/${versionNumber}`);
+    return response.data;
+  },
+  
+  getVersionDiff: async (lessonId: string, fromVersion: number, toVersion: number) => {
+    const response = await api.get(`/api/v1/content/versions/lesson/${lessonId}/diff`, {
+      params: { from_version: fromVersion, to_version: toVersion },
+    });
+    return response.data;
+  },
+  
   saveVersion: async (data: {
     content_type: string;
     content_id: string;
@@ -112,7 +230,7 @@ export const activityApi = {
     max_attempts?: number;
   }) => {
     const response = await api.post('/api/v1/agents/activity', data);
-    return response.data;
+    return jobApi.waitForResult(response.data.job_id);
   },
   
   redeploy: async (data: {
@@ -69,7 +69,8 @@ export interface LessonResponse {
 
 export interface ContentVersion {
   version_number: number;
-  content: Record<string, unknown>;
+  content?: Record<string, unknown>;  // Only present when fetched on demand
+  content_size?: number;
   changes_summary?: string;
   edit_type: string;
   edit_notes?: string;